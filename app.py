@@ -1,15 +1,48 @@
-from flask import Flask, render_template, request, jsonify
+import time
+STARTUP_STARTED_AT = time.perf_counter()  # Référence du rapport de démarrage
+
+from flask import Flask, render_template, request, jsonify, make_response, send_from_directory
 from flask_cors import CORS
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from langchain_mcp_adapters.tools import load_mcp_tools
-from langgraph.prebuilt import create_react_agent
-from langchain_anthropic import ChatAnthropic
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 import asyncio
+import json
 import os
 import logging
+import re
+import threading
+import unicodedata
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import gzip
+import hashlib
+import hmac
+import itertools
+import math
+import queue
+import secrets
+import signal
+import socket
+import sqlite3
+import sys
+import tracemalloc
+import urllib.error
+import urllib.request
+import weakref
+import zlib
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+try:
+    import brotli  # Optionnel : compression brotli si le module est installé
+except ImportError:
+    brotli = None
+
+# Durées des phases de démarrage (secondes depuis le lancement du processus Python)
+startup_timings = {'imports': round(time.perf_counter() - STARTUP_STARTED_AT, 3)}
 
 load_dotenv()
 
@@ -20,27 +53,72 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Permettre les requêtes cross-origin
 
+# Répertoire des données persistantes (FAQ pré-calculées, etc.)
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+
+# Bibliothèques de l'agent, importées à la demande (voir load_agent_libraries) :
+# leur import prend plusieurs secondes et n'est pas nécessaire aux routes statiques
+ClientSession = StdioServerParameters = stdio_client = load_mcp_tools = anthropic = None
+create_react_agent = GraphRecursionError = HumanMessage = SystemMessage = StructuredTool = ToolException = ChatAnthropic = None
+AGENT_PRELOAD = os.getenv('AGENT_PRELOAD', 'true').lower() == 'true'  # Import en tâche de fond au démarrage
+agent_libraries_lock = threading.Lock()
+
 # Configuration du modèle
-model = ChatAnthropic(
-    model="claude-3-5-sonnet-20240620",
-    max_tokens=6000,  # Limite la réponse à 6000 tokens
-    temperature=0.1,  # Réponses plus précises  
-    timeout=60.0      # Timeout après 60 secondes
-)
+MODEL_CONFIG = {
+    'model': "claude-3-5-sonnet-20240620",
+    'max_tokens': 6000,  # Limite la réponse à 6000 tokens
+    'temperature': 0.1,  # Réponses plus précises  
+    'timeout': 60.0,     # Timeout après 60 secondes
+    'max_retries': int(os.getenv('ANTHROPIC_MAX_RETRIES', 2))  # Nouvelles tentatives d'un appel (respectent retry-after)
+}
+model = None  # Instancié par get_model()
+MAX_STEP_RETRIES = int(os.getenv('MAX_STEP_RETRIES', 2))  # Reprises d'une étape de l'agent après une erreur passagère du modèle
 
-server_params = StdioServerParameters(
-    command="npx",
-    env={
-        "API_TOKEN": os.getenv("API_TOKEN"),
-        "BROWSER_AUTH": os.getenv("BROWSER_AUTH"),
-        "WEB_UNLOCKER_ZONE": os.getenv("WEB_UNLOCKER_ZONE"),
-        "NPM_CONFIG_LOGLEVEL": "silent",  # Logs npm complètement silencieux
-        "NPM_CONFIG_AUDIT": "false",      # Désactiver l'audit
-        "NPM_CONFIG_FUND": "false",       # Désactiver les messages de financement
-        "NPM_CONFIG_PROGRESS": "false",   # Désactiver la barre de progression
-    },
-    args=["--yes", "--silent", "--no-audit", "--no-fund", "--no-progress", "@brightdata/mcp@2.4.1"],
-)
+# Serveur MCP BrightData : binaire préinstallé (MCP_SERVER_BIN ou node_modules) plutôt que `npx --yes`
+MCP_SERVER_PACKAGE = '@brightdata/mcp@2.4.1'
+MCP_SERVER_BIN = os.getenv('MCP_SERVER_BIN')
+MCP_SERVER_ENV = {
+    "API_TOKEN": os.getenv("API_TOKEN"),
+    "BROWSER_AUTH": os.getenv("BROWSER_AUTH"),
+    "WEB_UNLOCKER_ZONE": os.getenv("WEB_UNLOCKER_ZONE"),
+    "NPM_CONFIG_LOGLEVEL": "silent",  # Logs npm complètement silencieux
+    "NPM_CONFIG_AUDIT": "false",      # Désactiver l'audit
+    "NPM_CONFIG_FUND": "false",       # Désactiver les messages de financement
+    "NPM_CONFIG_PROGRESS": "false",   # Désactiver la barre de progression
+}
+server_params = None  # Construit par get_server_params()
+
+# Pool de sessions MCP maintenues ouvertes entre les requêtes (0 = une session par requête)
+MCP_POOL_SIZE = int(os.getenv('MCP_POOL_SIZE', 2))
+MCP_POOL_ACQUIRE_TIMEOUT = float(os.getenv('MCP_POOL_ACQUIRE_TIMEOUT', 20))  # Attente max d'une session libre
+MCP_POOL_RETRY_DELAY = int(os.getenv('MCP_POOL_RETRY_DELAY', 15))  # Délai avant de rouvrir une session en échec
+
+# Supervision des processus MCP (npx/node) : plafond de sessions, limites par session, orphelins
+MCP_MAX_CHILDREN = int(os.getenv('MCP_MAX_CHILDREN', MCP_POOL_SIZE + 4))  # Sessions (arbres de processus) simultanées
+MCP_CHILD_MAX_RSS_MB = int(os.getenv('MCP_CHILD_MAX_RSS_MB', 512))  # Mémoire max des processus d'une session
+MCP_CHILD_MAX_LIFETIME = int(os.getenv('MCP_CHILD_MAX_LIFETIME', 3600))  # Durée de vie max d'une session (secondes)
+MCP_SUPERVISOR_INTERVAL = int(os.getenv('MCP_SUPERVISOR_INTERVAL', 30))  # Période des vérifications
+MCP_SUPERVISOR_ENV_VAR = 'ASSISTANT_MCP_SESSION'  # Marque héritée par les processus de chaque session
+
+# Navigateurs distants (scraping_browser_*) gardés ouverts dans les sessions du pool, par site de référence
+BROWSER_SESSION_MAX_AGE = int(os.getenv('BROWSER_SESSION_MAX_AGE', 900))  # Réinitialisation périodique du navigateur
+BROWSER_MAX_CONTEXTS = int(os.getenv('BROWSER_MAX_CONTEXTS', MCP_POOL_SIZE))  # Navigateurs ouverts simultanément
+BROWSER_PAGE_REUSE_TTL = int(os.getenv('BROWSER_PAGE_REUSE_TTL', 300))  # Page d'arrivée resservie sans nouveau chargement
+
+# Préchauffage déclenché par l'interface web (choix d'une catégorie, début de saisie)
+PREWARM_ENABLED = os.getenv('PREWARM_ENABLED', 'true').lower() == 'true'
+PREWARM_INTERVAL = int(os.getenv('PREWARM_INTERVAL', 120))  # Une même catégorie est préchauffée au plus une fois par intervalle
+PREWARM_MAX_PAGES = int(os.getenv('PREWARM_MAX_PAGES', 3))  # Pages des sites de référence récupérées à l'avance
+
+# Sondes de disponibilité (/readyz)
+READINESS_CACHE_TTL = int(os.getenv('READINESS_CACHE_TTL', 30))  # Durée de validité d'un résultat de sonde
+READINESS_MAX_QUEUE = int(os.getenv('READINESS_MAX_QUEUE', 10))  # Au-delà, l'instance se retire du trafic
+ANTHROPIC_MODELS_URL = 'https://api.anthropic.com/v1/models?limit=1'
+
+# Disjoncteurs BrightData / Anthropic et mode dégradé
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))  # Échecs consécutifs avant ouverture
+CIRCUIT_RESET_TIMEOUT = int(os.getenv('CIRCUIT_RESET_TIMEOUT', 60))  # Secondes avant un essai de rétablissement
+DEGRADED_MODE_ENABLED = os.getenv('DEGRADED_MODE_ENABLED', 'true').lower() == 'true'  # Réponse sans outils pendant une panne BrightData
 
 # Configuration des sites de référence par thématique
 REFERENCE_SITES = {
@@ -108,7 +186,7 @@ Tu aides les personnes qui viennent d'arriver sur diverses thématiques :
 
 RÈGLES IMPORTANTES :
 1. Réponds toujours en français, de manière claire et accessible
-2. OBLIGATOIRE : Cite TOUJOURS tes sources à la fin de chaque réponse
+2. Les sources consultées sont ajoutées automatiquement à la fin de ta réponse : ne rédige PAS de section « Sources »
 3. OBLIGATOIRE : Formate ta réponse en Markdown structuré et propre
 4. Propose des actions concrètes et des liens SPÉCIFIQUES (pas génériques)
 5. Donne des informations DÉTAILLÉES extraites du contenu scraped
@@ -126,7 +204,7 @@ FORMAT MARKDOWN OBLIGATOIRE :
 - Utilise > pour les citations importantes
 - Utilise des tableaux | si nécessaire
 - Utilise des émojis pour rendre visuellement agréable
-- Structure logique : Titre principal → Sous-sections → Étapes → Sources
+- Structure logique : Titre principal → Sous-sections → Étapes → Points importants
 
 EXEMPLE DE STRUCTURE MARKDOWN :
 ```markdown
@@ -145,11 +223,6 @@ EXEMPLE DE STRUCTURE MARKDOWN :
 ## ⚠️ Points importants
 
 > **Attention** : Information cruciale à retenir
-
-## 📚 Sources consultées
-
-- [Nom PRÉCIS du document](URL-complète)
-- [Autre source spécifique](URL-directe)
 ```
 
 EXEMPLES de bons liens :
@@ -184,158 +257,381 @@ EXEMPLE WORKFLOW STANDARD :
 - Étape 4: Extraire les informations détaillées et formater la réponse
 """
 
-async def get_agent_response(user_message, context=None, category=None, max_retries=3):
-    """Fonction pour obtenir la réponse de l'agent avec retry automatique"""
+# Prompt pour la base de connaissances locale
+KNOWLEDGE_PROMPT = """
+
+BASE DE CONNAISSANCES LOCALE :
+1. 📚 AVANT toute autre recherche, utilise search_local_knowledge avec les mots-clés de la question
+2. ✅ Si les passages retournés répondent précisément à la question, réponds à partir de ces passages en citant leurs URLs
+3. 🌐 Sinon (sujet absent, passages incomplets ou trop anciens), applique la méthode de recherche ci-dessous
+"""
+
+# Questions fréquentes pré-calculées par catégorie
+FAQ_QUESTIONS = {
+    'sante': [
+        'Comment obtenir une carte vitale ?',
+        'Comment m\'inscrire à la sécurité sociale ?',
+        'Comment déclarer un médecin traitant ?'
+    ],
+    'logement': [
+        'Comment obtenir des aides au logement ?',
+        'Comment faire une demande d\'APL à la CAF ?',
+        'Quels documents fournir pour louer un logement ?'
+    ],
+    'administratif': [
+        'Comment obtenir un titre de séjour ?',
+        'Comment renouveler mon titre de séjour ?',
+        'Comment prendre rendez-vous en préfecture ?'
+    ],
+    'juridique': [
+        'Comment obtenir l\'aide juridictionnelle ?',
+        'Quels sont mes droits en tant que locataire ?'
+    ],
+    'emploi': [
+        'Comment m\'inscrire à France Travail ?',
+        'Ai-je le droit de travailler avec mon titre de séjour ?'
+    ],
+    'education': [
+        'Comment inscrire mon enfant à l\'école ?',
+        'Comment faire reconnaître mon diplôme étranger ?'
+    ],
+    'transport': [
+        'Comment échanger mon permis de conduire étranger ?',
+        'Comment obtenir un abonnement aux transports en commun ?'
+    ],
+    'finances': [
+        'Comment ouvrir un compte bancaire en France ?',
+        'Comment faire ma première déclaration d\'impôts ?'
+    ]
+}
+
+# Configuration du pré-calcul des FAQ
+FAQ_REFRESH_ENABLED = os.getenv('FAQ_REFRESH_ENABLED', 'true').lower() == 'true'
+FAQ_REFRESH_INTERVAL = int(os.getenv('FAQ_REFRESH_INTERVAL', 24 * 3600))  # Secondes entre deux rafraîchissements
+FAQ_CONFIG_PATH = os.getenv('FAQ_CONFIG_PATH')  # Fichier JSON optionnel {catégorie: [questions]}
+FAQ_STORE_PATH = os.path.join(DATA_DIR, 'faq_store.json')
+
+# Configuration du cache des réponses
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 6 * 3600))  # Durée de vie d'une réponse en secondes
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 500))  # Limite du backend en mémoire
+ANSWER_CACHE_RETENTION = int(os.getenv('ANSWER_CACHE_RETENTION', 7 * 24 * 3600))  # Conservation (réponse de secours)
+# Au-delà de ANSWER_CACHE_TTL et jusqu'à ANSWER_CACHE_STALE_TTL, la réponse est servie (`stale`) pendant son rafraîchissement
+ANSWER_CACHE_STALE_TTL = int(os.getenv('ANSWER_CACHE_STALE_TTL', 3 * 24 * 3600))
+ANSWER_REFRESH_CONCURRENCY = int(os.getenv('ANSWER_REFRESH_CONCURRENCY', 2))  # Rafraîchissements simultanés au plus
+
+# Cache partagé : backend (memory, sqlite ou redis), espace de noms et compression
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory').lower()
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_SQLITE_PATH = os.path.join(DATA_DIR, 'cache.sqlite')
+CACHE_NAMESPACE = os.getenv('CACHE_NAMESPACE', 'assistant')
+CACHE_COMPRESS_MIN_SIZE = int(os.getenv('CACHE_COMPRESS_MIN_SIZE', 1024))  # Octets au-delà desquels zlib est utilisé
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 6 * 3600))  # Pages récupérées par les outils (0 = désactivé)
+
+# Budget d'exécution de l'agent par catégorie (appels d'outils, octets récupérés, durée)
+AGENT_BUDGETS = {
+    'default': {
+        'max_tool_calls': int(os.getenv('AGENT_MAX_TOOL_CALLS', 10)),
+        'max_scraped_bytes': int(os.getenv('AGENT_MAX_SCRAPED_BYTES', 400_000)),
+        'max_seconds': int(os.getenv('AGENT_MAX_SECONDS', 90))
+    },
+    'logement': {
+        'max_tool_calls': 12  # Navigation en plusieurs clics sur le site de référence
+    }
+}
+
+# Base de connaissances locale (passages extraits des pages et des réponses)
+KNOWLEDGE_ENABLED = os.getenv('KNOWLEDGE_ENABLED', 'true').lower() == 'true'
+KNOWLEDGE_DB_PATH = os.path.join(DATA_DIR, 'knowledge.sqlite')
+KNOWLEDGE_TOP_K = int(os.getenv('KNOWLEDGE_TOP_K', 5))  # Passages renvoyés par recherche
+KNOWLEDGE_MIN_SCORE = float(os.getenv('KNOWLEDGE_MIN_SCORE', 0.15))  # Similarité minimale
+KNOWLEDGE_VECTOR_DIM = 2 ** 18  # Dimension des vecteurs creux (hachage des termes)
+
+# Restreindre les outils MCP à ceux prévus par le prompt de la catégorie
+TOOL_PRUNING_ENABLED = os.getenv('TOOL_PRUNING_ENABLED', 'true').lower() == 'true'
+
+# Formats de réponse acceptés par /api/chat
+RESPONSE_FORMATS = ('markdown', 'structured')
+
+# Configuration du cache HTTP et de la compression
+STATIC_CACHE_MAX_AGE = int(os.getenv('STATIC_CACHE_MAX_AGE', 3600))  # Cache navigateur/CDN des métadonnées
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # Taille minimale (octets) pour compresser
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+# Configuration de la surveillance des sites sources
+SITE_WATCH_ENABLED = os.getenv('SITE_WATCH_ENABLED', 'true').lower() == 'true'
+SITE_WATCH_INTERVAL = int(os.getenv('SITE_WATCH_INTERVAL', 3600))  # Secondes entre deux vérifications
+SITE_WATCH_TOP_SOURCES = int(os.getenv('SITE_WATCH_TOP_SOURCES', 20))  # Sources les plus citées à surveiller
+SITE_WATCH_STATE_PATH = os.path.join(DATA_DIR, 'site_watch.json')
+
+# Journal d'usage (une ligne JSON par requête de chat, exploité par usage_report.py)
+USAGE_LOG_ENABLED = os.getenv('USAGE_LOG_ENABLED', 'true').lower() == 'true'
+USAGE_LOG_PATH = os.path.join(DATA_DIR, 'usage.jsonl')
+USAGE_LOG_MAX_BYTES = int(os.getenv('USAGE_LOG_MAX_BYTES', 50 * 1024 * 1024))  # Au-delà, renommé en usage.jsonl.1
+
+# Profilage à la demande d'une exécution de l'agent (désactivé sans PROFILING_TOKEN)
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')  # Jeton des en-têtes X-Profile et X-Admin-Token
+PROFILES_DIR = os.path.join(DATA_DIR, 'profiles')
+PROFILES_MAX = int(os.getenv('PROFILES_MAX', 20))  # Profils conservés sur disque
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))  # Période d'échantillonnage CPU
+PROFILE_TRACEMALLOC = os.getenv('PROFILE_TRACEMALLOC', 'true').lower() == 'true'  # Suivi des allocations
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', 5))
+PROFILE_TOP = 25  # Lignes des classements (fonctions, allocations)
+PROFILE_MAX_PAYLOADS = 10  # Sorties d'outils les plus volumineuses conservées
+
+def load_agent_libraries():
+    """Importe les bibliothèques de l'agent (MCP, LangGraph, LangChain) au premier besoin"""
+    global ClientSession, StdioServerParameters, stdio_client, load_mcp_tools, anthropic
+    global create_react_agent, GraphRecursionError, HumanMessage, SystemMessage, StructuredTool, ToolException, ChatAnthropic
+    if ChatAnthropic is not None:
+        return
+    with agent_libraries_lock:
+        if ChatAnthropic is not None:
+            return
+        started = time.perf_counter()
+        from mcp import ClientSession as _ClientSession, StdioServerParameters as _StdioServerParameters
+        from mcp.client.stdio import stdio_client as _stdio_client
+        from langchain_mcp_adapters.tools import load_mcp_tools as _load_mcp_tools
+        from langgraph.prebuilt import create_react_agent as _create_react_agent
+        from langgraph.errors import GraphRecursionError as _GraphRecursionError
+        from langchain_core.messages import HumanMessage as _HumanMessage, SystemMessage as _SystemMessage
+        from langchain_core.tools import StructuredTool as _StructuredTool, ToolException as _ToolException
+        from langchain_anthropic import ChatAnthropic as _ChatAnthropic
+        import anthropic as _anthropic
+        ClientSession, StdioServerParameters, stdio_client = _ClientSession, _StdioServerParameters, _stdio_client
+        load_mcp_tools, create_react_agent, GraphRecursionError = _load_mcp_tools, _create_react_agent, _GraphRecursionError
+        HumanMessage, SystemMessage, StructuredTool, ToolException = _HumanMessage, _SystemMessage, _StructuredTool, _ToolException
+        ChatAnthropic, anthropic = _ChatAnthropic, _anthropic
+        startup_timings['agent_libraries'] = round(time.perf_counter() - started, 3)
+        logger.info(f"📦 Bibliothèques de l'agent chargées en {startup_timings['agent_libraries']}s")
+
+def get_model():
+    """Modèle Claude partagé (créé au premier appel)"""
+    global model
+    if model is None:
+        load_agent_libraries()
+        model = ChatAnthropic(**MODEL_CONFIG)
+    return model
+
+def resolve_mcp_server_command():
+    """Commande du serveur MCP : MCP_SERVER_BIN, paquet installé dans node_modules, ou `npx --yes` en dernier recours"""
+    if MCP_SERVER_BIN:
+        if MCP_SERVER_BIN.endswith('.js'):
+            return 'node', [MCP_SERVER_BIN]
+        return MCP_SERVER_BIN, []
+    
+    package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node_modules', '@brightdata', 'mcp')
+    try:
+        with open(os.path.join(package_dir, 'package.json'), encoding='utf-8') as f:
+            package = json.load(f)
+        entry = package.get('bin')
+        if isinstance(entry, dict):
+            entry = next(iter(entry.values()), None)
+        if entry:
+            return 'node', [os.path.join(package_dir, entry)]
+    except (OSError, ValueError):
+        pass
+    
+    logger.warning(f"⚠️ Serveur MCP non préinstallé, résolution par npx à chaque lancement (npm install {MCP_SERVER_PACKAGE})")
+    return 'npx', ["--yes", "--silent", "--no-audit", "--no-fund", "--no-progress", MCP_SERVER_PACKAGE]
+
+def get_server_params():
+    """Paramètres de lancement du serveur MCP BrightData (résolus une seule fois)"""
+    global server_params
+    if server_params is None:
+        load_agent_libraries()
+        command, args = resolve_mcp_server_command()
+        server_params = StdioServerParameters(command=command, args=args, env=MCP_SERVER_ENV)
+        logger.info(f"🔌 Serveur MCP: {command} {' '.join(args)}")
+    return server_params
+
+async def get_agent_response(user_message, context=None, category=None, max_retries=3, run_info=None):
+    """Fonction pour obtenir la réponse de l'agent avec retry automatique
+
+    Si `run_info` (dict) est fourni, il est complété avec les métadonnées de l'exécution
+    (sources consultées, URLs visitées, nombre d'appels d'outils, consommation du budget).
+    """
+    if run_info is None:
+        run_info = {}
+    run_info.setdefault('sources', [])
+    
     # Vérifier la taille du message utilisateur
     if len(user_message) > 10000:  # ~7500 tokens approximativement
         return "❌ Votre message est trop long. Veuillez le raccourcir (maximum ~7500 tokens)."
     
+    # Charger les bibliothèques de l'agent sans bloquer la boucle (sans effet si déjà fait)
+    await asyncio.to_thread(load_agent_libraries)
+    
     # Générer le prompt système selon la catégorie
-    system_prompt = generate_system_prompt(category)
+    with profile_span('prompt', 'generate_system_prompt'):
+        system_prompt = generate_system_prompt(category)
+    
+    # Budget partagé par toutes les tentatives
+    budget = RunBudget(get_agent_budget(category))
+    budget.events = run_info.get('events')
+    run_info['budget'] = budget.usage()
     
     for attempt in range(max_retries):
+        run_info['attempts'] = attempt + 1
+        attempt_started = time.perf_counter()
+        
+        # Disjoncteurs : aucune tentative vouée à l'échec pendant une panne
+        trial_since = time.time()
+        if not breakers['anthropic'].allow():
+            return dependency_unavailable('anthropic', run_info)
+        
         try:
-            async with stdio_client(server_params) as (read, write):
-                async with ClientSession(read, write) as session:
-                    await session.initialize()
-                    tools = await load_mcp_tools(session)
-                    agent = create_react_agent(model, tools)
+            if not breakers['brightdata'].allow():
+                if DEGRADED_MODE_ENABLED:
+                    return await degraded_answer(user_message, context, category, system_prompt, run_info)
+                return dependency_unavailable('brightdata', run_info)
+            
+            # Session MCP du pool (déjà initialisée) ou dédiée si le pool est vide/saturé ;
+            # une session ayant échoué est fermée et remplacée
+            async with mcp_pool.session(browser_site_for(category)) as slot:
+                run_info['timings'] = {'session_wait': round(time.perf_counter() - attempt_started, 3)}
+                profile_mark('session', f'mcp-{slot.id}', wait=run_info['timings']['session_wait'])
+                with profile_span('agent_build', 'create_react_agent'):
+                    tools = filter_tools_for_category(slot.tools, category, system_prompt)
+                    tools = [budgeted_tool(tool, budget, slot) for tool in tools]
+                    if KNOWLEDGE_ENABLED:
+                        tools.append(knowledge_search_tool(category))
+                    agent = create_react_agent(get_model(), tools)
 
-                    # Messages avec prompt système dynamique
-                    messages = [
-                        {"role": "system", "content": system_prompt}
-                    ]
-                    
-                    # Ajouter le contexte si fourni
-                    if context:
-                        messages.append({"role": "system", "content": f"Contexte supplémentaire : {context}"})
-                    
-                    messages.append({"role": "user", "content": user_message})
+                # Messages avec prompt système dynamique
+                messages = [
+                    {"role": "system", "content": system_prompt}
+                ]
+                
+                # Ajouter le contexte si fourni
+                if context:
+                    messages.append({"role": "system", "content": f"Contexte supplémentaire : {context}"})
+                
+                messages.append({"role": "user", "content": user_message})
 
-                    # Log de la taille approximative des tokens
-                    total_chars = sum(len(msg["content"]) for msg in messages)
-                    estimated_tokens = total_chars // 4  # Approximation : 4 chars = 1 token
-                    logger.info(f"📊 Estimation tokens input: ~{estimated_tokens}")
+                # Log de la taille approximative des tokens
+                total_chars = sum(len(msg["content"]) for msg in messages)
+                estimated_tokens = total_chars // 4  # Approximation : 4 chars = 1 token
+                logger.info(f"📊 Estimation tokens input: ~{estimated_tokens}")
 
-                    # Appel de l'agent
-                    agent_response = await agent.ainvoke({"messages": messages})
-                    
-                    # Extraction de la réponse
-                    ai_message = agent_response["messages"][-1].content
-                    
-                    # Log de la taille de la réponse
-                    response_tokens = len(ai_message) // 4
-                    logger.info(f"📊 Estimation tokens output: ~{response_tokens}")
-                    
-                    return ai_message
+                # Appel de l'agent dans les limites du budget
+                agent_started = time.perf_counter()
+                with profile_span('agent', 'run_agent_with_budget'):
+                    agent_response = {"messages": await run_agent_with_budget(agent, messages, budget, system_prompt, user_message)}
+                run_info['timings']['agent'] = round(time.perf_counter() - agent_started, 3)
+                run_info['budget'] = budget.usage()
+                run_info['tools'] = budget.tools
+                run_info['tokens'] = token_usage(agent_response["messages"])
+                breakers['anthropic'].record_success()
+                
+                # Extraction de la réponse
+                ai_message = agent_response["messages"][-1].content
+                
+                # Log de la taille de la réponse
+                response_tokens = len(ai_message) // 4
+                logger.info(f"📊 Estimation tokens output: ~{response_tokens}")
+                
+                # Sources : URLs réellement consultées par les outils, vérifiées localement
+                with profile_span('sources', 'build_sources'):
+                    visited, seen, tool_calls = collect_tool_urls(agent_response["messages"])
+                    sources = build_sources(ai_message, visited, seen)
+                run_info.update({
+                    'sources': sources,
+                    'visited_urls': list(visited),
+                    'tool_calls': tool_calls
+                })
+                
+                # Enrichir la base de connaissances locale en arrière-plan
+                if KNOWLEDGE_ENABLED:
+                    threading.Thread(
+                        target=ingest_agent_run,
+                        args=(agent_response["messages"], ai_message, sources, category, user_message),
+                        daemon=True
+                    ).start()
+                
+                return strip_sources_section(ai_message) + render_sources_markdown(sources)
                     
         except Exception as e:
-            error_msg = str(e).lower()
-            logger.error(f"Erreur MCP (tentative {attempt + 1}/{max_retries}): {str(e)}")
-            
-            # Gestion des erreurs spécifiques
-            if "List roots not supported" in str(e):
-                return "❌ Erreur de configuration MCP. Le serveur BrightData n'est pas compatible avec cette version. Veuillez contacter l'administrateur."
-            
-            elif "529" in str(e) or "overloaded" in error_msg:
-                if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 2  # 2s, 4s, 6s
-                    logger.warning(f"⚠️ Service surchargé (tentative {attempt + 1}/{max_retries}), attente de {wait_time}s...")
-                    await asyncio.sleep(wait_time)
-                    continue
-                else:
-                    return "❌ Service temporairement surchargé. Le service de recherche web est actuellement très sollicité. Veuillez réessayer dans quelques minutes."
+            error_class = classify_error(e)
+            policy = RETRY_POLICIES[error_class]
+            logger.error(f"Erreur {error_class} (tentative {attempt + 1}/{max_retries}): {str(e)}")
+            if error_class in ('overloaded', 'anthropic_unavailable'):
+                breakers['anthropic'].record_failure()
             
-            elif "rate" in error_msg or "limit" in error_msg:
-                if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 1  # 1s, 2s, 3s
-                    logger.warning(f"⚠️ Rate limit atteint (tentative {attempt + 1}/{max_retries}), attente de {wait_time}s...")
-                    await asyncio.sleep(wait_time)
-                    continue
-                else:
-                    return "❌ Limite de requêtes atteinte. Trop de demandes simultanées. Veuillez patienter quelques secondes et réessayer."
-            
-            elif "tokens" in error_msg or "context" in error_msg:
-                logger.error(f"❌ Erreur de tokens: {str(e)}")
-                return f"❌ Limite de tokens atteinte. Essayez une question plus courte ou plus spécifique.\n\nDétails: {str(e)}"
-            
-            elif "mcp" in error_msg or "brightdata" in error_msg:
-                if attempt < max_retries - 1:
-                    logger.warning(f"⚠️ Erreur MCP/BrightData (tentative {attempt + 1}/{max_retries}), nouvelle tentative...")
-                    await asyncio.sleep(1)
-                    continue
-                else:
-                    logger.error(f"❌ Erreur MCP/BrightData: {str(e)}")
-                    return f"❌ Erreur de configuration des outils de recherche web. Veuillez réessayer dans quelques instants.\n\nDétails: {str(e)}"
-            
-            else:
-                if attempt < max_retries - 1:
-                    logger.warning(f"⚠️ Erreur inconnue (tentative {attempt + 1}/{max_retries}), nouvelle tentative...")
-                    await asyncio.sleep(1)
-                    continue
-                else:
-                    logger.error(f"Erreur dans get_agent_response: {str(e)}")
-                    return f"❌ Erreur lors du traitement de votre demande : {str(e)}\n\nVeuillez vérifier que vos clés API sont correctement configurées dans le fichier .env"
+            if policy['retry'] and attempt < max_retries - 1:
+                wait_time = retry_delay(e, policy, attempt + 1)
+                record_retry(error_class, 'run')
+                logger.warning(f"⚠️ {policy['label']} (tentative {attempt + 1}/{max_retries}), nouvelle tentative dans {wait_time:.0f}s"
+                               + (" avec une nouvelle session MCP" if policy['reconnect'] else ""))
+                await asyncio.sleep(wait_time)
+                continue
+            return policy['message'].format(details=str(e))
+        finally:
+            # Tentative terminée sans réponse ni panne d'Anthropic (BrightData indisponible,
+            # erreur MCP, annulation) : l'essai semi-ouvert est rendu au lieu de rester bloqué
+            breakers['anthropic'].release(trial_since)
     
     # Si on arrive ici, toutes les tentatives ont échoué
     return "❌ Impossible de traiter votre demande après plusieurs tentatives. Veuillez réessayer plus tard."
 
+# Informations des catégories (construites une seule fois)
+CATEGORIES = {
+    'sante': {
+        'id': 'sante',
+        'name': '🏥 Santé',
+        'description': 'Sécurité sociale, médecins, urgences, carte vitale',
+        'reference_sites': REFERENCE_SITES.get('sante', [])
+    },
+    'logement': {
+        'id': 'logement',
+        'name': '🏠 Logement',
+        'description': 'Recherche, droits, aides au logement, CAF',
+        'reference_sites': REFERENCE_SITES.get('logement', [])
+    },
+    'administratif': {
+        'id': 'administratif',
+        'name': '📋 Administratif',
+        'description': 'Cartes d\'identité, permis, inscriptions officielles',
+        'reference_sites': REFERENCE_SITES.get('administratif', [])
+    },
+    'juridique': {
+        'id': 'juridique',
+        'name': '⚖️ Juridique',
+        'description': 'Droits, démarches légales, recours',
+        'reference_sites': REFERENCE_SITES.get('juridique', [])
+    },
+    'emploi': {
+        'id': 'emploi',
+        'name': '💼 Emploi',
+        'description': 'Recherche d\'emploi, formations, droits du travail',
+        'reference_sites': REFERENCE_SITES.get('emploi', [])
+    },
+    'education': {
+        'id': 'education',
+        'name': '🎓 Éducation',
+        'description': 'Inscriptions scolaires, universités, formations',
+        'reference_sites': REFERENCE_SITES.get('education', [])
+    },
+    'transport': {
+        'id': 'transport',
+        'name': '🚗 Transport',
+        'description': 'Permis de conduire, transports en commun',
+        'reference_sites': REFERENCE_SITES.get('transport', [])
+    },
+    'finances': {
+        'id': 'finances',
+        'name': '💰 Finances',
+        'description': 'Banques, impôts, aides sociales',
+        'reference_sites': REFERENCE_SITES.get('finances', [])
+    }
+}
+
 def get_category_info(category_id):
     """Récupère les informations d'une catégorie par son ID"""
-    categories = {
-        'sante': {
-            'id': 'sante',
-            'name': '🏥 Santé',
-            'description': 'Sécurité sociale, médecins, urgences, carte vitale',
-            'reference_sites': REFERENCE_SITES.get('sante', [])
-        },
-        'logement': {
-            'id': 'logement',
-            'name': '🏠 Logement',
-            'description': 'Recherche, droits, aides au logement, CAF',
-            'reference_sites': REFERENCE_SITES.get('logement', [])
-        },
-        'administratif': {
-            'id': 'administratif',
-            'name': '📋 Administratif',
-            'description': 'Cartes d\'identité, permis, inscriptions officielles',
-            'reference_sites': REFERENCE_SITES.get('administratif', [])
-        },
-        'juridique': {
-            'id': 'juridique',
-            'name': '⚖️ Juridique',
-            'description': 'Droits, démarches légales, recours',
-            'reference_sites': REFERENCE_SITES.get('juridique', [])
-        },
-        'emploi': {
-            'id': 'emploi',
-            'name': '💼 Emploi',
-            'description': 'Recherche d\'emploi, formations, droits du travail',
-            'reference_sites': REFERENCE_SITES.get('emploi', [])
-        },
-        'education': {
-            'id': 'education',
-            'name': '🎓 Éducation',
-            'description': 'Inscriptions scolaires, universités, formations',
-            'reference_sites': REFERENCE_SITES.get('education', [])
-        },
-        'transport': {
-            'id': 'transport',
-            'name': '🚗 Transport',
-            'description': 'Permis de conduire, transports en commun',
-            'reference_sites': REFERENCE_SITES.get('transport', [])
-        },
-        'finances': {
-            'id': 'finances',
-            'name': '💰 Finances',
-            'description': 'Banques, impôts, aides sociales',
-            'reference_sites': REFERENCE_SITES.get('finances', [])
-        }
-    }
-    return categories.get(category_id)
+    return CATEGORIES.get(category_id)
 
+@functools.lru_cache(maxsize=32)
 def generate_system_prompt(category=None):
-    """Génère le prompt système selon la catégorie"""
+    """Génère le prompt système selon la catégorie (mis en cache, vidé quand la configuration change)"""
     # Utiliser le prompt de base
     prompt = BASE_PROMPT
     
@@ -415,6 +711,9 @@ RÈGLES SPÉCIFIQUES :
         # Utiliser la méthode standard
         category_prompt = STANDARD_METHOD_PROMPT
     
+    if KNOWLEDGE_ENABLED:
+        prompt += KNOWLEDGE_PROMPT
+    
     return prompt + category_prompt
 
 def add_reference_sites(category, sites):
@@ -422,10 +721,18 @@ def add_reference_sites(category, sites):
     if category not in REFERENCE_SITES:
         REFERENCE_SITES[category] = []
     REFERENCE_SITES[category].extend(sites)
+    generate_system_prompt.cache_clear()
+    invalidate_static_payloads()
 
 def add_category_prompt(category, config):
-    """Ajoute une configuration de prompt pour une catégorie"""
+    """Ajoute une configuration de prompt pour une catégorie
+
+    La clé optionnelle `tools` fixe explicitement la liste des outils MCP autorisés.
+    """
     CATEGORY_PROMPTS[category] = config
+    generate_system_prompt.cache_clear()
+    get_allowed_tool_names.cache_clear()
+    invalidate_static_payloads()
 
 def get_available_categories():
     """Retourne la liste des catégories disponibles avec leurs sites de référence"""
@@ -435,220 +742,3407 @@ def get_available_categories():
             'reference_sites': REFERENCE_SITES.get(category, []),
             'has_custom_prompt': category in CATEGORY_PROMPTS
         }
-        for category in ['sante', 'logement', 'administratif', 'juridique', 'emploi', 'education', 'transport', 'finances']
+        for category in CATEGORIES
     }
 
-# ============ ROUTES WEB ============
+# Lecture de la page ouverte par scraping_browser_navigate (qui ne renvoie que le titre et l'URL)
+BROWSER_PAGE_TOOLS = ('scraping_browser_get_text', 'scraping_browser_get_html', 'scraping_browser_wait_for')
 
-@app.route('/')
-def index():
-    """Page d'accueil avec interface web"""
-    return render_template('index.html')
+@functools.lru_cache(maxsize=64)
+def get_allowed_tool_names(category, system_prompt, available_names):
+    """Outils autorisés pour une catégorie
 
-# ============ API ENDPOINTS ============
+    Utilise la liste explicite `tools` de CATEGORY_PROMPTS si elle existe, sinon les outils
+    cités dans le prompt système, en excluant ceux cités sur une ligne « INTERDIT ».
+    Les prompts ne citent pas les outils de lecture du navigateur : ils sont ajoutés dès que
+    scraping_browser_navigate est autorisé, sans quoi la page ouverte ne pourrait pas être lue.
+    """
+    explicit = CATEGORY_PROMPTS.get(category, {}).get('tools')
+    if explicit:
+        allowed = set(explicit)
+        if 'scraping_browser_navigate' in allowed:
+            allowed.update(BROWSER_PAGE_TOOLS)
+        return frozenset(allowed)
+    allowed = set()
+    forbidden = set()
+    for line in system_prompt.splitlines():
+        names = {name for name in available_names if re.search(rf'(?<![\w-]){re.escape(name)}(?![\w-])', line)}
+        if 'INTERDIT' in line:
+            forbidden.update(names)
+        else:
+            allowed.update(names)
+    if 'scraping_browser_navigate' in allowed:
+        allowed.update(name for name in BROWSER_PAGE_TOOLS if name in available_names)
+    return frozenset(allowed - forbidden)
 
-@app.route('/api/status', methods=['GET'])
-def api_status():
-    """Endpoint pour vérifier le statut de l'API"""
-    return jsonify({
-        'status': 'active',
-        'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0',
-        'service': 'Assistant Nouveaux Arrivants France',
-        'model_config': {
-            'model': 'claude-3-5-sonnet-20240620',
-            'max_tokens_output': 6000,
-            'max_tokens_context': 200000,
-            'temperature': 0.1,
-            'timeout': '60s'
-        },
-        'token_limits': {
-            'prompt_system_approx': '~2000 tokens',
-            'user_message_max': '~7500 tokens', 
-            'total_context_max': '200k tokens',
-            'response_max': '6k tokens'
-        },
-        'retry_system': {
-            'max_retries': 3,
-            'overloaded_wait': '2s, 4s, 6s',
-            'rate_limit_wait': '1s, 2s, 3s'
+def tool_allowlist_gaps(available_names):
+    """Catégories dont les outils autorisés ouvrent une page dans le navigateur sans pouvoir la lire"""
+    gaps = []
+    for category in [None, *CATEGORIES]:
+        allowed = get_allowed_tool_names(category, generate_system_prompt(category), tuple(sorted(available_names)))
+        if 'scraping_browser_navigate' in allowed and 'scraping_browser_get_text' not in allowed:
+            gaps.append(category or 'standard')
+    return gaps
+
+def filter_tools_for_category(tools, category, system_prompt):
+    """Ne transmet à l'agent que les outils autorisés pour la catégorie (schémas plus légers)"""
+    if not TOOL_PRUNING_ENABLED:
+        return tools
+    allowed = get_allowed_tool_names(category, system_prompt, tuple(sorted(tool.name for tool in tools)))
+    filtered = [tool for tool in tools if tool.name in allowed]
+    if not filtered:
+        logger.warning(f"⚠️ Aucun outil autorisé trouvé pour la catégorie {category or 'standard'}, tous les outils sont conservés")
+        return tools
+    logger.info(f"🧰 Outils transmis à l'agent: {len(filtered)}/{len(tools)} ({', '.join(tool.name for tool in filtered)})")
+    return filtered
+
+def add_faq_questions(category, questions):
+    """Ajoute des questions fréquentes à pré-calculer pour une catégorie"""
+    if category not in FAQ_QUESTIONS:
+        FAQ_QUESTIONS[category] = []
+    FAQ_QUESTIONS[category].extend(questions)
+
+# ============ BUDGET D'EXÉCUTION DE L'AGENT ============
+
+BUDGET_EXHAUSTED_MESSAGE = (
+    "⛔ Budget de recherche atteint : n'appelle plus aucun outil. "
+    "Rédige maintenant ta réponse finale à partir des informations déjà collectées."
+)
+
+TOOL_UNAVAILABLE_MESSAGE = (
+    "⛔ Recherche web momentanément indisponible : n'appelle plus aucun outil. "
+    "Rédige ta réponse à partir des informations déjà collectées en signalant ce qui reste à vérifier."
+)
+REFUSED_TOOL_MESSAGES = (BUDGET_EXHAUSTED_MESSAGE, TOOL_UNAVAILABLE_MESSAGE)
+
+# Réponse renvoyée par create_react_agent lorsque la limite d'étapes est presque atteinte
+RECURSION_LIMIT_MESSAGE = "Sorry, need more steps to process this request."
+
+def get_agent_budget(category=None):
+    """Limites d'exécution pour une catégorie (valeurs par défaut complétées par AGENT_BUDGETS)"""
+    return {**AGENT_BUDGETS['default'], **AGENT_BUDGETS.get(category or '', {})}
+
+def set_agent_budget(category, **limits):
+    """Modifie les limites d'exécution d'une catégorie (max_tool_calls, max_scraped_bytes, max_seconds)"""
+    AGENT_BUDGETS.setdefault(category, {}).update(limits)
+
+class RunBudget:
+    """Consommation d'une exécution de l'agent par rapport à ses limites"""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.tool_calls = 0
+        self.scraped_bytes = 0
+        self.started_at = time.monotonic()
+        self.exhausted = None  # Première limite atteinte
+        self.events = None  # File des événements de progression (streaming), optionnelle
+        self.tools = {}  # Nom de l'outil -> {'calls', 'bytes', 'cached', 'seconds' (durée de chaque appel)}
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def check(self):
+        """Retourne la limite atteinte, ou None si l'agent peut encore appeler un outil"""
+        if self.tool_calls >= self.limits['max_tool_calls']:
+            reason = 'max_tool_calls'
+        elif self.scraped_bytes >= self.limits['max_scraped_bytes']:
+            reason = 'max_scraped_bytes'
+        elif self.elapsed() >= self.limits['max_seconds']:
+            reason = 'max_seconds'
+        else:
+            return None
+        self.exhausted = self.exhausted or reason
+        return reason
+
+    def usage(self):
+        return {
+            'tool_calls': self.tool_calls,
+            'scraped_bytes': self.scraped_bytes,
+            'elapsed_seconds': round(self.elapsed(), 2),
+            'limits': self.limits,
+            'exhausted': self.exhausted
         }
-    })
 
-@app.route('/api/chat', methods=['POST'])
-def api_chat():
-    """Endpoint principal pour les conversations"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'error': 'Format JSON requis'}), 400
-            
-        user_message = data.get('message', '').strip()
-        context = data.get('context', '')
-        category = data.get('category', '')
-        
-        if not user_message:
-            return jsonify({'error': 'Le champ "message" est requis et ne peut pas être vide'}), 400
-        
-        # Log de la requête
-        logger.info(f"Nouvelle requête chat: {user_message[:100]}... (catégorie: {category})")
+def budgeted_tool(tool, budget, slot=None):
+    """Enveloppe un outil MCP pour décompter ses appels et refuser ceux qui dépassent le budget
+
+    Les succès et échecs alimentent le disjoncteur BrightData ; tant qu'il est ouvert, les
+    appels sont refusés sans être transmis. Seuls les échecs du service (session MCP, délai
+    dépassé) comptent : une erreur renvoyée par l'outil (sélecteur introuvable, page 404) est
+    une réponse normale de BrightData. Les appels scraping_browser_* mettent à jour l'état
+    du navigateur de la session `slot` (site, page courante).
+    
+    Une erreur MCP (transport fermé, processus disparu) fait recycler la session `slot` à sa
+    restitution : l'agent transforme les erreurs d'outils en messages, elles ne remontent donc
+    pas jusqu'à McpSessionPool.session.
+    """
+    async def call_tool(**arguments):
+        if budget.check():
+            return BUDGET_EXHAUSTED_MESSAGE, None
+        if breakers['brightdata'].state == 'open':
+            return TOOL_UNAVAILABLE_MESSAGE, None
+        budget.tool_calls += 1
+        if budget.events is not None:
+            budget.events.put({'event': 'tool', 'name': tool.name, 'tool_calls': budget.tool_calls})
+        stats = budget.tools.setdefault(tool.name, {'calls': 0, 'bytes': 0, 'cached': 0, 'seconds': []})
         
-        # Construire le contexte enrichi avec la catégorie
-        enriched_context = context
-        if category:
-            category_info = get_category_info(category)
-            if category_info:
-                enriched_context = f"Catégorie: {category_info['name']} - {category_info['description']}\n{context}".strip()
+        # Page déjà récupérée par une autre requête (ou une autre instance) : pas d'appel BrightData
+        url = arguments.get('url') if tool.name in PAGE_CACHE_TOOLS else None
+        cached = await asyncio.to_thread(get_cached_page, tool.name, url) if url else None
+        # Navigateur de la session déjà sur cette page, sans interaction depuis : pas de rechargement
+        if tool.name == 'scraping_browser_navigate' and slot is not None:
+            cached = slot.browser.landing_page(arguments.get('url'))
+        if cached is not None:
+            stats['cached'] += 1
+            budget.scraped_bytes += len(tool_output_text(cached).encode('utf-8'))
+            return cached, None
         
-        # Exécution asynchrone
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        profiler = current_profile.get()
+        traced_before = tracemalloc.get_traced_memory()[0] if profiler is not None and profiler.tracing else None
+        started = time.perf_counter()
         try:
-            response = loop.run_until_complete(get_agent_response(user_message, enriched_context, category))
-            
-            return jsonify({
-                'success': True,
-                'response': response,
-                'timestamp': datetime.now().isoformat(),
-                'category': category
-            })
-        finally:
-            loop.close()
-            
-    except Exception as e:
-        logger.error(f"Erreur dans api_chat: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': f'Erreur serveur: {str(e)}'
-        }), 500
+            with profile_span('tool', tool.name):
+                content, artifact = await tool.coroutine(**arguments)
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class in ('mcp_session', 'mcp_config') or isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+                breakers['brightdata'].record_failure()
+            elif isinstance(e, ToolException):
+                breakers['brightdata'].record_success()
+            if slot is not None:
+                if tool.name.startswith('scraping_browser_'):
+                    slot.browser.reset()
+                if error_class in ('mcp_session', 'mcp_config'):
+                    slot.retire('broken', f"{type(e).__name__} pendant {tool.name}")
+            raise
+        breakers['brightdata'].record_success()
+        if slot is not None and tool.name.startswith('scraping_browser_'):
+            slot.browser.record(tool.name, arguments, content)
+        size = len(tool_output_text(content).encode('utf-8'))
+        if profiler is not None:
+            allocated = tracemalloc.get_traced_memory()[0] - traced_before if traced_before is not None else None
+            profiler.record_payload(tool.name, arguments, size, allocated)
+        budget.scraped_bytes += size
+        stats['calls'] += 1
+        stats['bytes'] += size
+        stats['seconds'].append(round(time.perf_counter() - started, 3))
+        if url:
+            await asyncio.to_thread(set_cached_page, tool.name, url, content)
+        return content, artifact
 
-@app.route('/api/categories', methods=['GET'])
-def api_categories():
-    """Endpoint pour obtenir les catégories d'aide disponibles"""
-    categories = [
-        get_category_info('sante'),
-        get_category_info('logement'),
-        get_category_info('administratif'),
-        get_category_info('juridique'),
-        get_category_info('emploi'),
-        get_category_info('education'),
-        get_category_info('transport'),
-        get_category_info('finances')
-    ]
-    
-    return jsonify({
-        'success': True,
-        'categories': categories
-    })
+    return StructuredTool(
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        coroutine=call_tool,
+        response_format=tool.response_format
+    )
 
-@app.route('/api/help', methods=['GET'])
-def api_help():
-    """Documentation de l'API"""
-    endpoints = [
-        {
-            'endpoint': '/api/status',
-            'method': 'GET',
-            'description': 'Vérifier le statut de l\'API'
-        },
-        {
-            'endpoint': '/api/chat',
-            'method': 'POST',
-            'description': 'Envoyer un message à l\'assistant',
-            'parameters': {
-                'message': 'string (requis) - Votre question',
-                'context': 'string (optionnel) - Contexte supplémentaire',
-                'category': 'string (optionnel) - Catégorie thématique (sante, logement, administratif, juridique, emploi, education, transport, finances)'
-            },
-            'example': {
-                'message': 'Comment obtenir des aides au logement en tant que réfugié syrien ?',
-                'context': 'Personne ayant obtenu le statut de réfugié ou protection internationale',
-                'category': 'logement'
-            }
-        },
-        {
-            'endpoint': '/api/categories',
-            'method': 'GET',
-            'description': 'Obtenir la liste des catégories d\'aide disponibles'
-        },
-        {
-            'endpoint': '/api/reference-sites',
-            'method': 'GET',
-            'description': 'Obtenir la configuration des sites de référence par catégorie'
-        }
-    ]
-    
-    return jsonify({
-        'service': 'API Assistant Nouveaux Arrivants France',
-        'version': '1.0.0',
-        'endpoints': endpoints
-    })
+async def run_agent_with_budget(agent, messages, budget, system_prompt, user_message):
+    """Exécute l'agent et force une réponse finale si le budget (étapes ou durée) est dépassé
 
-@app.route('/api/reference-sites', methods=['GET'])
-def api_reference_sites():
-    """Endpoint pour obtenir la configuration des sites de référence"""
-    return jsonify({
-        'success': True,
-        'reference_sites': REFERENCE_SITES,
-        'category_prompts': list(CATEGORY_PROMPTS.keys()),
-        'categories': get_available_categories()
-    })
+    Chaque réponse du modèle et chaque indisponibilité d'Anthropic absorbée par une reprise
+    d'étape alimentent le disjoncteur Anthropic ; les reprises cessent dès qu'il s'ouvre.
+    Retourne la liste des messages de l'exécution, le dernier étant la réponse finale.
+    """
+    limits = budget.limits
+    state = {'messages': []}
 
-# ============ COMPATIBILITÉ ANCIENNE API ============
+    async def stream():
+        config = {'recursion_limit': 2 * limits['max_tool_calls'] + 6}
+        resumes = 0
+        while True:
+            try:
+                async for values in agent.astream({"messages": state['messages'] or messages}, config=config, stream_mode="values"):
+                    state['messages'] = values['messages']
+                    if getattr(state['messages'][-1], 'type', None) == 'ai':
+                        breakers['anthropic'].record_success()
+                    profile_mark('step', getattr(state['messages'][-1], 'type', 'message'), messages=len(state['messages']))
+                return
+            except Exception as e:
+                # Erreur passagère du modèle : seule l'étape en échec est rejouée, en repartant
+                # des messages déjà obtenus (les résultats d'outils sont conservés)
+                error_class = classify_error(e)
+                policy = RETRY_POLICIES[error_class]
+                if not policy['resume'] or resumes >= MAX_STEP_RETRIES:
+                    raise  # Échec de l'exécution, compté par get_agent_response
+                if is_anthropic_outage(e):
+                    breakers['anthropic'].record_failure()
+                    if breakers['anthropic'].state == 'open':
+                        raise
+                resumes += 1
+                wait_time = retry_delay(e, policy, resumes)
+                record_retry(error_class, 'step')
+                logger.warning(f"⚠️ {policy['label']} pendant l'exécution, reprise de l'étape dans {wait_time:.0f}s ({resumes}/{MAX_STEP_RETRIES})")
+                await asyncio.sleep(wait_time)
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    """Ancien endpoint chat pour compatibilité"""
-    user_message = request.json.get('message', '')
+    try:
+        # Marge au-delà de max_seconds pour laisser le modèle rédiger après le refus des outils
+        await asyncio.wait_for(stream(), timeout=limits['max_seconds'] * 1.5)
+        last = state['messages'][-1]
+        if (getattr(last, 'type', None) == 'ai' and not getattr(last, 'tool_calls', None)
+                and last.content != RECURSION_LIMIT_MESSAGE):
+            return state['messages']
+        state['messages'] = state['messages'][:-1]
+        budget.exhausted = budget.exhausted or 'max_tool_calls'
+    except asyncio.TimeoutError:
+        budget.exhausted = budget.exhausted or 'max_seconds'
+    except GraphRecursionError:
+        budget.exhausted = budget.exhausted or 'max_tool_calls'
     
-    if not user_message.strip():
-        return jsonify({'error': 'Message vide'}), 400
+    logger.warning(f"⏱️ Budget atteint ({budget.exhausted}), rédaction forcée de la réponse finale")
+    final = await force_final_answer(state['messages'], system_prompt, user_message)
+    return state['messages'] + [final]
+
+def token_usage(messages):
+    """Tokens réellement consommés par les appels au modèle d'une exécution (usage_metadata des réponses)"""
+    usage = {'input': 0, 'output': 0}
+    for message in messages:
+        metadata = getattr(message, 'usage_metadata', None) or {}
+        usage['input'] += metadata.get('input_tokens', 0)
+        usage['output'] += metadata.get('output_tokens', 0)
+    return usage
+
+async def force_final_answer(gathered_messages, system_prompt, user_message, max_chars=40000):
+    """Demande au modèle, sans outils, une réponse à partir des contenus déjà collectés"""
+    gathered = []
+    for message in gathered_messages:
+        if getattr(message, 'type', None) == 'tool':
+            text = tool_output_text(message.content)
+            if text and text not in REFUSED_TOOL_MESSAGES:
+                gathered.append(f"--- Résultat de {message.name} ---\n{text}")
+    material = '\n\n'.join(gathered)[:max_chars] or "Aucune information n'a pu être collectée."
     
-    # Rediriger vers la nouvelle API
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        response = loop.run_until_complete(get_agent_response(user_message, category=None))
-        return jsonify({'response': response})
-    finally:
-        loop.close()
+    return await get_model().ainvoke([
+        SystemMessage(content=system_prompt),
+        HumanMessage(content=(
+            f"Question : {user_message}\n\n"
+            f"Informations collectées pendant la recherche :\n{material}\n\n"
+            "Le budget de recherche est épuisé. Rédige maintenant ta réponse finale complète "
+            "à partir de ces informations uniquement, en signalant ce qui reste à vérifier."
+        ))
+    ])
 
-# ============ GESTION D'ERREURS ============
+# ============ SOURCES CONSULTÉES ============
 
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({
-        'error': 'Endpoint non trouvé',
-        'message': 'Consultez /api/help pour voir les endpoints disponibles'
-    }), 404
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'()\[\]{}|\\^`]+')
 
-@app.errorhandler(405)
-def method_not_allowed(error):
-    return jsonify({
-        'error': 'Méthode non autorisée',
-        'message': 'Vérifiez la méthode HTTP utilisée (GET/POST)'
-    }), 405
+def tool_output_text(content):
+    """Texte brut de la sortie d'un outil (chaîne ou liste de blocs)"""
+    if isinstance(content, str):
+        return content
+    return ' '.join(
+        block.get('text', '') if isinstance(block, dict) else str(block)
+        for block in content or []
+    )
 
-@app.errorhandler(500)
-def internal_error(error):
-    return jsonify({
-        'error': 'Erreur serveur interne',
-        'message': 'Une erreur est survenue côté serveur'
-    }), 500
+def collect_tool_urls(messages):
+    """Collecte les URLs consultées pendant les appels d'outils d'une exécution
 
-if __name__ == '__main__':
-    logger.info("Démarrage de l'API Assistant Nouveaux Arrivants France")
-    
-    # Vérifier les variables d'environnement critiques
-    required_env_vars = ['API_TOKEN', 'BROWSER_AUTH', 'WEB_UNLOCKER_ZONE']
-    missing_vars = [var for var in required_env_vars if not os.getenv(var)]
+    Retourne (visited, seen, tool_calls) : `visited` associe chaque URL passée en argument
+    à un outil (scrape, navigate...) au titre de la page récupérée, `seen` contient toutes
+    les URLs apparues dans les sorties d'outils (résultats de recherche, liens, contenu).
+    """
+    visited = {}
+    seen = set()
+    outputs = {}
+    tool_calls = []
+    for message in messages:
+        if getattr(message, 'type', None) == 'tool':
+            text = tool_output_text(message.content)
+            outputs[message.tool_call_id] = text
+            seen.update(normalize_url(url.rstrip('.,;:')) for url in URL_PATTERN.findall(text))
+        for call in getattr(message, 'tool_calls', None) or []:
+            tool_calls.append(call)
     
-    if missing_vars:
-        logger.error(f"❌ Variables d'environnement manquantes: {', '.join(missing_vars)}")
-        logger.error("Veuillez configurer ces variables dans votre fichier .env ou dans les variables d'environnement Render")
-        exit(1)
-    
-    logger.info("✅ Toutes les variables d'environnement sont configurées")
+    for call in tool_calls:
+        url = (call.get('args') or {}).get('url')
+        if not url or outputs.get(call.get('id')) in REFUSED_TOOL_MESSAGES:
+            continue
+        heading = re.search(r'^#\s+(.+)$', outputs.get(call.get('id'), ''), re.M)
+        normalized = normalize_url(url)
+        if normalized not in visited or heading:
+            visited[normalized] = heading.group(1).strip() if heading else None
+    return visited, seen, len(tool_calls)
+
+def build_sources(answer, visited, seen):
+    """Construit la liste structurée des sources d'une réponse
+
+    Les liens cités dans la réponse sont normalisés, dédoublonnés et marqués `verified`
+    uniquement s'ils ont été consultés ou rencontrés pendant les appels d'outils.
+    Les pages consultées mais non citées sont ajoutées ensuite.
+    """
+    sources = {}
+    for link in extract_markdown_links(answer):
+        url = normalize_url(link['url'])
+        if url not in sources:
+            sources[url] = {
+                'url': url,
+                'title': link['title'],
+                'cited': True,
+                'visited': url in visited,
+                'verified': url in visited or url in seen
+            }
+    for url, title in visited.items():
+        if url not in sources:
+            sources[url] = {
+                'url': url,
+                'title': title or urlsplit(url).netloc + urlsplit(url).path.rstrip('/'),
+                'cited': False,
+                'visited': True,
+                'verified': True
+            }
+    return list(sources.values())
+
+def strip_sources_section(answer):
+    """Retire la section « Sources » rédigée par le modèle (remplacée par la liste vérifiée)"""
+    match = re.search(r'^#{1,6}[^\n]*\bSources\b[^\n]*$', answer, re.M | re.I)
+    if match and not re.search(r'^#{1,6}\s', answer[match.end():], re.M):
+        return answer[:match.start()].rstrip()
+    return answer.rstrip()
+
+def render_sources_markdown(sources):
+    """Section Markdown des sources vérifiées, ajoutée localement à la réponse"""
+    verified = [source for source in sources if source['verified']]
+    if not verified:
+        return ''
+    lines = [f"- [{source['title']}]({source['url']})" for source in verified]
+    return "\n\n## 📚 Sources consultées\n\n" + '\n'.join(lines)
+
+# ============ RÉPONSES STRUCTURÉES ============
+
+class AnswerStep(BaseModel):
+    """Étape numérotée d'une démarche"""
+    title: str
+    details: list[str] = Field(default_factory=list)
+
+class AnswerDocument(BaseModel):
+    """Document, formulaire ou page à consulter"""
+    name: str
+    url: str
+
+class AnswerSource(BaseModel):
+    """Source consultée (voir build_sources)"""
+    url: str
+    title: str
+    cited: bool = False
+    visited: bool = False
+    verified: bool = False
+
+class AnswerSection(BaseModel):
+    """Section Markdown de la réponse (sous-titre ## et contenu)"""
+    heading: str = ''
+    content: str = ''
+
+class StructuredAnswer(BaseModel):
+    """Réponse découpée en sections typées, rendue en Markdown à la demande"""
+    title: str = ''
+    sections: list[AnswerSection] = Field(default_factory=list)
+    steps: list[AnswerStep] = Field(default_factory=list)
+    warnings: list[str] = Field(default_factory=list)
+    documents: list[AnswerDocument] = Field(default_factory=list)
+    sources: list[AnswerSource] = Field(default_factory=list)
+
+def strip_markdown(text):
+    """Retire la mise en forme Markdown inline (gras, code, liens)"""
+    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
+    return re.sub(r'[*_`]+', '', text).strip()
+
+def parse_markdown_answer(markdown, sources=None):
+    """Découpe une réponse Markdown de l'agent en StructuredAnswer (sans appel au modèle)"""
+    body = strip_sources_section(markdown or '')
+    title = ''
+    title_match = re.search(r'^#\s+(.+)$', body, re.M)
+    if title_match:
+        title = title_match.group(1).strip()
+        body = body[:title_match.start()] + body[title_match.end():]
+    
+    # Sections : découpage sur les titres de niveau 2
+    sections = []
+    for chunk in re.split(r'^(?=##\s)', body.strip(), flags=re.M):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        if chunk.startswith('## '):
+            heading, _, content = chunk.partition('\n')
+            sections.append(AnswerSection(heading=heading[3:].strip(), content=content.strip()))
+        else:
+            sections.append(AnswerSection(content=chunk))
+    
+    # Étapes : éléments de liste numérotée et leurs sous-points
+    steps = []
+    for line in body.splitlines():
+        step_match = re.match(r'^\s{0,3}\d+[.)]\s+(.+)$', line)
+        if step_match:
+            steps.append(AnswerStep(title=strip_markdown(step_match.group(1))))
+        elif steps and re.match(r'^\s{2,}[-*•]\s+(.+)$', line):
+            steps[-1].details.append(strip_markdown(line.strip()[1:]))
+    
+    # Avertissements : citations et contenu des sections « importants » / « attention »
+    warnings = [strip_markdown(line.lstrip('> ')) for line in body.splitlines() if line.startswith('>') and line.strip('> ')]
+    for section in sections:
+        if re.search(r'important|attention|⚠', section.heading, re.I):
+            for line in section.content.splitlines():
+                line = line.strip()
+                if line.startswith(('-', '*', '•')):
+                    warnings.append(strip_markdown(line[1:]))
+    
+    documents = [
+        AnswerDocument(name=link['title'], url=link['url'])
+        for link in extract_markdown_links(body)
+    ]
+    
+    return StructuredAnswer(
+        title=title,
+        sections=sections,
+        steps=steps,
+        warnings=list(dict.fromkeys(warnings)),
+        documents=documents,
+        sources=[AnswerSource(**source) for source in sources or []]
+    )
+
+def render_structured_markdown(answer):
+    """Rend une StructuredAnswer en Markdown (format historique de /api/chat)"""
+    parts = []
+    if answer.title:
+        parts.append(f"# {answer.title}")
+    for section in answer.sections:
+        if section.heading:
+            parts.append(f"## {section.heading}\n\n{section.content}".rstrip())
+        else:
+            parts.append(section.content)
+    return '\n\n'.join(parts) + render_sources_markdown([source.model_dump() for source in answer.sources])
+
+def chat_payload(answer, response_format):
+    """Champs de réponse de /api/chat selon le format demandé"""
+    if response_format == 'structured':
+        return {'answer': answer.model_dump()}
+    return {
+        'response': render_structured_markdown(answer),
+        'sources': [source.model_dump() for source in answer.sources]
+    }
+
+# ============ CACHE PARTAGÉ (RÉPONSES ET PAGES) ============
+
+class MemoryCacheBackend:
+    """Cache LRU en mémoire, propre au processus"""
+    name = 'memory'
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # clé -> (valeur, expiration)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def add(self, key, value, ttl):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and item[1] >= time.time():
+                return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def keys(self, prefix):
+        with self.lock:
+            return [key for key in self.entries if key.startswith(prefix)]
+
+class SqliteCacheBackend:
+    """Cache sur disque (SQLite), partagé par les processus d'une même machine"""
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self.sets = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, key):
+        with self.connect() as connection:
+            row = connection.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl):
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+            self.sets += 1
+            if self.sets % 200 == 0:
+                connection.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+    def add(self, key, value, ttl):
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("DELETE FROM cache WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, now + ttl)
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def keys(self, prefix):
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT key FROM cache WHERE key >= ? AND key < ? AND expires_at >= ?",
+                (prefix, prefix + '\uffff', time.time())
+            ).fetchall()
+        return [row[0] for row in rows]
+
+class RedisCacheBackend:
+    """Cache partagé par toutes les instances, via un serveur parlant le protocole Redis (RESP)
+
+    Client minimal sur une connexion TCP unique protégée par un verrou (GET, SET EX [NX], DEL, SCAN),
+    pour ne pas ajouter de dépendance.
+    """
+    name = 'redis'
+
+    def __init__(self, url, timeout=2.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.retry_at = 0  # Après un échec de connexion, pas de nouvel essai avant cette date
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.reader = self.sock.makefile('rb')
+        if self.password:
+            self.send('AUTH', self.password)
+        if self.db:
+            self.send('SELECT', self.db)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = self.reader = None
+
+    def send(self, *args):
+        payload = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            payload.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b''.join(payload))
+        return self.read_reply()
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connexion Redis fermée")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RuntimeError(f"Erreur Redis: {rest.decode()}")
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self.read_reply() for _ in range(length)]
+        raise RuntimeError(f"Réponse Redis inattendue: {line[:50]!r}")
+
+    def command(self, *args):
+        """Exécute une commande, en rouvrant la connexion une fois si elle a été coupée"""
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        if time.time() < self.retry_at:
+                            raise ConnectionError("Redis injoignable, nouvel essai différé")
+                        self.connect()
+                    return self.send(*args)
+                except (OSError, ConnectionError):
+                    if self.sock is None:
+                        self.retry_at = time.time() + 5
+                    self.close()
+                    if attempt:
+                        raise
+
+    def get(self, key):
+        return self.command('GET', key)
+
+    def set(self, key, value, ttl):
+        self.command('SET', key, value, 'EX', max(int(ttl), 1))
+
+    def add(self, key, value, ttl):
+        return self.command('SET', key, value, 'EX', max(int(ttl), 1), 'NX') == 'OK'
+
+    def delete(self, key):
+        self.command('DEL', key)
+
+    def keys(self, prefix):
+        keys, cursor = [], '0'
+        while True:
+            cursor, batch = self.command('SCAN', cursor, 'MATCH', prefix + '*', 'COUNT', 500)
+            cursor = cursor.decode() if isinstance(cursor, bytes) else str(cursor)
+            keys.extend(key.decode() for key in batch)
+            if cursor == '0':
+                return keys
+
+class SharedCache:
+    """Cache de valeurs JSON au-dessus d'un backend interchangeable
+
+    Clés : `<CACHE_NAMESPACE>:<type>:<catégorie>:<empreinte>`. Valeurs : JSON compressé (zlib)
+    au-delà de CACHE_COMPRESS_MIN_SIZE. Une erreur du backend est journalisée et traitée comme
+    une absence en cache : le cache ne fait jamais échouer une requête.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def key(self, kind, category, identifier):
+        digest = hashlib.sha256(identifier.encode('utf-8')).hexdigest()[:32]
+        return f"{CACHE_NAMESPACE}:{kind}:{category or 'general'}:{digest}"
+
+    @staticmethod
+    def encode(value):
+        data = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(data) >= CACHE_COMPRESS_MIN_SIZE:
+            return b'z' + zlib.compress(data, 6)
+        return b'j' + data
+
+    @staticmethod
+    def decode(data):
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        if data[:1] == b'z':
+            return json.loads(zlib.decompress(data[1:]))
+        return json.loads(data[1:])
+
+    def record(self, counter, started):
+        with self.lock:
+            self.stats[counter] += 1
+            self.stats[f"{counter}_ms"] += (time.perf_counter() - started) * 1000
+
+    def get(self, key, counted=True):
+        """Valeur d'une clé ; `counted=False` pour une lecture interne, hors statistiques de succès"""
+        started = time.perf_counter()
+        try:
+            data = self.backend.get(key)
+        except Exception as e:
+            self.record('errors', started)
+            if counted:
+                self.record('misses', started)  # Cache indisponible : la requête se poursuit comme sans cache
+            logger.warning(f"⚠️ Cache {self.backend.name} indisponible (lecture): {e}")
+            return None
+        if counted:
+            self.record('hits' if data is not None else 'misses', started)
+        return self.decode(data) if data is not None else None
+
+    def set(self, key, value, ttl):
+        started = time.perf_counter()
+        try:
+            data = self.encode(value)
+            self.backend.set(key, data, ttl)
+        except Exception as e:
+            self.record('errors', started)
+            logger.warning(f"⚠️ Cache {self.backend.name} indisponible (écriture): {e}")
+            return
+        self.record('sets', started)
+        with self.lock:
+            self.stats['bytes_written'] += len(data)
+
+    def add(self, key, value, ttl):
+        """Écrit la clé seulement si elle n'existe pas (réservation entre instances) ; False sinon ou en cas d'erreur"""
+        try:
+            return self.backend.add(key, self.encode(value), ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ Cache {self.backend.name} indisponible (réservation): {e}")
+            return False
+
+    def delete(self, key):
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Cache {self.backend.name} indisponible (suppression): {e}")
+
+    def scan(self, kind):
+        """Parcourt les entrées d'un type (clé, valeur) ; utilisé pour les invalidations"""
+        try:
+            keys = self.backend.keys(f"{CACHE_NAMESPACE}:{kind}:")
+        except Exception as e:
+            logger.warning(f"⚠️ Cache {self.backend.name} indisponible (parcours): {e}")
+            return
+        for key in keys:
+            value = self.get(key, counted=False)
+            if value is not None:
+                yield key, value
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        return {
+            'backend': self.backend.name,
+            'hits': stats.get('hits', 0),
+            'misses': stats.get('misses', 0),
+            'sets': stats.get('sets', 0),
+            'errors': stats.get('errors', 0),
+            'hit_rate': round(stats.get('hits', 0) / lookups, 3) if lookups else None,
+            'avg_get_ms': round((stats.get('hits_ms', 0) + stats.get('misses_ms', 0)) / lookups, 2) if lookups else None,
+            'avg_set_ms': round(stats.get('sets_ms', 0) / stats['sets'], 2) if stats.get('sets') else None,
+            'bytes_written': stats.get('bytes_written', 0)
+        }
+
+def create_cache_backend():
+    """Backend choisi par CACHE_BACKEND (memory, sqlite ou redis)"""
+    if CACHE_BACKEND == 'redis':
+        return RedisCacheBackend(CACHE_REDIS_URL)
+    if CACHE_BACKEND == 'sqlite':
+        return SqliteCacheBackend(CACHE_SQLITE_PATH)
+    if CACHE_BACKEND != 'memory':
+        logger.warning(f"⚠️ CACHE_BACKEND inconnu ({CACHE_BACKEND}), cache en mémoire utilisé")
+    return MemoryCacheBackend(ANSWER_CACHE_MAX_ENTRIES)
+
+shared_cache = SharedCache(create_cache_backend())
+
+def answer_cache_key(user_message, category=None, context=None):
+    """Clé d'une réponse (question, catégorie et contexte normalisés), aussi utilisée pour fusionner les requêtes"""
+    return f"{category or 'general'}:{normalize_question(user_message)}:{normalize_question(context)}"
+
+def answer_storage_key(key):
+    """Clé de la réponse dans le cache partagé, rangée sous sa catégorie"""
+    return shared_cache.key('answer', key.split(':', 1)[0], key)
+
+def get_cached_answer(key, allow_expired=False):
+    """Retourne la réponse structurée en cache si elle n'a pas expiré
+
+    Les entrées expirées restent conservées ANSWER_CACHE_RETENTION secondes pour servir de
+    réponse de secours pendant une panne (`allow_expired`).
+    """
+    entry = shared_cache.get(answer_storage_key(key))
+    if not entry:
+        return None
+    if not allow_expired and time.time() - entry['created_at'] > ANSWER_CACHE_TTL:
+        return None
+    return StructuredAnswer.model_validate(entry['answer'])
+
+def lookup_cached_answer(key):
+    """Réponse en cache à servir, avec sa date de génération et son état
+
+    Retourne (réponse, created_at, stale) : `stale` si elle a dépassé ANSWER_CACHE_TTL mais pas
+    ANSWER_CACHE_STALE_TTL (elle doit alors être rafraîchie) ; (None, None, False) au-delà.
+    """
+    entry = shared_cache.get(answer_storage_key(key))
+    if not entry:
+        return None, None, False
+    age = time.time() - entry['created_at']
+    if age > max(ANSWER_CACHE_TTL, ANSWER_CACHE_STALE_TTL):
+        return None, None, False
+    return StructuredAnswer.model_validate(entry['answer']), entry['created_at'], age > ANSWER_CACHE_TTL
+
+def set_cached_answer(key, answer):
+    """Met en cache une réponse structurée"""
+    shared_cache.set(
+        answer_storage_key(key),
+        {'answer': answer.model_dump(), 'created_at': time.time()},
+        max(ANSWER_CACHE_RETENTION, ANSWER_CACHE_STALE_TTL, ANSWER_CACHE_TTL)
+    )
+
+# Outils dont la sortie ne dépend que de l'URL (extract dépend aussi de sa consigne, get_text de la page ouverte)
+PAGE_CACHE_TOOLS = ('scrape_as_markdown', 'scrape_as_html')
+
+def page_cache_key(tool_name, url):
+    """Une clé par outil et par page : chaque écriture est un SET unique, sans relecture de l'entrée"""
+    return shared_cache.key('page', 'web', f"{tool_name}|{normalize_url(url)}")
+
+def get_cached_page(tool_name, url):
+    """Contenu d'une page déjà récupérée par le même outil, s'il a moins de PAGE_CACHE_TTL secondes"""
+    if PAGE_CACHE_TTL <= 0 or not url:
+        return None
+    entry = shared_cache.get(page_cache_key(tool_name, url))
+    return entry['content'] if entry else None
+
+def set_cached_page(tool_name, url, content):
+    """Conserve la sortie d'un outil de lecture de page pour les autres requêtes et instances"""
+    if PAGE_CACHE_TTL <= 0 or not url:
+        return
+    shared_cache.set(page_cache_key(tool_name, url), {'url': normalize_url(url), 'content': content}, PAGE_CACHE_TTL)
+
+def delete_cached_page(url):
+    """Supprime la page du cache, pour tous les outils de lecture"""
+    for tool_name in PAGE_CACHE_TOOLS:
+        shared_cache.delete(page_cache_key(tool_name, url))
+
+# ============ BASE DE CONNAISSANCES LOCALE ============
+
+KNOWLEDGE_TOOL_NAME = 'search_local_knowledge'
+KNOWLEDGE_STOPWORDS = set(
+    "le la les un une des du de d l et ou en au aux a à pour par sur dans avec sans est sont "
+    "que qui quoi quel quelle quels quelles comment ce cet cette ces mon ma mes ton ta tes son sa ses "
+    "je tu il elle on nous vous ils elles se ne pas plus y the of and to is".split()
+)
+# Outils dont la sortie est le contenu d'une page identifiée par l'argument `url`
+PAGE_CONTENT_TOOLS = ('scrape_as_markdown', 'scrape_as_html', 'extract', 'scraping_browser_get_text')
+knowledge_lock = threading.Lock()
+knowledge_schema_ready = False
+
+@contextlib.contextmanager
+def knowledge_connect():
+    """Connexion à la base SQLite de connaissances (transaction validée à la sortie)"""
+    global knowledge_schema_ready
+    os.makedirs(DATA_DIR, exist_ok=True)
+    connection = sqlite3.connect(KNOWLEDGE_DB_PATH, timeout=10)
+    try:
+        if not knowledge_schema_ready:
+            create_knowledge_schema(connection)
+            knowledge_schema_ready = True
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def create_knowledge_schema(connection):
+    """Crée les tables de la base de connaissances si nécessaire"""
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY,
+            category TEXT,
+            kind TEXT,
+            source_url TEXT,
+            depends_on TEXT,
+            text TEXT,
+            content_hash TEXT UNIQUE,
+            created_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS chunk_vectors (
+            feature INTEGER,
+            chunk_id INTEGER,
+            weight REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_vectors_feature ON chunk_vectors (feature);
+        CREATE INDEX IF NOT EXISTS idx_vectors_chunk ON chunk_vectors (chunk_id);
+        CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source_url);
+    """)
+
+def knowledge_vector(text):
+    """Vecteur creux normalisé d'un texte (termes et bigrammes hachés, sans modèle externe)"""
+    words = [word for word in normalize_question(text).split() if word not in KNOWLEDGE_STOPWORDS and len(word) > 1]
+    terms = Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+    vector = {}
+    for term, count in terms.items():
+        feature = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'big') % KNOWLEDGE_VECTOR_DIM
+        vector[feature] = vector.get(feature, 0.0) + 1.0 + math.log(count)
+    norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+    return {feature: weight / norm for feature, weight in vector.items()}
+
+def split_into_chunks(text, max_chars=1200, max_chunks=40):
+    """Découpe un texte en passages d'environ max_chars caractères sur les paragraphes"""
+    chunks = []
+    current = ''
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) > max_chars:
+            chunks.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph[:max_chars * 2]
+        if len(chunks) >= max_chunks:
+            break
+    if current and len(chunks) < max_chunks:
+        chunks.append(current)
+    # Les passages trop courts (menus, boutons) n'apportent rien à la recherche
+    return [chunk for chunk in chunks if len(chunk) >= 80]
+
+def add_knowledge(texts, category, kind, source_url=None, depends_on=(), replace=False):
+    """Ajoute des passages (et leurs vecteurs) à la base, sans doublons
+
+    Avec `replace`, les passages précédemment extraits de la même page sont remplacés.
+    """
+    created_at = datetime.now().isoformat()
+    added = 0
+    with knowledge_lock, knowledge_connect() as connection:
+        if replace and source_url:
+            ids = [(row[0],) for row in connection.execute(
+                "SELECT id FROM chunks WHERE source_url = ? AND kind = ?", (source_url, kind)
+            )]
+            connection.executemany("DELETE FROM chunk_vectors WHERE chunk_id = ?", ids)
+            connection.executemany("DELETE FROM chunks WHERE id = ?", ids)
+        for text in texts:
+            content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO chunks (category, kind, source_url, depends_on, text, content_hash, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (category or '', kind, source_url, ' '.join(depends_on), text, content_hash, created_at)
+            )
+            if not cursor.rowcount:
+                continue
+            connection.executemany(
+                "INSERT INTO chunk_vectors (feature, chunk_id, weight) VALUES (?, ?, ?)",
+                [(feature, cursor.lastrowid, weight) for feature, weight in knowledge_vector(text).items()]
+            )
+            added += 1
+    return added
+
+def remove_knowledge_for_url(url):
+    """Supprime les passages issus d'une page ou de réponses qui la citent"""
+    with knowledge_lock, knowledge_connect() as connection:
+        ids = [row[0] for row in connection.execute(
+            "SELECT id FROM chunks WHERE source_url = ? OR ' ' || depends_on || ' ' LIKE ?",
+            (url, f"% {url} %")
+        )]
+        connection.executemany("DELETE FROM chunk_vectors WHERE chunk_id = ?", [(i,) for i in ids])
+        connection.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+    return len(ids)
+
+def search_knowledge(query, category=None, top_k=KNOWLEDGE_TOP_K):
+    """Passages les plus proches de la requête (similarité cosinus pondérée par l'IDF)"""
+    query_vector = knowledge_vector(query)
+    if not query_vector:
+        return []
+    with knowledge_connect() as connection:
+        total = connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        if not total:
+            return []
+        placeholders = ','.join('?' * len(query_vector))
+        rows = connection.execute(
+            f"SELECT feature, chunk_id, weight FROM chunk_vectors WHERE feature IN ({placeholders})",
+            list(query_vector)
+        ).fetchall()
+        document_frequency = Counter(feature for feature, _, _ in rows)
+        scores = Counter()
+        for feature, chunk_id, weight in rows:
+            idf = math.log(1 + total / document_frequency[feature])
+            scores[chunk_id] += query_vector[feature] * weight * idf
+        results = []
+        for chunk_id, score in scores.most_common(top_k * 4):
+            row = connection.execute(
+                "SELECT category, kind, source_url, text, created_at FROM chunks WHERE id = ?", (chunk_id,)
+            ).fetchone()
+            if not row or (category and row[0] not in (category, '')):
+                continue
+            # Score ramené à [0, 1] environ en divisant par l'IDF maximal
+            normalized_score = score / math.log(1 + total)
+            if normalized_score < KNOWLEDGE_MIN_SCORE:
+                break
+            results.append({
+                'category': row[0],
+                'kind': row[1],
+                'source_url': row[2],
+                'text': row[3],
+                'created_at': row[4],
+                'score': round(normalized_score, 3)
+            })
+            if len(results) >= top_k:
+                break
+    return results
+
+def format_knowledge_passages(results):
+    """Passages de la base locale numérotés avec leur origine, tels que transmis au modèle"""
+    passages = []
+    for i, result in enumerate(results, 1):
+        origin = f"Source : {result['source_url']}" if result['source_url'] else "Source : réponse précédente"
+        passages.append(
+            f"[{i}] {origin} (enregistré le {result['created_at'][:10]}, score {result['score']})\n{result['text']}"
+        )
+    return '\n\n'.join(passages)
+
+def knowledge_search_tool(category=None):
+    """Outil de recherche dans la base locale exposé à l'agent"""
+    async def search_local_knowledge(query: str) -> str:
+        results = await asyncio.to_thread(search_knowledge, query, category)
+        if not results:
+            return "Aucun passage pertinent dans la base locale : utilise la recherche web."
+        return format_knowledge_passages(results)
+
+    return StructuredTool.from_function(
+        coroutine=search_local_knowledge,
+        name=KNOWLEDGE_TOOL_NAME,
+        description=(
+            "Recherche dans la base de connaissances locale (pages officielles déjà consultées et réponses "
+            "précédentes) les passages pertinents pour une requête en français. Rapide et gratuit : "
+            "à utiliser avant toute recherche web."
+        )
+    )
+
+def ingest_agent_run(messages, answer, sources, category, question):
+    """Ajoute à la base les pages récupérées et la réponse finale d'une exécution"""
+    try:
+        outputs = {
+            message.tool_call_id: tool_output_text(message.content)
+            for message in messages if getattr(message, 'type', None) == 'tool'
+        }
+        pages = 0
+        for message in messages:
+            for call in getattr(message, 'tool_calls', None) or []:
+                url = (call.get('args') or {}).get('url')
+                text = outputs.get(call.get('id'), '')
+                if call['name'] not in PAGE_CONTENT_TOOLS or not url or text in REFUSED_TOOL_MESSAGES:
+                    continue
+                chunks = split_into_chunks(text)
+                if chunks:
+                    pages += add_knowledge(chunks, category, 'page', source_url=normalize_url(url), replace=True)
+        if not answer.startswith('❌'):
+            depends_on = [source['url'] for source in sources if source['verified']]
+            body = f"Question : {question}\n\n{strip_sources_section(answer)}"
+            pages += add_knowledge(split_into_chunks(body), category, 'answer', depends_on=depends_on)
+        logger.info(f"📚 {pages} passages ajoutés à la base de connaissances")
+    except Exception as e:
+        logger.error(f"Erreur d'alimentation de la base de connaissances: {str(e)}")
+
+def knowledge_stats():
+    """Nombre de passages par catégorie et par type"""
+    with knowledge_connect() as connection:
+        rows = connection.execute("SELECT category, kind, COUNT(*) FROM chunks GROUP BY category, kind").fetchall()
+    return [{'category': category or 'general', 'kind': kind, 'chunks': count} for category, kind, count in rows]
+
+# ============ FAQ PRÉ-CALCULÉES ============
+
+FAQ_CLAIM_TTL = 900  # Durée maximale de génération d'une FAQ réservée par une instance
+
+def normalize_question(text):
+    """Normalise une question (casse, accents, ponctuation) pour la comparer aux FAQ"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+def faq_key(category, question):
+    """Clé de stockage d'une FAQ"""
+    return f"{category}:{normalize_question(question)}"
+
+def faq_storage_key(key):
+    """Clé de la FAQ dans le cache partagé, commune à toutes les instances"""
+    return shared_cache.key('faq', key.split(':', 1)[0], key)
+
+def faq_storage_ttl():
+    """Conservation d'une FAQ : elle reste servie après FAQ_REFRESH_INTERVAL, le temps d'être régénérée"""
+    return max(2 * FAQ_REFRESH_INTERVAL, ANSWER_CACHE_RETENTION)
+
+def extract_markdown_links(text):
+    """Extrait les liens Markdown [titre](url) d'une réponse, sans doublons"""
+    links = []
+    seen = set()
+    for title, url in re.findall(r'\[([^\]]+)\]\((https?://[^)\s]+)\)', text or ''):
+        if url not in seen:
+            seen.add(url)
+            links.append({'title': title, 'url': url})
+    return links
+
+def load_faq_config():
+    """Charge la liste de FAQ depuis FAQ_CONFIG_PATH si configuré"""
+    if not FAQ_CONFIG_PATH:
+        return
+    try:
+        with open(FAQ_CONFIG_PATH, encoding='utf-8') as f:
+            config = json.load(f)
+        for category, questions in config.items():
+            FAQ_QUESTIONS[category] = list(questions)
+        logger.info(f"📋 Configuration FAQ chargée depuis {FAQ_CONFIG_PATH}")
+    except Exception as e:
+        logger.error(f"Erreur de lecture de la configuration FAQ {FAQ_CONFIG_PATH}: {str(e)}")
+
+def load_faq_store():
+    """Importe dans le cache partagé les réponses de la copie locale qui n'y sont pas encore
+
+    Avec le backend en mémoire, cette copie évite de tout régénérer à chaque redémarrage ;
+    avec sqlite ou redis, les réponses sont déjà partagées et seules les absentes sont importées.
+    """
+    try:
+        with open(FAQ_STORE_PATH, encoding='utf-8') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error(f"Erreur de lecture du stockage FAQ: {str(e)}")
+        return
+    imported = 0
+    for key, entry in entries.items():
+        storage_key = faq_storage_key(key)
+        if shared_cache.get(storage_key, counted=False) is None:
+            shared_cache.set(storage_key, entry, faq_storage_ttl())
+            imported += 1
+    logger.info(f"📋 {imported}/{len(entries)} réponses FAQ importées depuis {FAQ_STORE_PATH}")
+
+def save_faq_store():
+    """Copie locale des réponses pré-calculées (reprise au redémarrage avec le backend en mémoire)"""
+    entries = {faq_key(entry['category'], entry['question']): entry for _, entry in shared_cache.scan('faq')}
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_path = f"{FAQ_STORE_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, FAQ_STORE_PATH)
+
+def get_faq_entry(category, question):
+    return shared_cache.get(faq_storage_key(faq_key(category, question)))
+
+def find_faq_answer(user_message, category=None):
+    """Retourne la réponse pré-calculée correspondant à la question, s'il y en a une
+
+    La question est d'abord comparée à la liste des FAQ (en mémoire) : seules les questions
+    fréquentes donnent lieu à une lecture du cache partagé.
+    """
+    normalized = normalize_question(user_message)
+    for faq_category in ([category] if category else list(FAQ_QUESTIONS)):
+        for question in FAQ_QUESTIONS.get(faq_category, []):
+            if normalize_question(question) == normalized:
+                return get_faq_entry(faq_category, question)
+    return None
+
+def get_faq_entries(category):
+    """Liste les FAQ d'une catégorie avec leur réponse pré-calculée (ou None si pas encore générée)"""
+    return [
+        {'question': question, 'answer': get_faq_entry(category, question)}
+        for question in FAQ_QUESTIONS.get(category, [])
+    ]
+
+def faq_entry_answer(entry):
+    """Réponse structurée d'une FAQ pré-calculée (les anciennes entrées n'ont que le Markdown)"""
+    if 'answer' in entry:
+        return StructuredAnswer.model_validate(entry['answer'])
+    return parse_markdown_answer(entry['response'], entry['sources'])
+
+def build_faq_bundle(category):
+    """FAQ d'une catégorie prêtes à être servies hors ligne par l'interface web
+
+    Chaque entrée porte la question normalisée (`key`) pour que le navigateur retrouve
+    la réponse sans appel au serveur.
+    """
+    bundle = []
+    for item in get_faq_entries(category):
+        entry = item['answer']
+        if not entry:
+            continue
+        bundle.append({
+            'question': item['question'],
+            'key': normalize_question(item['question']),
+            **chat_payload(faq_entry_answer(entry), 'markdown'),
+            'generated_at': entry['generated_at']
+        })
+    return bundle
+
+async def generate_faq_answer(category, question):
+    """Exécute l'agent hors ligne pour une question fréquente"""
+    category_info = get_category_info(category)
+    context = f"Catégorie: {category_info['name']} - {category_info['description']}" if category_info else None
+    start_time = time.time()
+    run_info = {}
+    response = await get_agent_response(question, context, category, run_info=run_info)
+    if response.startswith('❌'):
+        raise RuntimeError(response)
+    if run_info.get('degraded'):
+        raise RuntimeError("Recherche web indisponible, réponse non vérifiée non enregistrée")
+    sources = [source for source in run_info['sources'] if source['verified']]
+    record_source_hits(run_info.get('visited_urls', []))
+    return {
+        'category': category,
+        'question': question,
+        'response': response,
+        'answer': parse_markdown_answer(response, sources).model_dump(),
+        'sources': sources,
+        'generated_at': datetime.now().isoformat(),
+        'generation_time': round(time.time() - start_time, 2)
+    }
+
+async def refresh_faq(categories=None, force=False):
+    """Génère les FAQ manquantes ou plus anciennes que FAQ_REFRESH_INTERVAL
+
+    Les réponses sont lues et écrites dans le cache partagé : une instance qui démarre ne
+    régénère que ce qui manque. Chaque génération est réservée (écriture atomique d'une clé
+    de réservation) pour que deux instances ne génèrent pas la même FAQ en même temps.
+    """
+    refreshed = 0
+    for category in categories or list(FAQ_QUESTIONS):
+        for question in FAQ_QUESTIONS.get(category, []):
+            key = faq_key(category, question)
+            storage_key = faq_storage_key(key)
+            entry = await asyncio.to_thread(shared_cache.get, storage_key, False)
+            if entry and not force:
+                age = (datetime.now() - datetime.fromisoformat(entry['generated_at'])).total_seconds()
+                if age < FAQ_REFRESH_INTERVAL:
+                    continue
+            claim_key = shared_cache.key('faq_claim', category, key)
+            if not await asyncio.to_thread(shared_cache.add, claim_key, {'pid': os.getpid()}, FAQ_CLAIM_TTL):
+                continue  # Générée par une autre instance
+            try:
+                new_entry = await generate_faq_answer(category, question)
+            except Exception as e:
+                logger.warning(f"⚠️ FAQ non générée ({category}: {question}): {str(e)[:200]}")
+                continue
+            finally:
+                await asyncio.to_thread(shared_cache.delete, claim_key)
+            await asyncio.to_thread(shared_cache.set, storage_key, new_entry, faq_storage_ttl())
+            await asyncio.to_thread(save_faq_store)
+            refreshed += 1
+            logger.info(f"✅ FAQ générée en {new_entry['generation_time']}s ({category}: {question})")
+    return refreshed
+
+faq_refresh_requested = threading.Event()
+
+def faq_refresh_worker():
+    """Tâche de fond : rafraîchit périodiquement les FAQ pré-calculées"""
+    while True:
+        faq_refresh_requested.clear()
+        try:
+            refreshed = run_in_agent_loop(refresh_faq())
+            logger.info(f"📋 Rafraîchissement FAQ terminé ({refreshed} réponses générées)")
+        except Exception as e:
+            logger.error(f"Erreur dans le rafraîchissement FAQ: {str(e)}")
+        # Vérifier au moins toutes les heures pour rattraper les échecs et les réponses expirées,
+        # ou immédiatement si des réponses ont été invalidées
+        faq_refresh_requested.wait(min(FAQ_REFRESH_INTERVAL, 3600))
+
+# ============ SURVEILLANCE DES SITES SOURCES ============
+
+site_watch_state = {}  # URL normalisée -> {etag, last_modified, content_hash, checked_at, changed_at}
+site_change_events = deque(maxlen=200)
+source_hits = Counter()  # URL normalisée -> nombre de réponses qui la citent
+site_watch_lock = threading.Lock()
+
+def normalize_url(url):
+    """Normalise une URL (schéma/hôte en minuscules, sans fragment, ni paramètres de tracking, ni / final)"""
+    parts = urlsplit((url or '').strip())
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not k.startswith('utm_')])
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ''))
+
+def record_source_hits(urls):
+    """Comptabilise les URLs citées dans une réponse pour choisir les pages à surveiller"""
+    with site_watch_lock:
+        source_hits.update(normalize_url(url) for url in urls)
+
+def get_watched_urls():
+    """URLs surveillées : sites de référence + sources les plus citées"""
+    urls = [normalize_url(site) for sites in REFERENCE_SITES.values() for site in sites]
+    with site_watch_lock:
+        urls += [url for url, _ in source_hits.most_common(SITE_WATCH_TOP_SOURCES)]
+    return list(dict.fromkeys(urls))
+
+def load_site_watch_state():
+    """Recharge l'état de surveillance depuis le disque"""
+    try:
+        with open(SITE_WATCH_STATE_PATH, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error(f"Erreur de lecture de l'état de surveillance: {str(e)}")
+        return
+    with site_watch_lock:
+        site_watch_state.update(data.get('state', {}))
+        site_change_events.extend(data.get('events', []))
+        source_hits.update(data.get('source_hits', {}))
+
+def save_site_watch_state():
+    """Sauvegarde l'état de surveillance sur le disque"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with site_watch_lock:
+        data = {
+            'state': dict(site_watch_state),
+            'events': list(site_change_events),
+            'source_hits': dict(source_hits)
+        }
+    tmp_path = f"{SITE_WATCH_STATE_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, SITE_WATCH_STATE_PATH)
+
+def page_content_hash(html):
+    """Empreinte du texte visible d'une page (scripts, styles et balises ignorés)"""
+    text = re.sub(r'<(script|style|noscript)\b.*?</\1>', ' ', html, flags=re.S | re.I)
+    text = re.sub(r'<[^>]+>', ' ', text)
+    text = ' '.join(text.split())
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def check_url_change(url):
+    """Vérifie si une page a changé (ETag/Last-Modified puis empreinte du contenu)"""
+    with site_watch_lock:
+        previous = dict(site_watch_state.get(url, {}))
+    
+    headers = {'User-Agent': 'Mozilla/5.0 (compatible; AssistantNouveauxArrivants/1.0)'}
+    if previous.get('etag'):
+        headers['If-None-Match'] = previous['etag']
+    if previous.get('last_modified'):
+        headers['If-Modified-Since'] = previous['last_modified']
+    
+    state = dict(previous, checked_at=datetime.now().isoformat())
+    changed = False
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=15) as response:
+            body = response.read(5 * 1024 * 1024).decode(response.headers.get_content_charset() or 'utf-8', errors='replace')
+            state['etag'] = response.headers.get('ETag')
+            state['last_modified'] = response.headers.get('Last-Modified')
+        content_hash = page_content_hash(body)
+        # Première vérification : on enregistre seulement la référence
+        changed = bool(previous.get('content_hash')) and previous['content_hash'] != content_hash
+        state['content_hash'] = content_hash
+        if changed:
+            state['changed_at'] = state['checked_at']
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            logger.warning(f"⚠️ Surveillance {url}: HTTP {e.code}")
+    
+    with site_watch_lock:
+        site_watch_state[url] = state
+    return changed
+
+def invalidate_source(url):
+    """Invalide uniquement les réponses en cache qui citent l'URL modifiée"""
+    url = normalize_url(url)
+    invalidated = []
+    for key, entry in shared_cache.scan('faq'):
+        if any(normalize_url(source['url']) == url for source in entry.get('sources', [])):
+            shared_cache.delete(key)
+            invalidated.append(key)
+    if invalidated:
+        save_faq_store()
+        faq_refresh_requested.set()
+    if KNOWLEDGE_ENABLED:
+        removed = remove_knowledge_for_url(url)
+        if removed:
+            logger.info(f"📚 {removed} passages de la base de connaissances supprimés ({url})")
+    for key, entry in shared_cache.scan('answer'):
+        if any(normalize_url(source['url']) == url for source in entry['answer']['sources']):
+            shared_cache.delete(key)
+            invalidated.append(key)
+    delete_cached_page(url)
+    return invalidated
+
+def check_watched_sites():
+    """Vérifie toutes les URLs surveillées et invalide les réponses dépendantes des pages modifiées"""
+    changes = 0
+    for url in get_watched_urls():
+        try:
+            if not check_url_change(url):
+                continue
+        except Exception as e:
+            logger.warning(f"⚠️ Surveillance {url} impossible: {str(e)[:200]}")
+            continue
+        invalidated = invalidate_source(url)
+        event = {
+            'url': url,
+            'detected_at': datetime.now().isoformat(),
+            'invalidated': invalidated
+        }
+        with site_watch_lock:
+            site_change_events.append(event)
+        changes += 1
+        logger.info(f"🔄 Changement détecté sur {url} ({len(invalidated)} réponses invalidées)")
+    save_site_watch_state()
+    return changes
+
+def site_watch_worker():
+    """Tâche de fond : surveille périodiquement les sites sources"""
+    while True:
+        try:
+            changes = check_watched_sites()
+            logger.info(f"🔄 Surveillance des sites terminée ({changes} changements)")
+        except Exception as e:
+            logger.error(f"Erreur dans la surveillance des sites: {str(e)}")
+        time.sleep(SITE_WATCH_INTERVAL)
+
+def preload_agent():
+    """Charge les bibliothèques de l'agent et résout le serveur MCP en tâche de fond"""
+    try:
+        get_model()
+        get_server_params()
+        startup_timings['agent_ready'] = round(time.perf_counter() - STARTUP_STARTED_AT, 3)
+        logger.info(f"⏱️ Agent prêt {startup_timings['agent_ready']}s après le lancement du processus")
+    except Exception as e:
+        logger.error(f"❌ Préchargement de l'agent échoué (chargement au premier message): {e}")
+
+def get_startup_report():
+    """Rapport de démarrage : durées des phases et mode de lancement du serveur MCP"""
+    return {
+        'timings': dict(startup_timings),
+        'agent_libraries_loaded': ChatAnthropic is not None,
+        'mcp_server_command': server_params.command if server_params is not None else None
+    }
+
+def start_background_jobs():
+    """Démarre les tâches de fond (préchargement de l'agent, pool MCP, pré-calcul des FAQ, surveillance des sites)"""
+    if AGENT_PRELOAD:
+        threading.Thread(target=preload_agent, name='agent-preload', daemon=True).start()
+    start_mcp_pool()
+    load_faq_config()
+    load_faq_store()
+    load_site_watch_state()
+    if FAQ_REFRESH_ENABLED:
+        threading.Thread(target=faq_refresh_worker, name='faq-refresh', daemon=True).start()
+        logger.info(f"📋 Pré-calcul des FAQ activé (rafraîchissement toutes les {FAQ_REFRESH_INTERVAL}s)")
+    if SITE_WATCH_ENABLED:
+        threading.Thread(target=site_watch_worker, name='site-watch', daemon=True).start()
+        logger.info(f"🔄 Surveillance des sites activée (vérification toutes les {SITE_WATCH_INTERVAL}s)")
+    startup_timings['http_ready'] = round(time.perf_counter() - STARTUP_STARTED_AT, 3)
+    logger.info(f"⏱️ Démarrage: imports {startup_timings['imports']}s, routes prêtes à {startup_timings['http_ready']}s")
+
+# ============ CLASSIFICATION DES ERREURS ET POLITIQUE DE RETRY ============
+
+class McpSessionUnavailable(Exception):
+    """Impossible d'ouvrir une session MCP (processus Node, npx ou handshake en échec)"""
+
+# Politique par classe d'erreur : nouvelle tentative de l'exécution (retry), reprise de l'étape en
+# échec seulement (resume), remplacement de la session MCP (reconnect), attente de base en secondes
+RETRY_POLICIES = {
+    'overloaded': {
+        'label': 'Service surchargé', 'retry': True, 'resume': True, 'reconnect': False, 'backoff': 2,
+        'message': "❌ Service temporairement surchargé. Le service de recherche web est actuellement très sollicité. Veuillez réessayer dans quelques minutes."
+    },
+    'rate_limit': {
+        'label': 'Rate limit atteint', 'retry': True, 'resume': True, 'reconnect': False, 'backoff': 1,
+        'message': "❌ Limite de requêtes atteinte. Trop de demandes simultanées. Veuillez patienter quelques secondes et réessayer."
+    },
+    'anthropic_unavailable': {
+        'label': 'Modèle injoignable', 'retry': True, 'resume': True, 'reconnect': False, 'backoff': 1,
+        'message': "❌ Le service IA est momentanément injoignable. Veuillez réessayer dans quelques instants.\n\nDétails: {details}"
+    },
+    'context_length': {
+        'label': 'Limite de tokens', 'retry': False, 'resume': False, 'reconnect': False, 'backoff': 0,
+        'message': "❌ Limite de tokens atteinte. Essayez une question plus courte ou plus spécifique.\n\nDétails: {details}"
+    },
+    'invalid_request': {
+        'label': 'Requête refusée par le modèle', 'retry': False, 'resume': False, 'reconnect': False, 'backoff': 0,
+        'message': "❌ Erreur lors du traitement de votre demande : {details}\n\nVeuillez vérifier que vos clés API sont correctement configurées dans le fichier .env"
+    },
+    'mcp_config': {
+        'label': 'Erreur de configuration MCP', 'retry': False, 'resume': False, 'reconnect': True, 'backoff': 0,
+        'message': "❌ Erreur de configuration MCP. Le serveur BrightData n'est pas compatible avec cette version. Veuillez contacter l'administrateur."
+    },
+    'mcp_session': {
+        'label': 'Erreur MCP/BrightData', 'retry': True, 'resume': False, 'reconnect': True, 'backoff': 0,
+        'message': "❌ Erreur de configuration des outils de recherche web. Veuillez réessayer dans quelques instants.\n\nDétails: {details}"
+    },
+    'unknown': {
+        'label': 'Erreur inconnue', 'retry': True, 'resume': False, 'reconnect': True, 'backoff': 1,
+        'message': "❌ Erreur lors du traitement de votre demande : {details}\n\nVeuillez vérifier que vos clés API sont correctement configurées dans le fichier .env"
+    }
+}
+MAX_RETRY_WAIT = 30  # Attente maximale entre deux tentatives, même si retry-after demande plus
+
+retry_stats = Counter()  # "classe:niveau" -> nombre (niveau : step, run ou reconnect)
+
+def classify_error(error):
+    """Classe d'une erreur d'après son type (SDK Anthropic, MCP, anyio) plutôt que son message"""
+    if isinstance(error, BaseExceptionGroup) and error.exceptions:
+        return classify_error(error.exceptions[0])
+    if anthropic is not None:
+        if isinstance(error, anthropic.RateLimitError):
+            return 'rate_limit'
+        if isinstance(error, anthropic.APIStatusError):
+            if error.status_code == 529:
+                return 'overloaded'
+            if error.status_code >= 500:
+                return 'anthropic_unavailable'
+            if error.status_code in (400, 413) and re.search(r'prompt is too long|context (window|length)|too many tokens', str(error), re.I):
+                return 'context_length'
+            return 'invalid_request'
+        if isinstance(error, anthropic.APIConnectionError):
+            return 'anthropic_unavailable'
+    if isinstance(error, McpSessionUnavailable):
+        # Échec d'ouverture d'une session dédiée : la cause garde sa classe (configuration MCP)
+        if error.__cause__ is not None and classify_error(error.__cause__) == 'mcp_config':
+            return 'mcp_config'
+        return 'mcp_session'
+    module = type(error).__module__ or ''
+    if module.startswith(('mcp', 'anyio')) or isinstance(error, (BrokenPipeError, ConnectionError, EOFError)):
+        if 'List roots not supported' in str(error):
+            return 'mcp_config'
+        return 'mcp_session'
+    return 'unknown'
+
+def retry_delay(error, policy, attempt):
+    """Attente avant une nouvelle tentative : en-tête retry-after de la réponse, sinon attente de la politique"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return min(float(headers['retry-after-ms']) / 1000, MAX_RETRY_WAIT)
+        if headers.get('retry-after'):
+            return min(float(headers['retry-after']), MAX_RETRY_WAIT)
+    except ValueError:
+        pass
+    return min(policy['backoff'] * attempt, MAX_RETRY_WAIT)
+
+def record_retry(error_class, level):
+    retry_stats[f"{error_class}:{level}"] += 1
+
+def get_retry_stats():
+    """Statistiques des nouvelles tentatives depuis le démarrage, par classe d'erreur et par niveau"""
+    by_class = {}
+    for key, count in retry_stats.items():
+        error_class, level = key.split(':')
+        by_class.setdefault(error_class, {})[level] = count
+    return {
+        'step_resumes': sum(count for key, count in retry_stats.items() if key.endswith(':step')),
+        'run_retries': sum(count for key, count in retry_stats.items() if key.endswith(':run')),
+        'session_reconnects': sum(count for key, count in retry_stats.items() if key.endswith(':reconnect')),
+        'by_class': by_class
+    }
+
+# ============ DISJONCTEURS ET MODE DÉGRADÉ ============
+
+class CircuitBreaker:
+    """Disjoncteur d'une dépendance externe
+
+    Fermé : les appels passent. Ouvert (après `threshold` échecs consécutifs) : les appels sont
+    refusés immédiatement pendant `reset_timeout` secondes. Semi-ouvert : un appel d'essai passe,
+    son succès referme le disjoncteur et son échec le rouvre.
+    """
+    def __init__(self, name, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.trial_started_at = 0
+        self.trips = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+    
+    def allow(self):
+        """Indique si un appel peut être tenté (passe en semi-ouvert à l'expiration du délai)"""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            now = time.time()
+            if self.state == 'open' and now - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                logger.info(f"🔌 Disjoncteur {self.name} semi-ouvert, essai de rétablissement")
+            # Un seul essai à la fois, renouvelé si le précédent n'a donné aucun résultat
+            if self.state == 'half_open' and now - self.trial_started_at >= self.reset_timeout:
+                self.trial_started_at = now
+                return True
+            self.rejected += 1
+            return False
+    
+    def release(self, since):
+        """Rend l'essai semi-ouvert commencé depuis `since` s'il s'est terminé sans résultat"""
+        with self.lock:
+            if self.state == 'half_open' and self.trial_started_at >= since:
+                self.trial_started_at = 0
+    
+    def record_success(self):
+        with self.lock:
+            if self.state != 'closed':
+                logger.info(f"✅ Disjoncteur {self.name} refermé, service rétabli")
+            self.state = 'closed'
+            self.failures = 0
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+                self.state = 'open'
+                self.opened_at = time.time()
+                self.trips += 1
+                logger.error(f"🔌 Disjoncteur {self.name} ouvert après {self.failures} échecs, appels suspendus {self.reset_timeout}s")
+    
+    def retry_after(self):
+        """Secondes avant le prochain essai de rétablissement (0 si fermé)"""
+        if self.state == 'closed':
+            return 0
+        return max(int(self.opened_at + self.reset_timeout - time.time()) + 1, 1)
+    
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'trips': self.trips,
+            'rejected': self.rejected,
+            'retry_after': self.retry_after()
+        }
+
+breakers = {
+    'brightdata': CircuitBreaker('brightdata'),  # Session MCP et appels d'outils
+    'anthropic': CircuitBreaker('anthropic')     # Appels au modèle
+}
+
+DEPENDENCY_NAMES = {'brightdata': 'recherche web BrightData', 'anthropic': 'modèle Claude'}
+
+def is_anthropic_outage(error):
+    """Erreur traduisant une indisponibilité d'Anthropic (connexion, délai, 5xx, 529) et non une requête invalide"""
+    return classify_error(error) in ('overloaded', 'anthropic_unavailable')
+
+def dependency_unavailable(name, run_info):
+    """Message d'erreur immédiat lorsqu'une dépendance est coupée par son disjoncteur"""
+    retry_after = breakers[name].retry_after()
+    run_info.update({'unavailable': name, 'retry_after': retry_after})
+    logger.warning(f"🔌 {DEPENDENCY_NAMES[name]} indisponible (disjoncteur ouvert), requête non transmise")
+    return f"❌ Service momentanément indisponible ({DEPENDENCY_NAMES[name]}). Veuillez réessayer dans {retry_after} secondes."
+
+DEGRADED_NOTICE = (
+    "> ⚠️ **Mode dégradé** : la recherche web en temps réel est momentanément indisponible. "
+    "Cette réponse n'a pas été vérifiée sur les sites officiels, confirmez les démarches avant de les engager.\n\n"
+)
+
+async def degraded_answer(user_message, context, category, system_prompt, run_info):
+    """Réponse du modèle sans outils web, appuyée sur la base de connaissances locale si elle est disponible"""
+    run_info.update({'degraded': 'brightdata', 'retry_after': breakers['brightdata'].retry_after()})
+    results = []
+    if KNOWLEDGE_ENABLED:
+        try:
+            results = await asyncio.to_thread(search_knowledge, user_message, category)
+        except Exception as e:
+            logger.warning(f"⚠️ Base de connaissances inaccessible en mode dégradé: {e}")
+    material = format_knowledge_passages(results) if results else "Aucun passage disponible dans la base locale."
+    
+    try:
+        reply = await get_model().ainvoke([
+            SystemMessage(content=system_prompt),
+            HumanMessage(content=(
+                f"Question : {user_message}\n\n"
+                + (f"Contexte supplémentaire : {context}\n\n" if context else "")
+                + f"Passages de la base locale (pages officielles consultées précédemment) :\n{material}\n\n"
+                "La recherche web est indisponible : réponds sans outils, à partir de ces passages et de tes "
+                "connaissances générales. Ne cite que des liens présents dans les passages ou les sites de "
+                "référence, et indique clairement ce qui doit être vérifié."
+            ))
+        ])
+    except Exception as e:
+        if is_anthropic_outage(e):
+            breakers['anthropic'].record_failure()
+            return dependency_unavailable('anthropic', run_info)
+        logger.error(f"Erreur en mode dégradé: {str(e)}")
+        return f"❌ Erreur lors du traitement de votre demande : {str(e)}"
+    breakers['anthropic'].record_success()
+    run_info['tokens'] = token_usage([reply])
+    
+    logger.warning("🔌 Réponse en mode dégradé (sans recherche web)")
+    seen = {normalize_url(result['source_url']) for result in results if result['source_url']}
+    sources = build_sources(reply.content, {}, seen)
+    run_info['sources'] = sources
+    return DEGRADED_NOTICE + strip_sources_section(reply.content) + render_sources_markdown(sources)
+
+def degraded_fallback(user_message, category, cache_key):
+    """Réponse de secours pendant une panne : FAQ pré-calculée (même avec contexte) ou cache expiré"""
+    faq_entry = find_faq_answer(user_message, category)
+    if faq_entry:
+        return faq_entry_answer(faq_entry)
+    return get_cached_answer(cache_key, allow_expired=True)
+
+# ============ BOUCLE DE L'AGENT ET POOL DE SESSIONS MCP ============
+
+agent_loop = None  # Boucle asyncio partagée par toutes les exécutions de l'agent
+agent_loop_thread = None
+agent_loop_lock = threading.Lock()
+agent_runs_active = 0
+
+def get_agent_loop():
+    """Boucle asyncio de l'agent, exécutée dans un thread dédié (démarrée au premier appel)"""
+    global agent_loop, agent_loop_thread
+    with agent_loop_lock:
+        if agent_loop is None:
+            agent_loop = asyncio.new_event_loop()
+            if PROFILING_TOKEN:
+                agent_loop.set_task_factory(profiling_task_factory)
+            agent_loop_thread = threading.Thread(target=agent_loop.run_forever, name='agent-loop', daemon=True)
+            agent_loop_thread.start()
+    return agent_loop
+
+def run_in_agent_loop(coro):
+    """Exécute une coroutine dans la boucle de l'agent et attend son résultat (depuis un thread Flask)"""
+    global agent_runs_active
+    with agent_loop_lock:
+        agent_runs_active += 1
+    try:
+        return asyncio.run_coroutine_threadsafe(coro, get_agent_loop()).result()
+    finally:
+        with agent_loop_lock:
+            agent_runs_active -= 1
+
+mcp_handshake = {}  # Dernier établissement de session MCP : ok, at, duration, error
+
+# Outils du navigateur qui ne modifient pas la page affichée
+BROWSER_READ_TOOLS = ('scraping_browser_links', 'scraping_browser_get_text', 'scraping_browser_get_html',
+                      'scraping_browser_screenshot', 'scraping_browser_wait_for')
+
+def browser_site_for(category):
+    """Site de référence (domaine) que l'agent ouvrira dans le navigateur pour cette catégorie"""
+    sites = REFERENCE_SITES.get(category) or []
+    return urlsplit(sites[0]).netloc.lower() if sites else None
+
+class BrowserState:
+    """État du navigateur distant d'une session MCP
+
+    Le serveur MCP garde un seul navigateur (et ses cookies, dont le consentement) par
+    processus entre les appels : il reste ouvert d'une requête à l'autre tant que la session
+    du pool vit. On en suit le site, la page courante et l'âge pour router les requêtes.
+    """
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        self.site = None
+        self.url = None
+        self.landing = None  # Résultat du dernier navigate, tant que la page n'a pas été modifiée
+        self.started_at = None
+        self.used_at = None
+        self.navigations = 0
+    
+    @property
+    def open(self):
+        return self.started_at is not None
+    
+    def expired(self):
+        return self.open and time.time() - self.started_at > BROWSER_SESSION_MAX_AGE
+    
+    def record(self, tool_name, arguments, content):
+        now = time.time()
+        if self.started_at is None:
+            self.started_at = now
+        self.used_at = now
+        if tool_name == 'scraping_browser_navigate':
+            self.url = normalize_url(arguments.get('url', ''))
+            self.site = urlsplit(self.url).netloc.lower() or None
+            self.landing = (content, now)
+            self.navigations += 1
+        elif tool_name not in BROWSER_READ_TOOLS:
+            self.landing = None
+    
+    def landing_page(self, url):
+        """Résultat du navigate précédent si le navigateur affiche encore cette page, inchangée"""
+        if not url or self.landing is None or normalize_url(url) != self.url:
+            return None
+        content, loaded_at = self.landing
+        if time.time() - loaded_at > BROWSER_PAGE_REUSE_TTL:
+            return None
+        self.used_at = time.time()
+        return content
+    
+    def stats(self):
+        return {
+            'site': self.site,
+            'age': round(time.time() - self.started_at) if self.open else None,
+            'navigations': self.navigations
+        }
+
+class McpSessionSlot:
+    """Session MCP maintenue ouverte par une tâche dédiée
+
+    Les contextes stdio_client/ClientSession doivent être ouverts et fermés dans la même
+    tâche : hold() les garde ouverts jusqu'à ce que `closing` soit positionné.
+    """
+    def __init__(self, pooled=True):
+        self.id = next(mcp_supervisor.ids)
+        self.pooled = pooled
+        self.in_use = False
+        self.retire_reason = None  # Limite de supervision dépassée : session à recycler
+        self.session = None
+        self.tools = []
+        self.error = None
+        self.uses = 0
+        self.created_at = time.time()
+        self.browser = BrowserState()
+        self.ready = asyncio.Event()
+        self.closing = asyncio.Event()
+        self.task = None
+    
+    @property
+    def usable(self):
+        return self.session is not None and self.retire_reason is None
+    
+    def retire(self, reason, detail):
+        """Demande le recyclage de la session : immédiat si elle est libre, à sa restitution sinon
+
+        `reason` : limite de supervision dépassée (rss, lifetime), processus disparus (dead) ou
+        erreur MCP pendant un appel d'outil (broken).
+        """
+        if self.retire_reason:
+            return
+        self.retire_reason = reason
+        mcp_supervisor.stats[f'recycled_{reason}'] += 1
+        logger.warning(f"♻️ Pool MCP: session {self.id} recyclée ({reason}: {detail})")
+        if not self.in_use:
+            self.closing.set()
+    
+    async def hold(self):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(mcp_supervisor.capacity.acquire(), MCP_POOL_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.error = McpChildLimitReached(f"{mcp_supervisor.max_children} sessions MCP déjà ouvertes (MCP_MAX_CHILDREN)")
+            self.ready.set()
+            return
+        mcp_supervisor.slots[self.id] = self
+        try:
+            async with stdio_client(mcp_supervisor.server_params(self.id)) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.tools = await load_mcp_tools(session)
+                    self.session = session
+                    mcp_handshake.update({'ok': True, 'at': datetime.now().isoformat(),
+                                          'duration': round(time.perf_counter() - started, 2), 'error': None})
+                    self.ready.set()
+                    await self.closing.wait()
+        except Exception as e:
+            self.error = e
+            if not self.ready.is_set():
+                mcp_handshake.update({'ok': False, 'at': datetime.now().isoformat(),
+                                      'duration': round(time.perf_counter() - started, 2), 'error': str(e)[:200]})
+        finally:
+            self.session = None
+            mcp_supervisor.slots.pop(self.id, None)
+            mcp_supervisor.capacity.release()
+            self.ready.set()
+    
+    async def open(self):
+        """Démarre la tâche de maintien et attend la fin de l'initialisation"""
+        self.task = asyncio.create_task(self.hold())
+        await self.ready.wait()
+        return self.session is not None
+
+class McpSessionPool:
+    """Pool de sessions MCP initialisées (processus Node, handshake et liste des outils déjà faits)
+
+    Chaque exécution de l'agent emprunte une session pour toute sa durée ; une session qui a
+    échoué est fermée et sa place rouverte en tâche de fond. Si aucune session n'est prête ou
+    si le pool reste saturé plus de MCP_POOL_ACQUIRE_TIMEOUT, une session dédiée est ouverte.
+    
+    Une requête qui ouvrira un site de référence dans le navigateur reçoit de préférence la
+    session dont le navigateur est déjà sur ce site (au plus BROWSER_MAX_CONTEXTS navigateurs
+    ouverts) ; un navigateur plus vieux que BROWSER_SESSION_MAX_AGE est réinitialisé en
+    fermant sa session.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.slots = set()
+        self.idle = None
+        self.waiting = 0
+        self.keepers = []
+        self.tools_checked = False  # Listes d'outils autorisés vérifiées sur la première session
+    
+    async def start(self):
+        self.idle = asyncio.Queue()
+        await asyncio.to_thread(load_agent_libraries)
+        self.keepers = [asyncio.create_task(self.keep_slot(index)) for index in range(self.size)]
+        logger.info(f"🔥 Pool MCP: ouverture de {self.size} sessions")
+    
+    async def keep_slot(self, index):
+        """Maintient une place du pool occupée par une session ouverte"""
+        delay = MCP_POOL_RETRY_DELAY
+        while True:
+            slot = McpSessionSlot()
+            if not await slot.open():
+                if not isinstance(slot.error, McpSessionUnavailable):
+                    breakers['brightdata'].record_failure()
+                logger.warning(f"⚠️ Pool MCP: session {index} indisponible ({str(slot.error)[:200]}), nouvel essai dans {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 300)
+                continue
+            delay = MCP_POOL_RETRY_DELAY
+            if not self.tools_checked:
+                self.tools_checked = True
+                gaps = tool_allowlist_gaps([tool.name for tool in slot.tools])
+                if gaps:
+                    logger.warning(f"⚠️ Navigateur sans outil de lecture pour les catégories: {', '.join(gaps)}")
+            self.slots.add(slot)
+            self.idle.put_nowait(slot)
+            await slot.task  # Jusqu'à la fermeture de la session
+            self.slots.discard(slot)
+    
+    def ready_count(self):
+        return sum(1 for slot in self.slots if slot.session is not None)
+    
+    def browser_count(self):
+        return sum(1 for slot in self.slots if slot.browser.open)
+    
+    def pick(self, slot, site):
+        """Choisit parmi les sessions libres celle dont le navigateur convient le mieux au site"""
+        candidates = [slot]
+        while not self.idle.empty():
+            candidates.append(self.idle.get_nowait())
+        candidates = [candidate for candidate in candidates if candidate.usable]
+        if not candidates:
+            return None
+        
+        def rank(candidate):
+            if candidate.browser.site == site:
+                return (0, 0)
+            if not candidate.browser.open:
+                # Nouveau navigateur seulement sous la limite ; sinon réutiliser le moins récent
+                return (1 if self.browser_count() < BROWSER_MAX_CONTEXTS else 3, 0)
+            return (2, candidate.browser.used_at or 0)
+        
+        best = min(candidates, key=rank)
+        for candidate in candidates:
+            if candidate is not best:
+                self.idle.put_nowait(candidate)
+        return best
+    
+    def try_acquire(self, site=None):
+        """Session libre du pool, sans attente ni session dédiée ; None si aucune n'est libre"""
+        if self.idle is None:
+            return None
+        while not self.idle.empty():
+            slot = self.idle.get_nowait()
+            if site:
+                slot = self.pick(slot, site)
+            if slot is not None and slot.usable:
+                slot.in_use = True
+                return slot
+        return None
+    
+    async def acquire(self, site=None):
+        if self.idle is not None and self.ready_count():
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + MCP_POOL_ACQUIRE_TIMEOUT
+                while True:
+                    slot = await asyncio.wait_for(self.idle.get(), max(deadline - time.monotonic(), 0))
+                    if site:
+                        slot = self.pick(slot, site)
+                    if slot is not None and slot.usable:
+                        slot.in_use = True
+                        return slot
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ Pool MCP saturé depuis {MCP_POOL_ACQUIRE_TIMEOUT}s, ouverture d'une session dédiée")
+            finally:
+                self.waiting -= 1
+        
+        slot = McpSessionSlot(pooled=False)
+        if not await slot.open():
+            if isinstance(slot.error, McpSessionUnavailable):
+                raise slot.error
+            breakers['brightdata'].record_failure()
+            raise McpSessionUnavailable(f"Session MCP impossible à ouvrir: {slot.error}") from slot.error
+        slot.in_use = True
+        return slot
+    
+    def release(self, slot, broken=False):
+        slot.uses += 1
+        slot.in_use = False
+        if slot.retire_reason:
+            broken = True
+        elif slot.browser.expired():
+            logger.info(f"🔄 Pool MCP: réinitialisation du navigateur ({slot.browser.site}, {slot.browser.navigations} navigations)")
+            broken = True
+        elif slot.pooled and slot.browser.open and self.browser_count() > BROWSER_MAX_CONTEXTS:
+            broken = self.close_oldest_browser(slot)
+        if slot.pooled and not broken and slot.usable:
+            self.idle.put_nowait(slot)
+        else:
+            slot.closing.set()
+    
+    def close_oldest_browser(self, slot):
+        """Au-delà de BROWSER_MAX_CONTEXTS, ferme la session libre dont le navigateur a servi le moins récemment
+
+        Retourne True si c'est la session `slot` (en cours de restitution) qui doit être fermée.
+        """
+        candidates = [slot]
+        while not self.idle.empty():
+            candidates.append(self.idle.get_nowait())
+        oldest = min((candidate for candidate in candidates if candidate.browser.open),
+                     key=lambda candidate: candidate.browser.used_at or 0)
+        logger.info(f"🔄 Pool MCP: plus de {BROWSER_MAX_CONTEXTS} navigateurs ouverts, fermeture de celui de {oldest.browser.site}")
+        for candidate in candidates[1:]:
+            if candidate is oldest:
+                candidate.closing.set()
+            else:
+                self.idle.put_nowait(candidate)
+        return oldest is slot
+    
+    @contextlib.asynccontextmanager
+    async def session(self, site=None, wait=True):
+        """Emprunte une session ; elle est fermée (et remplacée) si l'erreur la met en cause
+
+        Une erreur du modèle (surcharge, limite de débit...) laisse la session intacte ; une
+        erreur MCP, inconnue ou une annulation en cours d'appel la fait remplacer. `site` : domaine
+        que l'agent ouvrira dans le navigateur, pour réutiliser un navigateur déjà sur ce site.
+        Avec `wait=False`, seule une session libre du pool est empruntée, sinon None est fourni.
+        """
+        slot = await self.acquire(site) if wait else self.try_acquire(site)
+        if slot is None:
+            yield None
+            return
+        broken = True
+        try:
+            yield slot
+            broken = False
+        except Exception as e:
+            broken = RETRY_POLICIES[classify_error(e)]['reconnect']
+            raise
+        finally:
+            if broken or slot.retire_reason == 'broken':
+                record_retry('mcp_session', 'reconnect')
+            self.release(slot, broken)
+    
+    def stats(self):
+        idle = self.idle.qsize() if self.idle is not None else 0
+        ready = self.ready_count()
+        return {
+            'size': self.size,
+            'ready': ready,
+            'idle': idle,
+            'in_use': max(ready - idle, 0),
+            'queue_depth': self.waiting,
+            'active_runs': agent_runs_active,
+            'last_handshake': dict(mcp_handshake) or None,
+            'browsers': [slot.browser.stats() for slot in self.slots if slot.browser.open]
+        }
+
+mcp_pool = McpSessionPool(MCP_POOL_SIZE)
+
+def start_mcp_pool():
+    """Ouvre les sessions du pool et lance la supervision de leurs processus (tâches de fond de la boucle de l'agent)"""
+    asyncio.run_coroutine_threadsafe(mcp_supervisor.run(), get_agent_loop())
+    if MCP_POOL_SIZE > 0:
+        asyncio.run_coroutine_threadsafe(mcp_pool.start(), get_agent_loop())
+
+# ============ SUPERVISION DES PROCESSUS MCP ============
+
+class McpChildLimitReached(McpSessionUnavailable):
+    """Trop de processus MCP en cours (MCP_MAX_CHILDREN) pour en lancer un nouveau"""
+
+class McpSupervisor:
+    """Suivi des processus lancés par les sessions MCP (npx, node et leurs descendants)
+
+    Chaque session lance son serveur avec la variable MCP_SUPERVISOR_ENV_VAR (`<pid de l'API>-<id
+    de la session>`), héritée par tous ses descendants : le parcours de /proc retrouve ainsi
+    l'arbre de processus de chaque session, même quand npx a laissé un node orphelin.
+
+    Toutes les MCP_SUPERVISOR_INTERVAL secondes :
+    - une session dont les processus dépassent MCP_CHILD_MAX_RSS_MB, plus vieille que
+      MCP_CHILD_MAX_LIFETIME, ou ouverte sans plus aucun processus marqué (serveur mort ou
+      marque perdue), est recyclée (fermée tout de suite si libre, à sa restitution sinon) ;
+    - un processus marqué dont la session est fermée, ou lancé par une instance de l'API qui
+      n'existe plus, est arrêté (SIGTERM, puis SIGKILL au passage suivant).
+    Le nombre de sessions (donc d'arbres de processus) simultanées est limité à MCP_MAX_CHILDREN.
+    """
+    def __init__(self, max_children):
+        self.max_children = max_children
+        self.capacity = asyncio.Semaphore(max_children)
+        self.slots = {}  # id -> McpSessionSlot dont les processus sont en vie
+        self.ids = itertools.count(1)
+        self.processes = {}  # id de session -> [{pid, rss}] au dernier passage
+        self.terminating = {}  # pid -> date du SIGTERM
+        self.stats = Counter()
+        self.scanned_at = None
+        self.supported = os.path.isdir('/proc/self')
+    
+    def server_params(self, slot_id):
+        """Paramètres de lancement du serveur MCP marqués pour la session `slot_id`"""
+        params = get_server_params()
+        tag = {MCP_SUPERVISOR_ENV_VAR: f"{os.getpid()}-{slot_id}"}
+        return params.model_copy(update={'env': {**(params.env or {}), **tag}})
+    
+    @staticmethod
+    def read_process(pid):
+        """(marque, rss en octets) d'un processus, ou None s'il n'est pas marqué ou lisible"""
+        try:
+            with open(f'/proc/{pid}/environ', 'rb') as f:
+                environ = f.read()
+            marker = f"{MCP_SUPERVISOR_ENV_VAR}=".encode()
+            start = environ.find(marker)
+            if start < 0 or (start and environ[start - 1] != 0):
+                return None
+            tag = environ[start + len(marker):].split(b'\0', 1)[0].decode()
+            rss = 0
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss = int(line.split()[1]) * 1024
+                        break
+            return tag, rss
+        except (OSError, ValueError, UnicodeDecodeError):
+            return None
+    
+    def scan(self):
+        """Processus marqués, groupés par marque `<pid de l'API>-<id de session>`"""
+        tagged = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit() or int(entry) == os.getpid():
+                continue
+            info = self.read_process(int(entry))
+            if info:
+                tagged.setdefault(info[0], []).append({'pid': int(entry), 'rss': info[1]})
+        return tagged
+    
+    @staticmethod
+    def pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+    
+    def terminate(self, pid):
+        """SIGTERM, puis SIGKILL si le processus est toujours là au passage suivant"""
+        sent_at = self.terminating.get(pid)
+        sig = signal.SIGKILL if sent_at and time.time() - sent_at >= MCP_SUPERVISOR_INTERVAL else signal.SIGTERM
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            return
+        except PermissionError as e:
+            logger.warning(f"⚠️ Supervision MCP: impossible d'arrêter le processus {pid} ({e})")
+            return
+        self.terminating.setdefault(pid, time.time())
+        self.stats['reaped' if sig == signal.SIGTERM else 'killed'] += 1
+    
+    def check(self, tagged=None):
+        """Un passage de supervision (parcours de /proc, limites, processus orphelins)
+
+        Exécuté dans la boucle de l'agent (recyclage des sessions) ; `tagged` est le résultat de
+        scan(), fait au préalable hors de la boucle.
+        """
+        if tagged is None:
+            tagged = self.scan()
+        self.scanned_at = time.time()
+        own_prefix = f"{os.getpid()}-"
+        processes = {}
+        for tag, children in tagged.items():
+            owner, _, slot_id = tag.partition('-')
+            if tag.startswith(own_prefix) and slot_id.isdigit() and int(slot_id) in self.slots:
+                processes[int(slot_id)] = children
+                continue
+            # Session fermée (ou instance de l'API disparue) : ses processus n'ont plus de raison d'être
+            if tag.startswith(own_prefix) or (owner.isdigit() and not self.pid_alive(int(owner))):
+                for child in children:
+                    logger.warning(f"🧹 Supervision MCP: processus orphelin {child['pid']} arrêté ({tag})")
+                    self.terminate(child['pid'])
+        self.terminating = {pid: at for pid, at in self.terminating.items() if self.pid_alive(pid)}
+        self.processes = processes
+        
+        for slot_id, slot in list(self.slots.items()):
+            children = processes.get(slot_id)
+            rss = sum(child['rss'] for child in children or [])
+            if slot.session is not None and not children:
+                slot.retire('dead', "aucun processus marqué")
+            elif rss > MCP_CHILD_MAX_RSS_MB * 1024 * 1024:
+                slot.retire('rss', f"{rss // (1024 * 1024)} Mo")
+            elif time.time() - slot.created_at > MCP_CHILD_MAX_LIFETIME:
+                slot.retire('lifetime', f"{int(time.time() - slot.created_at)}s")
+    
+    async def run(self):
+        if not self.supported:
+            logger.info("ℹ️ Supervision MCP: /proc indisponible, seule la limite de processus s'applique")
+            return
+        while True:
+            try:
+                self.check(await asyncio.to_thread(self.scan))
+            except Exception as e:
+                logger.warning(f"⚠️ Supervision MCP: passage échoué ({e})")
+            await asyncio.sleep(MCP_SUPERVISOR_INTERVAL)
+    
+    def report(self):
+        sessions = []
+        for slot_id, children in sorted(self.processes.items()):
+            slot = self.slots.get(slot_id)
+            sessions.append({
+                'id': slot_id,
+                'pids': [child['pid'] for child in children],
+                'rss_mb': round(sum(child['rss'] for child in children) / (1024 * 1024), 1),
+                'age': round(time.time() - slot.created_at) if slot else None,
+                'in_use': bool(slot and slot.in_use)
+            })
+        return {
+            'supported': self.supported,
+            'sessions_open': len(self.slots),
+            'max_sessions': self.max_children,
+            'processes': sum(len(session['pids']) for session in sessions),
+            'rss_mb': round(sum(session['rss_mb'] for session in sessions), 1),
+            'limits': {'rss_mb': MCP_CHILD_MAX_RSS_MB, 'lifetime': MCP_CHILD_MAX_LIFETIME},
+            'sessions': sessions,
+            'recycled': {reason: self.stats[f'recycled_{reason}'] for reason in ('rss', 'lifetime', 'dead', 'broken')},
+            'orphans_reaped': self.stats['reaped'],
+            'orphans_killed': self.stats['killed'],
+            'scanned_at': datetime.fromtimestamp(self.scanned_at).isoformat(timespec='seconds') if self.scanned_at else None
+        }
+
+mcp_supervisor = McpSupervisor(max(MCP_MAX_CHILDREN, MCP_POOL_SIZE, 1))
+
+# ============ PRÉCHAUFFAGE ============
+
+prewarm_state = {}  # catégorie -> dernier préchauffage (requested_at, status, duration, pages, browser)
+prewarm_lock = threading.Lock()
+
+def request_prewarm(category, usage):
+    """Lance le préchauffage d'une catégorie en tâche de fond
+
+    Retourne False (sans rien lancer) si la catégorie a été préchauffée il y a moins de
+    PREWARM_INTERVAL secondes.
+    """
+    now = time.time()
+    with prewarm_lock:
+        last = prewarm_state.get(category)
+        if last and now - last['requested_at'] < PREWARM_INTERVAL:
+            return False
+        prewarm_state[category] = {'requested_at': now, 'status': 'running'}
+    asyncio.run_coroutine_threadsafe(prewarm_category(category, usage), get_agent_loop())
+    return True
+
+async def prewarm_category(category, usage):
+    """Prépare l'exécution de l'agent pour une catégorie pendant que l'utilisateur saisit sa question
+
+    Charge le modèle, génère le prompt système et la liste des outils autorisés, puis, sur une
+    session libre du pool : récupère les pages des sites de référence dans le cache des pages
+    et ouvre la première dans le navigateur de la session, que le pool réservera ensuite aux
+    requêtes de cette catégorie. Rien n'est fait côté BrightData si aucune session n'est libre
+    ou si son disjoncteur n'est pas fermé : le préchauffage ne doit pas retarder une requête.
+    """
+    started = time.perf_counter()
+    state = {'status': 'done', 'pages': 0, 'browser': False}
+    budget = RunBudget(get_agent_budget(category))
+    try:
+        await asyncio.to_thread(get_model)
+        system_prompt = generate_system_prompt(category)
+        sites = (REFERENCE_SITES.get(category) or [])[:PREWARM_MAX_PAGES]
+        if not sites:
+            state['status'] = 'no_reference_sites'
+        elif breakers['brightdata'].state != 'closed':
+            state['status'] = 'brightdata_unavailable'
+        else:
+            async with mcp_pool.session(browser_site_for(category), wait=False) as slot:
+                if slot is None:
+                    state['status'] = 'pool_busy'
+                else:
+                    tools = {tool.name: budgeted_tool(tool, budget, slot)
+                             for tool in filter_tools_for_category(slot.tools, category, system_prompt)}
+                    if 'scrape_as_markdown' in tools:
+                        for url in sites:
+                            await tools['scrape_as_markdown'].coroutine(url=url)
+                            state['pages'] += 1
+                    if 'scraping_browser_navigate' in tools and slot.browser.landing_page(sites[0]) is None:
+                        await tools['scraping_browser_navigate'].coroutine(url=sites[0])
+                        state['browser'] = True
+    except Exception as e:
+        state.update(status='error', error=str(e)[:200])
+        logger.warning(f"⚠️ Préchauffage {category} échoué: {e}")
+    
+    state['duration'] = round(time.perf_counter() - started, 2)
+    with prewarm_lock:
+        prewarm_state[category].update(state)
+    logger.info(f"🔥 Préchauffage {category}: {state['status']} ({state['pages']} pages, navigateur: {state['browser']}, {state['duration']}s)")
+    
+    stats = budget.tools.values()
+    usage.update({
+        'category': category,
+        'source': 'prewarm',
+        'tool_calls': budget.tool_calls,
+        'cached_tool_calls': sum(tool_stats.get('cached', 0) for tool_stats in stats),
+        'tools': budget.tools,
+        'scraped_bytes': budget.scraped_bytes,
+        'timings': {'prewarm': state['duration']}
+    })
+    await asyncio.to_thread(record_usage, usage, 200 if state['status'] != 'error' else 500)
+
+def get_prewarm_stats():
+    with prewarm_lock:
+        return {category: dict(state) for category, state in prewarm_state.items()}
+
+# ============ PROFILAGE À LA DEMANDE ============
+
+current_profile = contextvars.ContextVar('current_profile', default=None)  # Profil de l'exécution en cours
+task_profiles = weakref.WeakKeyDictionary()  # Tâche asyncio -> profil de l'exécution qui l'a créée
+armed_profiles = 0  # Prochaines exécutions à profiler (armées par /api/admin/profile)
+armed_profiles_lock = threading.Lock()
+tracemalloc_users = 0  # Profils en cours qui suivent les allocations
+
+def profiling_task_factory(loop, coro, context=None):
+    """Fabrique de tâches de la boucle de l'agent : rattache chaque tâche au profil de l'exécution qui la crée"""
+    task = asyncio.Task(coro, loop=loop, context=context)
+    profiler = context.get(current_profile) if context is not None else current_profile.get()
+    if profiler is not None:
+        task_profiles[task] = profiler
+    return task
+
+def profiling_authorized(token):
+    return bool(PROFILING_TOKEN) and hmac.compare_digest(token or '', PROFILING_TOKEN)
+
+def arm_profiles(runs):
+    global armed_profiles
+    with armed_profiles_lock:
+        armed_profiles = runs
+    return runs
+
+def take_armed_profile():
+    global armed_profiles
+    with armed_profiles_lock:
+        if armed_profiles <= 0:
+            return False
+        armed_profiles -= 1
+        return True
+
+@contextlib.contextmanager
+def profile_span(kind, name, **details):
+    """Intervalle de la chronologie du profil en cours (sans effet hors profilage)"""
+    profiler = current_profile.get()
+    if profiler is None:
+        yield None
+        return
+    span = {'kind': kind, 'name': name, 'start': profiler.elapsed(), **details}
+    try:
+        yield span
+    finally:
+        span['end'] = profiler.elapsed()
+        profiler.spans.append(span)
+
+def profile_mark(kind, name, **details):
+    """Événement ponctuel de la chronologie du profil en cours"""
+    profiler = current_profile.get()
+    if profiler is not None:
+        profiler.spans.append({'kind': kind, 'name': name, 'start': profiler.elapsed(), **details})
+
+class RunProfiler:
+    """Profil d'une exécution de l'agent
+
+    - Échantillonnage CPU : toutes les PROFILE_SAMPLE_INTERVAL secondes, la pile du thread de la
+      boucle est relevée si la tâche en cours appartient à l'exécution (sinon l'échantillon compte
+      comme attente d'E/S ou comme travail d'une autre requête).
+    - Chronologie : tâches asyncio de l'exécution vues par l'échantillonneur, et intervalles
+      explicites (prompt, session MCP, étapes de l'agent, appels d'outils).
+    - Allocations : tracemalloc pendant l'exécution (PROFILE_TRACEMALLOC), avec la mémoire allouée
+      par chaque sortie d'outil ; les plus volumineuses sont conservées.
+    """
+    def __init__(self, label):
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(3)}"
+        self.label = label
+        self.spans = []
+        self.stacks = Counter()  # Pile repliée (racine;...;feuille) -> échantillons
+        self.samples = Counter()  # run / idle / other
+        self.tasks = {}  # Nom de la tâche -> première et dernière apparition, échantillons
+        self.payloads = []  # Sorties d'outils : taille et mémoire allouée
+        self.started = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.tracing = False
+    
+    def elapsed(self):
+        return round(time.perf_counter() - self.started, 4)
+    
+    def start(self):
+        global tracemalloc_users
+        self.started = time.perf_counter()
+        if PROFILE_TRACEMALLOC:
+            with armed_profiles_lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+                tracemalloc_users += 1
+            tracemalloc.reset_peak()
+            self.tracing = True
+        self.thread = threading.Thread(target=self.sample_loop, name=f'profiler-{self.id}', daemon=True)
+        self.thread.start()
+    
+    def sample_loop(self):
+        loop_thread_id = agent_loop_thread.ident
+        while not self.stop_event.wait(PROFILE_SAMPLE_INTERVAL):
+            task = asyncio.current_task(agent_loop)
+            if task is None:
+                self.samples['idle'] += 1
+                continue
+            if task_profiles.get(task) is not self:
+                self.samples['other'] += 1
+                continue
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is None:
+                continue
+            self.samples['run'] += 1
+            stack = []
+            # Pile de la tâche seulement : on s'arrête au rappel de la boucle qui l'exécute
+            while frame is not None and not (frame.f_code.co_name == '_run' and frame.f_code.co_filename == asyncio.events.__file__):
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            name = task.get_name()
+            entry = self.tasks.setdefault(name, {'coroutine': getattr(task.get_coro(), '__qualname__', '?'),
+                                                 'first': self.elapsed(), 'samples': 0})
+            entry['last'] = self.elapsed()
+            entry['samples'] += 1
+    
+    def record_payload(self, tool_name, arguments, size, allocated):
+        self.payloads.append({'tool': tool_name, 'arguments': {key: str(value)[:200] for key, value in arguments.items()},
+                              'bytes': size, 'allocated_bytes': allocated})
+        self.payloads = sorted(self.payloads, key=lambda payload: payload['bytes'], reverse=True)[:PROFILE_MAX_PAYLOADS]
+    
+    def stop(self):
+        global tracemalloc_users
+        duration = self.elapsed()
+        self.stop_event.set()
+        self.thread.join()
+        memory = None
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            memory = {
+                'traced_current': current,
+                'traced_peak': peak,
+                'top_allocations': [
+                    {'location': str(stat.traceback), 'size': stat.size, 'count': stat.count}
+                    for stat in snapshot.statistics('lineno')[:PROFILE_TOP]
+                ]
+            }
+            with armed_profiles_lock:
+                tracemalloc_users -= 1
+                if tracemalloc_users == 0:
+                    tracemalloc.stop()
+        return duration, memory
+    
+    def cpu_summary(self):
+        """Fonctions les plus présentes dans les échantillons : en propre (feuille) et cumulé"""
+        own, cumulative = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                cumulative[frame] += count
+        total = max(self.samples['run'], 1)
+        return {
+            'self': [{'function': name, 'samples': count, 'share': round(count / total, 3)}
+                     for name, count in own.most_common(PROFILE_TOP)],
+            'cumulative': [{'function': name, 'samples': count, 'share': round(count / total, 3)}
+                           for name, count in cumulative.most_common(PROFILE_TOP)]
+        }
+    
+    def save(self, duration, memory):
+        """Écrit le profil (JSON) et les piles repliées (.folded, pour flamegraph.pl ou speedscope)"""
+        artifact = {
+            'id': self.id,
+            'label': self.label,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'duration': duration,
+            'sample_interval': PROFILE_SAMPLE_INTERVAL,
+            'samples': dict(self.samples),
+            'cpu': self.cpu_summary(),
+            'timeline': {
+                'spans': sorted(self.spans, key=lambda span: span['start']),
+                'tasks': self.tasks
+            },
+            'largest_payloads': self.payloads,
+            'memory': memory
+        }
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        with open(os.path.join(PROFILES_DIR, f'{self.id}.json'), 'w', encoding='utf-8') as f:
+            json.dump(artifact, f, ensure_ascii=False, indent=1)
+        with open(os.path.join(PROFILES_DIR, f'{self.id}.folded'), 'w', encoding='utf-8') as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        
+        # Seuls les PROFILES_MAX profils les plus récents sont conservés
+        for old in list_profiles()[PROFILES_MAX:]:
+            for extension in ('.json', '.folded'):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(PROFILES_DIR, old['id'] + extension))
+        
+        logger.info(f"🔬 Profil {self.id} enregistré ({duration}s, {self.samples['run']} échantillons)")
+        return {'id': self.id, 'url': f'/api/admin/profiles/{self.id}'}
+
+async def run_profiled(coro, run_info, label):
+    """Exécute `coro` (get_agent_response) en la profilant ; run_info['profile'] reçoit l'identifiant du profil"""
+    profiler = RunProfiler(label)
+    current_profile.set(profiler)
+    task_profiles[asyncio.current_task()] = profiler
+    profiler.start()
+    try:
+        return await coro
+    finally:
+        duration, memory = await asyncio.to_thread(profiler.stop)
+        try:
+            run_info['profile'] = await asyncio.to_thread(profiler.save, duration, memory)
+        except OSError as e:
+            logger.warning(f"⚠️ Profil {profiler.id} non enregistré: {e}")
+
+def list_profiles():
+    """Profils enregistrés, du plus récent au plus ancien"""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(PROFILES_DIR):
+        if name.endswith('.json'):
+            path = os.path.join(PROFILES_DIR, name)
+            profiles.append({'id': name[:-5], 'size': os.path.getsize(path), 'mtime': os.path.getmtime(path)})
+    return sorted(profiles, key=lambda profile: profile['mtime'], reverse=True)
+
+# ============ FUSION DES REQUÊTES IDENTIQUES ============
+
+inflight_runs = {}  # clé normalisée -> Future partagée par les requêtes identiques en cours
+inflight_lock = threading.Lock()
+
+def run_agent_coalesced(user_message, context=None, category=None, enriched_context=None, events=None, profile=False):
+    """Exécute get_agent_response une seule fois pour des requêtes identiques simultanées
+
+    La première requête exécute l'agent ; les requêtes identiques (message, catégorie et
+    contexte normalisés) arrivées pendant l'exécution attendent et reçoivent son résultat.
+    `events` (queue.Queue) reçoit la progression de l'exécution si cette requête la mène.
+    Avec `profile` (ou un profilage armé par /api/admin/profile), l'exécution est profilée ;
+    une requête à profiler ne rejoint pas une exécution déjà en cours.
+    Retourne (réponse, run_info, coalesced).
+    """
+    key = answer_cache_key(user_message, category, context)
+    with inflight_lock:
+        future = None if profile else inflight_runs.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = concurrent.futures.Future()
+            if not profile:
+                inflight_runs[key] = future
+    
+    if not is_leader:
+        logger.info("🔗 Requête identique déjà en cours, attente de son résultat")
+        response, run_info = future.result()
+        return response, dict(run_info), True
+    
+    try:
+        run_info = {'events': events} if events is not None else {}
+        run = get_agent_response(
+            user_message, enriched_context if enriched_context is not None else context, category, run_info=run_info
+        )
+        if profile or (PROFILING_TOKEN and take_armed_profile()):
+            run = run_profiled(run, run_info, f"{category or 'general'}: {user_message[:80]}")
+        response = run_in_agent_loop(run)
+        run_info.pop('events', None)
+        future.set_result((response, run_info))
+        return response, run_info, False
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with inflight_lock:
+            if inflight_runs.get(key) is future:
+                del inflight_runs[key]
+
+# ============ RAFRAÎCHISSEMENT DES RÉPONSES PÉRIMÉES ============
+
+refreshing_answers = set()  # Clés des réponses en cours de rafraîchissement
+refresh_lock = threading.Lock()
+refresh_stats = {'started': 0, 'refreshed': 0, 'failed': 0, 'skipped_busy': 0}
+
+def request_answer_refresh(cache_key, user_message, context, category, enriched_context, usage):
+    """Rafraîchit en tâche de fond une réponse servie périmée
+
+    Une seule exécution par clé ; au-delà de ANSWER_REFRESH_CONCURRENCY rafraîchissements en
+    cours, la demande est ignorée (la prochaine requête identique la renouvellera).
+    Retourne True si le rafraîchissement a été lancé.
+    """
+    with refresh_lock:
+        if cache_key in refreshing_answers:
+            return False
+        if len(refreshing_answers) >= ANSWER_REFRESH_CONCURRENCY:
+            refresh_stats['skipped_busy'] += 1
+            return False
+        refreshing_answers.add(cache_key)
+        refresh_stats['started'] += 1
+    threading.Thread(
+        target=refresh_cached_answer,
+        args=(cache_key, user_message, context, category, enriched_context, usage),
+        name='answer-refresh', daemon=True
+    ).start()
+    return True
+
+def refresh_cached_answer(cache_key, user_message, context, category, enriched_context, usage):
+    """Exécute l'agent pour une réponse périmée et remplace l'entrée du cache
+
+    L'exécution passe par la fusion des requêtes : une requête identique arrivée entre-temps
+    attend ce résultat au lieu de relancer l'agent. Une réponse en erreur ou dégradée ne
+    remplace pas l'ancienne.
+    """
+    usage['started'] = time.perf_counter()
+    status = 200
+    try:
+        response, run_info, coalesced = run_agent_coalesced(user_message, context, category, enriched_context)
+        usage.update(run_usage(run_info, coalesced))
+        if response.startswith('❌') or run_info.get('degraded') or run_info.get('unavailable'):
+            raise RuntimeError(response[:200] if response.startswith('❌') else "recherche web indisponible")
+        if not coalesced:
+            record_source_hits(run_info.get('visited_urls', []))
+            set_cached_answer(cache_key, parse_markdown_answer(response, run_info['sources']))
+        with refresh_lock:
+            refresh_stats['refreshed'] += 1
+        logger.info(f"🔄 Réponse périmée rafraîchie ({category or 'general'}: {user_message[:60]})")
+    except Exception as e:
+        status = 500
+        with refresh_lock:
+            refresh_stats['failed'] += 1
+        logger.warning(f"⚠️ Rafraîchissement de la réponse échoué ({category or 'general'}): {str(e)[:200]}")
+    finally:
+        with refresh_lock:
+            refreshing_answers.discard(cache_key)
+        record_usage(usage, status)
+
+def get_answer_refresh_stats():
+    with refresh_lock:
+        return {
+            **refresh_stats,
+            'running': len(refreshing_answers),
+            'limit': ANSWER_REFRESH_CONCURRENCY,
+            'ttl': ANSWER_CACHE_TTL,
+            'stale_ttl': ANSWER_CACHE_STALE_TTL
+        }
+
+# ============ JOURNAL D'USAGE ============
+
+usage_log_lock = threading.Lock()
+
+def start_usage(endpoint):
+    """Début d'un enregistrement d'usage pour la requête HTTP en cours"""
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'endpoint': endpoint,
+        'client_id': (request.headers.get('X-Client-Id') or 'anonyme')[:64],
+        'started': time.perf_counter()
+    }
+
+def run_usage(run_info, coalesced):
+    """Consommation d'une exécution de l'agent (nulle pour une requête fusionnée avec une autre)"""
+    budget = run_info.get('budget') or {}
+    return {
+        'coalesced': coalesced,
+        'attempts': run_info.get('attempts', 0),
+        'tool_calls': 0 if coalesced else budget.get('tool_calls', 0),
+        'cached_tool_calls': 0 if coalesced else sum(stats.get('cached', 0) for stats in run_info.get('tools', {}).values()),
+        'tools': {} if coalesced else run_info.get('tools', {}),
+        'scraped_bytes': 0 if coalesced else budget.get('scraped_bytes', 0),
+        'tokens': {'input': 0, 'output': 0} if coalesced else run_info.get('tokens', {'input': 0, 'output': 0}),
+        'budget_exhausted': budget.get('exhausted'),
+        'degraded': bool(run_info.get('degraded')),
+        'timings': run_info.get('timings', {})
+    }
+
+def record_usage(usage, status):
+    """Ajoute une ligne au journal d'usage (JSON lines, renommé en .1 au-delà de USAGE_LOG_MAX_BYTES)"""
+    if not USAGE_LOG_ENABLED:
+        return
+    entry = {key: value for key, value in usage.items() if key != 'started'}
+    entry['status'] = status
+    entry.setdefault('source', 'error')
+    entry['timings'] = {**entry.get('timings', {}), 'total': round(time.perf_counter() - usage['started'], 3)}
+    line = json.dumps(entry, ensure_ascii=False) + '\n'
+    try:
+        with usage_log_lock:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            if os.path.exists(USAGE_LOG_PATH) and os.path.getsize(USAGE_LOG_PATH) > USAGE_LOG_MAX_BYTES:
+                os.replace(USAGE_LOG_PATH, USAGE_LOG_PATH + '.1')
+            with open(USAGE_LOG_PATH, 'a', encoding='utf-8') as f:
+                f.write(line)
+    except OSError as e:
+        logger.warning(f"⚠️ Journal d'usage non écrit: {e}")
+
+# ============ CACHE HTTP ET COMPRESSION ============
+
+static_payloads = {}  # nom -> (corps JSON, ETag), calculés une seule fois
+compressed_payloads = {}  # (ETag, encodage) -> corps compressé
+
+def invalidate_static_payloads():
+    """Force le recalcul des réponses statiques après un changement de configuration"""
+    static_payloads.clear()
+    compressed_payloads.clear()
+
+def json_response_with_etag(body, etag, max_age):
+    """Réponse JSON avec ETag et Cache-Control, 304 si le client a déjà cette version"""
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)  # Faible : identique quel que soit l'encodage de compression
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+def conditional_json_response(data, max_age=0):
+    """Réponse JSON conditionnelle pour un contenu calculé à chaque appel"""
+    body = app.json.dumps(data).encode('utf-8')
+    return json_response_with_etag(body, hashlib.sha1(body).hexdigest(), max_age)
+
+def static_json_response(name, builder, max_age=STATIC_CACHE_MAX_AGE):
+    """Réponse JSON précalculée : `builder` n'est appelé qu'au premier appel"""
+    payload = static_payloads.get(name)
+    if payload is None:
+        body = app.json.dumps(builder()).encode('utf-8')
+        payload = static_payloads[name] = (body, hashlib.sha1(body).hexdigest())
+    return json_response_with_etag(*payload, max_age)
+
+def compress_body(data, encoding):
+    """Compresse un corps de réponse en gzip ou brotli"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+@app.after_request
+def compress_response(response):
+    """Compresse les réponses volumineuses selon l'en-tête Accept-Encoding du client"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+    
+    etag, _ = response.get_etag()
+    if etag:
+        # Réponses statiques : compresser une seule fois par version
+        key = (etag, encoding)
+        if key not in compressed_payloads:
+            if len(compressed_payloads) >= 256:
+                compressed_payloads.clear()
+            compressed_payloads[key] = compress_body(data, encoding)
+        compressed = compressed_payloads[key]
+    else:
+        compressed = compress_body(data, encoding)
+    
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.after_request
+def set_default_cache_control(response):
+    """Les réponses sans politique explicite (chat, erreurs) ne sont pas mises en cache"""
+    if 'Cache-Control' not in response.headers:
+        response.cache_control.no_store = True
+    return response
+
+# ============ ROUTES WEB ============
+
+@app.route('/')
+def index():
+    """Page d'accueil avec interface web"""
+    response = make_response(render_template('index.html', answer_cache_ttl=ANSWER_CACHE_TTL))
+    response.add_etag()
+    response.cache_control.no_cache = True  # Toujours revalider, 304 si inchangée
+    return response.make_conditional(request)
+
+@app.route('/sw.js')
+def service_worker():
+    """Service worker de l'interface web, servi à la racine pour couvrir tout le site"""
+    response = send_from_directory(app.static_folder, 'sw.js', mimetype='application/javascript')
+    response.cache_control.no_cache = True  # Les navigateurs doivent voir les nouvelles versions
+    return response
+
+# ============ API ENDPOINTS ============
+
+# Partie statique du statut (configuration du modèle et des limites)
+STATUS_INFO = {
+    'version': '1.0.0',
+    'service': 'Assistant Nouveaux Arrivants France',
+    'model_config': {
+        'model': MODEL_CONFIG['model'],
+        'max_tokens_output': MODEL_CONFIG['max_tokens'],
+        'max_tokens_context': 200000,
+        'temperature': 0.1,
+        'timeout': '60s'
+    },
+    'token_limits': {
+        'prompt_system_approx': '~2000 tokens',
+        'user_message_max': '~7500 tokens', 
+        'total_context_max': '200k tokens',
+        'response_max': '6k tokens'
+    },
+    'retry_system': {
+        'max_retries': 3,
+        'step_retries': MAX_STEP_RETRIES,
+        'model_call_retries': MODEL_CONFIG['max_retries'],
+        'policies': {
+            name: {key: policy[key] for key in ('retry', 'resume', 'reconnect', 'backoff')}
+            for name, policy in RETRY_POLICIES.items()
+        }
+    },
+    'agent_budgets': AGENT_BUDGETS
+}
+
+@app.route('/api/status', methods=['GET'])
+def api_status():
+    """Endpoint pour vérifier le statut de l'API"""
+    response = jsonify({
+        'status': 'active',
+        'timestamp': datetime.now().isoformat(),
+        **STATUS_INFO,
+        'knowledge': knowledge_stats() if KNOWLEDGE_ENABLED else None,
+        'startup': get_startup_report(),
+        'mcp_pool': mcp_pool.stats(),
+        'mcp_processes': mcp_supervisor.report(),
+        'circuits': {name: breaker.stats() for name, breaker in breakers.items()},
+        'retries': get_retry_stats(),
+        'cache': shared_cache.get_stats(),
+        'answer_refresh': get_answer_refresh_stats(),
+        'prewarm': get_prewarm_stats()
+    })
+    response.cache_control.no_cache = True
+    return response
+
+model_probe = {}  # Dernier résultat de la sonde Anthropic : ok, at, checked, duration, error
+model_probe_lock = threading.Lock()
+
+def probe_model():
+    """Vérifie que l'API Anthropic répond et accepte la clé (résultat mis en cache READINESS_CACHE_TTL)"""
+    if model_probe and time.time() - model_probe['checked'] < READINESS_CACHE_TTL:
+        return model_probe
+    if not model_probe_lock.acquire(blocking=False):
+        return model_probe  # Sonde déjà en cours dans un autre thread : dernier résultat connu
+    try:
+        started = time.perf_counter()
+        probe_request = urllib.request.Request(ANTHROPIC_MODELS_URL, headers={
+            'x-api-key': os.getenv('ANTHROPIC_API_KEY', ''),
+            'anthropic-version': '2023-06-01'
+        })
+        try:
+            with urllib.request.urlopen(probe_request, timeout=5):
+                error = None
+        except urllib.error.HTTPError as e:
+            error = f"HTTP {e.code}"
+        except Exception as e:
+            error = str(e)[:200]
+        model_probe.update({
+            'ok': error is None,
+            'at': datetime.now().isoformat(),
+            'checked': time.time(),
+            'duration': round(time.perf_counter() - started, 2),
+            'error': error
+        })
+        if error:
+            logger.warning(f"⚠️ Sonde Anthropic en échec: {error}")
+        return model_probe
+    finally:
+        model_probe_lock.release()
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Sonde de vivacité : le processus répond et la boucle de l'agent tourne"""
+    loop_alive = agent_loop_thread is None or agent_loop_thread.is_alive()
+    return jsonify({'status': 'alive' if loop_alive else 'dead'}), 200 if loop_alive else 503
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Sonde de disponibilité : sessions MCP prêtes, modèle joignable et file d'attente raisonnable"""
+    pool = mcp_pool.stats()
+    model_status = {key: value for key, value in probe_model().items() if key != 'checked'}
+    if MCP_POOL_SIZE > 0:
+        mcp_ok = pool['ready'] > 0
+    else:
+        mcp_ok = mcp_handshake.get('ok', True)  # Sans pool : dernier handshake connu
+    checks = {
+        'mcp': {'ok': mcp_ok, 'last_handshake': pool['last_handshake']},
+        'model': model_status,
+        'queue': {'ok': pool['queue_depth'] <= READINESS_MAX_QUEUE, 'depth': pool['queue_depth'], 'max': READINESS_MAX_QUEUE}
+    }
+    ready = all(check.get('ok') for check in checks.values())
+    return jsonify({
+        'ready': ready,
+        'checks': checks,
+        'pool': pool,
+        'circuits': {name: breaker.stats() for name, breaker in breakers.items()},
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
+def parse_chat_request(data, query_format=None):
+    """Valide le corps d'une requête de chat ; lève ValueError avec le message d'erreur destiné au client"""
+    if not data:
+        raise ValueError('Format JSON requis')
+    
+    fields = {
+        'user_message': data.get('message', '').strip(),
+        'context': data.get('context', ''),
+        'category': data.get('category', ''),
+        'response_format': data.get('format') or query_format or 'markdown'
+    }
+    
+    if not fields['user_message']:
+        raise ValueError('Le champ "message" est requis et ne peut pas être vide')
+    
+    if fields['response_format'] not in RESPONSE_FORMATS:
+        raise ValueError(f'Format inconnu: {fields["response_format"]} (formats acceptés: {", ".join(RESPONSE_FORMATS)})')
+    return fields
+
+def profile_requested():
+    """La requête demande le profilage de l'exécution de l'agent (en-tête X-Profile portant PROFILING_TOKEN)"""
+    return profiling_authorized(request.headers.get('X-Profile'))
+
+def process_chat_request(user_message, context, category, response_format, events=None, usage=None, profile=False):
+    """Répond à une question (FAQ, cache, puis agent) et retourne (corps JSON, code HTTP, en-têtes)
+
+    `usage` (dict, optionnel) est complété avec l'origine de la réponse et la consommation de
+    l'exécution, pour le journal d'usage. Avec `profile`, l'agent est toujours exécuté (ni FAQ ni
+    cache) et profilé ; metadata.profile indique le profil enregistré.
+    """
+    if usage is None:
+        usage = {}
+    usage['category'] = category or None
+    # Log de la requête
+    logger.info(f"Nouvelle requête chat: {user_message[:100]}... (catégorie: {category})")
+    
+    # Construire le contexte enrichi avec la catégorie
+    enriched_context = context
+    if category:
+        category_info = get_category_info(category)
+        if category_info:
+            enriched_context = f"Catégorie: {category_info['name']} - {category_info['description']}\n{context}".strip()
+    
+    # Réponse pré-calculée si la question correspond à une FAQ (sans contexte personnalisé)
+    if not context and not profile:
+        faq_entry = find_faq_answer(user_message, category)
+        if faq_entry:
+            logger.info(f"📋 Réponse FAQ servie ({faq_entry['category']})")
+            usage['source'] = 'faq'
+            answer = faq_entry_answer(faq_entry)
+            return {
+                'success': True,
+                **chat_payload(answer, response_format),
+                'timestamp': datetime.now().isoformat(),
+                'category': category,
+                'faq': True,
+                'generated_at': faq_entry['generated_at']
+            }, 200, {}
+    
+    # Réponse déjà générée pour la même question (périmée : servie puis rafraîchie en tâche de fond)
+    cache_key = answer_cache_key(user_message, category, context)
+    answer, created_at, stale = lookup_cached_answer(cache_key) if not profile else (None, None, False)
+    if answer:
+        usage['source'] = 'cache'
+        if stale:
+            usage['stale'] = True
+            refresh_usage = {key: usage[key] for key in ('client_id', 'category') if key in usage}
+            refresh_usage.update(timestamp=datetime.now().isoformat(timespec='seconds'), endpoint='refresh', source='refresh')
+            refreshing = request_answer_refresh(cache_key, user_message, context, category, enriched_context, refresh_usage)
+            logger.info(f"⚡ Réponse périmée servie depuis le cache (rafraîchissement {'lancé' if refreshing else 'non lancé'})")
+        else:
+            logger.info("⚡ Réponse servie depuis le cache")
+        return {
+            'success': True,
+            **chat_payload(answer, response_format),
+            'timestamp': datetime.now().isoformat(),
+            'category': category,
+            'cached': True,
+            'stale': stale,
+            'generated_at': datetime.fromtimestamp(created_at).isoformat()
+        }, 200, {}
+    
+    # Exécution de l'agent (partagée avec les requêtes identiques en cours)
+    response, run_info, coalesced = run_agent_coalesced(user_message, context, category, enriched_context, events, profile)
+    usage.update(run_usage(run_info, coalesced))
+    
+    # Dépendance coupée par son disjoncteur : réponse de secours ou 503 immédiat
+    if run_info.get('unavailable'):
+        answer = degraded_fallback(user_message, category, cache_key)
+        usage['source'] = 'fallback' if answer else 'unavailable'
+        if not answer:
+            return {
+                'success': False,
+                'error': response,
+                'retry_after': run_info['retry_after']
+            }, 503, {'Retry-After': str(run_info['retry_after'])}
+        logger.info("🔌 Réponse de secours servie (FAQ ou cache) pendant la panne")
+        return {
+            'success': True,
+            **chat_payload(answer, response_format),
+            'timestamp': datetime.now().isoformat(),
+            'category': category,
+            'cached': True,
+            'metadata': {'degraded': True, 'live_verified': False}
+        }, 200, {}
+    
+    answer = parse_markdown_answer(response, run_info['sources'])
+    degraded = bool(run_info.get('degraded'))
+    usage['source'] = 'error' if response.startswith('❌') else 'agent'
+    if not coalesced:
+        record_source_hits(run_info.get('visited_urls', []))
+        if not response.startswith('❌') and not degraded:
+            set_cached_answer(cache_key, answer)
+    
+    return {
+        'success': True,
+        **chat_payload(answer, response_format),
+        'timestamp': datetime.now().isoformat(),
+        'category': category,
+        'metadata': {
+            'budget': run_info.get('budget'),
+            'coalesced': coalesced,
+            'degraded': degraded,
+            'live_verified': not degraded,
+            **({'profile': run_info['profile']} if run_info.get('profile') else {})
+        }
+    }, 200, {}
+
+@app.route('/api/chat', methods=['POST'])
+def api_chat():
+    """Endpoint principal pour les conversations"""
+    try:
+        try:
+            fields = parse_chat_request(request.get_json(), request.args.get('format'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        usage = start_usage('/api/chat')
+        body, status, headers = process_chat_request(**fields, usage=usage, profile=profile_requested())
+        record_usage(usage, status)
+        response = jsonify(body)
+        response.headers.update(headers)
+        return response, status
+            
+    except Exception as e:
+        logger.error(f"Erreur dans api_chat: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Erreur serveur: {str(e)}'
+        }), 500
+
+SSE_KEEPALIVE_INTERVAL = 15  # Secondes entre deux commentaires de maintien de connexion
+
+def sse_event(name, data):
+    """Sérialise un événement Server-Sent Events"""
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def api_chat_stream():
+    """Variante de /api/chat en Server-Sent Events : progression de l'agent puis réponse finale"""
+    try:
+        fields = parse_chat_request(request.get_json(), request.args.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    events = queue.Queue()
+    result = {}
+    usage = start_usage('/api/chat/stream')
+    profile = profile_requested()
+    
+    def worker():
+        try:
+            result['value'] = process_chat_request(**fields, events=events, usage=usage, profile=profile)
+        except Exception as e:
+            logger.error(f"Erreur dans api_chat_stream: {str(e)}")
+            result['value'] = ({'success': False, 'error': f'Erreur serveur: {str(e)}'}, 500, {})
+        finally:
+            record_usage(usage, result['value'][1] if 'value' in result else 500)
+            events.put(None)
+    
+    threading.Thread(target=worker, name='chat-stream', daemon=True).start()
+    
+    def generate():
+        yield sse_event('start', {'message': fields['user_message'][:100], 'category': fields['category']})
+        while True:
+            try:
+                event = events.get(timeout=SSE_KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                break
+            yield sse_event(event.pop('event'), event)
+        body, status, _ = result['value']
+        yield sse_event('answer' if status == 200 else 'error', {**body, 'status': status})
+    
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['X-Accel-Buffering'] = 'no'  # Pas de mise en tampon par un proxy nginx
+    return response
+
+@app.route('/api/prewarm', methods=['POST'])
+def api_prewarm():
+    """Signal de l'interface web : l'utilisateur a choisi une catégorie ou commence à saisir sa question"""
+    data = request.get_json(silent=True) or {}
+    category = data.get('category')
+    if not get_category_info(category):
+        return jsonify({'success': False, 'error': f'Catégorie inconnue: {category}'}), 400
+    if not PREWARM_ENABLED:
+        return jsonify({'success': True, 'accepted': False, 'category': category}), 202
+    
+    accepted = request_prewarm(category, start_usage('/api/prewarm'))
+    return jsonify({'success': True, 'accepted': accepted, 'category': category}), 202
+
+def admin_forbidden():
+    """Réponse 403 si l'en-tête X-Admin-Token ne porte pas PROFILING_TOKEN (None si autorisé)"""
+    if profiling_authorized(request.headers.get('X-Admin-Token')):
+        return None
+    return jsonify({'success': False, 'error': 'Jeton d\'administration invalide ou profilage désactivé'}), 403
+
+@app.route('/api/admin/profile', methods=['POST'])
+def api_admin_profile():
+    """Arme le profilage des prochaines exécutions de l'agent (sans redémarrage)"""
+    forbidden = admin_forbidden()
+    if forbidden:
+        return forbidden
+    data = request.get_json(silent=True) or {}
+    try:
+        runs = min(max(int(data.get('runs', 1)), 0), 10)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Le champ "runs" doit être un entier'}), 400
+    logger.info(f"🔬 Profilage armé pour {runs} exécution(s)")
+    return jsonify({'success': True, 'armed_runs': arm_profiles(runs)})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def api_admin_profiles():
+    """Liste des profils enregistrés"""
+    forbidden = admin_forbidden()
+    if forbidden:
+        return forbidden
+    return jsonify({
+        'success': True,
+        'armed_runs': armed_profiles,
+        'profiles': [
+            {'id': profile['id'], 'size': profile['size'], 'url': f"/api/admin/profiles/{profile['id']}",
+             'created_at': datetime.fromtimestamp(profile['mtime']).isoformat(timespec='seconds')}
+            for profile in list_profiles()
+        ]
+    })
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def api_admin_profile_download(profile_id):
+    """Télécharge un profil : JSON (défaut) ou piles repliées (?format=folded)"""
+    forbidden = admin_forbidden()
+    if forbidden:
+        return forbidden
+    extension = '.folded' if request.args.get('format') == 'folded' else '.json'
+    if not re.fullmatch(r'[\w-]+', profile_id) or not os.path.exists(os.path.join(PROFILES_DIR, profile_id + extension)):
+        return jsonify({'success': False, 'error': f'Profil inconnu: {profile_id}'}), 404
+    return send_from_directory(os.path.abspath(PROFILES_DIR), profile_id + extension, as_attachment=True,
+                               mimetype='text/plain' if extension == '.folded' else 'application/json')
+
+@app.route('/api/categories', methods=['GET'])
+def api_categories():
+    """Endpoint pour obtenir les catégories d'aide disponibles"""
+    return static_json_response('categories', lambda: {
+        'success': True,
+        'categories': list(CATEGORIES.values())
+    })
+
+def build_api_help():
+    """Documentation de l'API (construite une seule fois, voir api_help)"""
+    endpoints = [
+        {
+            'endpoint': '/api/status',
+            'method': 'GET',
+            'description': 'Vérifier le statut de l\'API'
+        },
+        {
+            'endpoint': '/healthz',
+            'method': 'GET',
+            'description': 'Sonde de vivacité (processus et boucle de l\'agent)'
+        },
+        {
+            'endpoint': '/readyz',
+            'method': 'GET',
+            'description': 'Sonde de disponibilité : sessions MCP prêtes, modèle joignable, file d\'attente (503 si non prête)'
+        },
+        {
+            'endpoint': '/api/chat',
+            'method': 'POST',
+            'description': 'Envoyer un message à l\'assistant',
+            'parameters': {
+                'message': 'string (requis) - Votre question',
+                'context': 'string (optionnel) - Contexte supplémentaire',
+                'format': 'string (optionnel) - Format de la réponse : markdown (défaut) ou structured (sections typées dans "answer")',
+                'category': 'string (optionnel) - Catégorie thématique (sante, logement, administratif, juridique, emploi, education, transport, finances)'
+            },
+            'example': {
+                'message': 'Comment obtenir des aides au logement en tant que réfugié syrien ?',
+                'context': 'Personne ayant obtenu le statut de réfugié ou protection internationale',
+                'category': 'logement'
+            }
+        },
+        {
+            'endpoint': '/api/chat/stream',
+            'method': 'POST',
+            'description': 'Comme /api/chat, en Server-Sent Events : événements start, tool (appel d\'outil) puis answer ou error'
+        },
+        {
+            'endpoint': '/api/prewarm',
+            'method': 'POST',
+            'description': 'Préchauffer l\'agent pour une catégorie (session MCP, prompt, pages de référence) avant la question',
+            'parameters': {
+                'category': 'string (requis) - Catégorie choisie par l\'utilisateur'
+            }
+        },
+        {
+            'endpoint': '/api/categories',
+            'method': 'GET',
+            'description': 'Obtenir la liste des catégories d\'aide disponibles'
+        },
+        {
+            'endpoint': '/api/faq/<category>',
+            'method': 'GET',
+            'description': 'Obtenir les questions fréquentes pré-calculées d\'une catégorie avec leurs réponses et sources'
+        },
+        {
+            'endpoint': '/api/faq-bundle/<category>',
+            'method': 'GET',
+            'description': 'Obtenir les FAQ d\'une catégorie au format de /api/chat, pour une consultation hors ligne (ETag)'
+        },
+        {
+            'endpoint': '/api/site-changes',
+            'method': 'GET',
+            'description': 'Consulter les pages sources surveillées et les changements détectés'
+        },
+        {
+            'endpoint': '/api/reference-sites',
+            'method': 'GET',
+            'description': 'Obtenir la configuration des sites de référence par catégorie'
+        }
+    ]
+    
+    return {
+        'service': 'API Assistant Nouveaux Arrivants France',
+        'version': '1.0.0',
+        'endpoints': endpoints
+    }
+
+@app.route('/api/help', methods=['GET'])
+def api_help():
+    """Documentation de l'API"""
+    return static_json_response('help', build_api_help)
+
+@app.route('/api/faq/<category>', methods=['GET'])
+def api_faq(category):
+    """Endpoint pour obtenir les questions fréquentes pré-calculées d'une catégorie"""
+    category_info = get_category_info(category)
+    if not category_info:
+        return jsonify({'success': False, 'error': f'Catégorie inconnue: {category}'}), 404
+    
+    return conditional_json_response({
+        'success': True,
+        'category': category_info,
+        'faq': get_faq_entries(category)
+    }, max_age=300)
+
+@app.route('/api/faq-bundle/<category>', methods=['GET'])
+def api_faq_bundle(category):
+    """Endpoint pour obtenir les FAQ d'une catégorie prêtes à être mises en cache par le navigateur"""
+    category_info = get_category_info(category)
+    if not category_info:
+        return jsonify({'success': False, 'error': f'Catégorie inconnue: {category}'}), 404
+    
+    return conditional_json_response({
+        'success': True,
+        'category': category,
+        'faq': build_faq_bundle(category)
+    }, max_age=300)
+
+@app.route('/api/site-changes', methods=['GET'])
+def api_site_changes():
+    """Endpoint pour consulter les pages surveillées et les changements détectés"""
+    watched = get_watched_urls()
+    with site_watch_lock:
+        state = {url: site_watch_state.get(url) for url in watched}
+        events = list(reversed(site_change_events))
+    
+    return jsonify({
+        'success': True,
+        'watched_urls': state,
+        'events': events
+    })
+
+@app.route('/api/reference-sites', methods=['GET'])
+def api_reference_sites():
+    """Endpoint pour obtenir la configuration des sites de référence"""
+    return static_json_response('reference-sites', lambda: {
+        'success': True,
+        'reference_sites': REFERENCE_SITES,
+        'category_prompts': list(CATEGORY_PROMPTS.keys()),
+        'categories': get_available_categories()
+    })
+
+# ============ COMPATIBILITÉ ANCIENNE API ============
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    """Ancien endpoint chat pour compatibilité"""
+    user_message = request.json.get('message', '')
+    
+    if not user_message.strip():
+        return jsonify({'error': 'Message vide'}), 400
+    
+    usage = start_usage('/chat')
+    faq_entry = find_faq_answer(user_message)
+    if faq_entry:
+        record_usage({**usage, 'source': 'faq'}, 200)
+        return jsonify({'response': faq_entry['response']})
+    
+    # Rediriger vers la nouvelle API
+    response, run_info, coalesced = run_agent_coalesced(user_message)
+    usage.update(run_usage(run_info, coalesced), source='unavailable' if run_info.get('unavailable') else 'agent')
+    record_usage(usage, 503 if run_info.get('unavailable') else 200)
+    if run_info.get('unavailable'):
+        error_response = jsonify({'response': response})
+        error_response.headers['Retry-After'] = str(run_info['retry_after'])
+        return error_response, 503
+    return jsonify({'response': response})
+
+# ============ GESTION D'ERREURS ============
+
+@app.errorhandler(404)
+def not_found(error):
+    return jsonify({
+        'error': 'Endpoint non trouvé',
+        'message': 'Consultez /api/help pour voir les endpoints disponibles'
+    }), 404
+
+@app.errorhandler(405)
+def method_not_allowed(error):
+    return jsonify({
+        'error': 'Méthode non autorisée',
+        'message': 'Vérifiez la méthode HTTP utilisée (GET/POST)'
+    }), 405
+
+@app.errorhandler(500)
+def internal_error(error):
+    return jsonify({
+        'error': 'Erreur serveur interne',
+        'message': 'Une erreur est survenue côté serveur'
+    }), 500
+
+if __name__ == '__main__':
+    logger.info("Démarrage de l'API Assistant Nouveaux Arrivants France")
+    
+    # Vérifier les variables d'environnement critiques
+    required_env_vars = ['API_TOKEN', 'BROWSER_AUTH', 'WEB_UNLOCKER_ZONE']
+    missing_vars = [var for var in required_env_vars if not os.getenv(var)]
+    
+    if missing_vars:
+        logger.error(f"❌ Variables d'environnement manquantes: {', '.join(missing_vars)}")
+        logger.error("Veuillez configurer ces variables dans votre fichier .env ou dans les variables d'environnement Render")
+        exit(1)
+    
+    logger.info("✅ Toutes les variables d'environnement sont configurées")
+    
+    # Démarrer les tâches de fond (pré-calcul des FAQ, surveillance des sites)
+    start_background_jobs()
     
     # Utiliser le port Render par défaut ou 8080 en local
     port = int(os.environ.get('PORT', 8080))
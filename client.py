@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Client Python pour l'API Assistant Nouveaux Arrivants France
+
+Connexions HTTP réutilisées (requests.Session), nouvelles tentatives respectant l'en-tête
+Retry-After, réponses en streaming (/api/chat/stream) et mode par lots concurrent.
+
+Utilisation en ligne de commande :
+    python client.py ask "Comment obtenir une carte vitale ?" --category sante --stream
+    python client.py bulk questions.txt --category sante --concurrency 8 --output reponses.jsonl
+
+Utilisation en Python :
+    with AssistantClient() as client:
+        data = client.chat("Comment ouvrir un compte bancaire ?", category="finances")
+        print(data['response'])
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = os.getenv('ASSISTANT_API_URL', "http://127.0.0.1:8080")
+RETRY_STATUSES = (429, 502, 503, 504)  # Erreurs temporaires : nouvelle tentative
+MAX_RETRY_WAIT = 120  # Attente maximale entre deux tentatives (secondes)
+
+class AssistantAPIError(Exception):
+    """Erreur renvoyée par l'API (ou connexion impossible)"""
+
+    def __init__(self, message, status_code=None, payload=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload or {}
+
+class AssistantClient:
+    """Client de l'API, sûr entre threads : une seule Session et un pool de connexions partagés"""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, timeout=180, max_retries=3, backoff=1.0,
+                 pool_size=16, client_id=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        if client_id:
+            self.session.headers['X-Client-Id'] = client_id
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def retry_delay(self, response, attempt):
+        """Délai avant la prochaine tentative : Retry-After (secondes ou date HTTP), sinon backoff exponentiel"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        delay = None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+        if delay is None:
+            delay = self.backoff * 2 ** attempt
+        return min(max(delay, 0), MAX_RETRY_WAIT)
+
+    def request(self, method, path, **kwargs):
+        """Requête HTTP avec nouvelles tentatives sur les erreurs de connexion et les codes temporaires
+
+        Les dépassements de délai de lecture ne sont pas retentés : la requête a peut-être
+        déjà été traitée par le serveur.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                if attempt == self.max_retries:
+                    raise AssistantAPIError(f"API injoignable ({self.base_url}): {e}") from e
+                time.sleep(self.retry_delay(None, attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self.retry_delay(response, attempt)
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+
+    def request_json(self, method, path, **kwargs):
+        """Requête dont la réponse JSON est renvoyée ; lève AssistantAPIError si elle n'aboutit pas"""
+        response = self.request(method, path, **kwargs)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {'error': response.text[:500]}
+        if response.status_code != 200 or data.get('success') is False:
+            raise AssistantAPIError(data.get('error', f"Erreur HTTP {response.status_code}"), response.status_code, data)
+        return data
+
+    def status(self):
+        return self.request_json('GET', '/api/status')
+
+    def categories(self):
+        return self.request_json('GET', '/api/categories')['categories']
+
+    def faq(self, category):
+        return self.request_json('GET', f'/api/faq/{category}')['faq']
+
+    @staticmethod
+    def chat_body(message, context=None, category=None, format='markdown'):
+        body = {'message': message, 'format': format}
+        if context:
+            body['context'] = context
+        if category:
+            body['category'] = category
+        return body
+
+    def chat(self, message, context=None, category=None, format='markdown'):
+        """Pose une question et renvoie la réponse JSON complète de /api/chat"""
+        return self.request_json('POST', '/api/chat', json=self.chat_body(message, context, category, format))
+
+    def chat_stream(self, message, context=None, category=None, format='markdown'):
+        """Pose une question via /api/chat/stream et produit les événements (nom, données) au fil de l'eau
+
+        Le dernier événement est `answer` (même contenu que /api/chat) ou `error`.
+        """
+        response = self.request('POST', '/api/chat/stream', stream=True,
+                                json=self.chat_body(message, context, category, format))
+        if response.status_code != 200:
+            try:
+                data = response.json()
+            except ValueError:
+                data = {'error': response.text[:500]}
+            raise AssistantAPIError(data.get('error', f"Erreur HTTP {response.status_code}"), response.status_code, data)
+
+        with response:
+            name, lines = 'message', []
+            for line in response.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if not line:
+                    if lines:
+                        yield name, json.loads('\n'.join(lines))
+                    name, lines = 'message', []
+                elif line.startswith('event:'):
+                    name = line[6:].strip()
+                elif line.startswith('data:'):
+                    lines.append(line[5:].strip())
+
+    def bulk(self, questions, concurrency=8):
+        """Soumet des questions en parallèle et produit les résultats dans l'ordre où ils arrivent
+
+        `questions` : dicts {message, context?, category?, format?}. Chaque résultat contient la
+        question, `ok`, la réponse (`result`) ou l'erreur (`error`) et la durée en secondes.
+        """
+        def run(question):
+            started = time.time()
+            try:
+                result = self.chat(**question)
+                return {'question': question, 'ok': True, 'result': result,
+                        'duration': round(time.time() - started, 2)}
+            except AssistantAPIError as e:
+                return {'question': question, 'ok': False, 'error': str(e), 'status_code': e.status_code,
+                        'duration': round(time.time() - started, 2)}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(run, question) for question in questions]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+
+def load_questions(path, category=None, context=None):
+    """Lit un fichier de questions : une question par ligne, ou JSON lines {message, context, category}
+
+    Les lignes vides et celles commençant par # sont ignorées.
+    """
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                item = json.loads(line)
+            else:
+                item = {'message': line}
+            if category and not item.get('category'):
+                item['category'] = category
+            if context and not item.get('context'):
+                item['context'] = context
+            questions.append(item)
+    return questions
+
+def main():
+    parser = argparse.ArgumentParser(description="Client de l'API Assistant Nouveaux Arrivants France")
+    parser.add_argument('--url', default=DEFAULT_BASE_URL, help="URL de l'API")
+    parser.add_argument('--client-id', help="Identifiant du client (en-tête X-Client-Id)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ask = subparsers.add_parser('ask', help="Poser une question")
+    ask.add_argument('message')
+    ask.add_argument('--category')
+    ask.add_argument('--context')
+    ask.add_argument('--stream', action='store_true', help="Afficher la progression de l'agent")
+
+    bulk = subparsers.add_parser('bulk', help="Soumettre un fichier de questions en parallèle")
+    bulk.add_argument('file', help="Une question par ligne, ou JSON lines {message, context, category}")
+    bulk.add_argument('--category')
+    bulk.add_argument('--context')
+    bulk.add_argument('--concurrency', type=int, default=8)
+    bulk.add_argument('--output', help="Fichier JSON lines des résultats (sortie standard par défaut)")
+
+    args = parser.parse_args()
+
+    with AssistantClient(args.url, client_id=args.client_id, pool_size=max(getattr(args, 'concurrency', 1), 1)) as client:
+        if args.command == 'ask':
+            try:
+                if args.stream:
+                    for name, data in client.chat_stream(args.message, args.context, args.category):
+                        if name == 'tool':
+                            print(f"🔧 {data['name']} (appel {data['tool_calls']})", file=sys.stderr)
+                        elif name == 'answer':
+                            print(data['response'])
+                        elif name == 'error':
+                            print(f"❌ {data.get('error')}", file=sys.stderr)
+                            return 1
+                else:
+                    print(client.chat(args.message, args.context, args.category)['response'])
+            except AssistantAPIError as e:
+                print(f"❌ {e}", file=sys.stderr)
+                return 1
+            return 0
+
+        questions = load_questions(args.file, args.category, args.context)
+        print(f"🚀 {len(questions)} questions, {args.concurrency} en parallèle", file=sys.stderr)
+        started = time.time()
+        succeeded = 0
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            for i, item in enumerate(client.bulk(questions, args.concurrency), 1):
+                succeeded += item['ok']
+                output.write(json.dumps(item, ensure_ascii=False) + '\n')
+                output.flush()
+                status = "✅" if item['ok'] else "❌"
+                print(f"{status} [{i}/{len(questions)}] {item['duration']}s - {item['question']['message'][:60]}", file=sys.stderr)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        elapsed = time.time() - started
+        print(f"📊 {succeeded}/{len(questions)} réussies en {elapsed:.1f}s "
+              f"({len(questions) / elapsed * 3600:.0f} questions/heure)", file=sys.stderr)
+        return 0 if succeeded == len(questions) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
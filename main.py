@@ -9,6 +9,11 @@ import os
 
 load_dotenv()
 
+# Nombre d'échanges (question + réponse) conservés dans l'historique envoyé à l'agent
+MAX_HISTORY_TURNS = int(os.getenv('CLI_MAX_HISTORY_TURNS', 6))
+if MAX_HISTORY_TURNS < 0:
+    raise ValueError(f"CLI_MAX_HISTORY_TURNS doit être positif ou nul (reçu : {MAX_HISTORY_TURNS})")
+
 model = ChatAnthropic(
     model="claude-3-5-sonnet-20240620",
     max_tokens=6000,  # Limite la réponse à 6000 tokens
@@ -78,12 +83,16 @@ async def chat_with_agent():
                 # Add user message to history
                 messages.append({"role": "user", "content": user_input})
 
-                # Call the agent with the full message history
+                # Call the agent with the system prompt and the most recent turns only
                 agent_response = await agent.ainvoke({"messages": messages})
 
                 # Extract agent's reply and add to history
                 ai_message = agent_response["messages"][-1].content
                 print(f"Agent: {ai_message}")
+                messages.append({"role": "assistant", "content": ai_message})
+
+                # Bound the history: keep the system prompt and the last turns (none if 0)
+                del messages[1:max(1, len(messages) - 2 * MAX_HISTORY_TURNS)]
 
 
 if __name__ == "__main__":
@@ -6,6 +6,8 @@ Guide de démarrage rapide pour l'API Assistant Nouveaux Arrivants France
 import requests
 import json
 
+session = requests.Session()  # Connexion HTTP réutilisée entre les appels
+
 def quick_test():
     """Test rapide de l'API"""
     base_url = "http://127.0.0.1:8080"
@@ -16,7 +18,7 @@ def quick_test():
     # Test 1: Status
     print("1️⃣ Test du status...")
     try:
-        response = requests.get(f"{base_url}/api/status")
+        response = session.get(f"{base_url}/api/status")
         if response.status_code == 200:
             data = response.json()
             print(f"   ✅ API active - Version: {data['version']}")
@@ -30,7 +32,7 @@ def quick_test():
     
     # Test 2: Catégories
     print("\n2️⃣ Test des catégories...")
-    response = requests.get(f"{base_url}/api/categories")
+    response = session.get(f"{base_url}/api/categories")
     if response.status_code == 200:
         data = response.json()
         print(f"   ✅ {len(data['categories'])} catégories disponibles")
@@ -40,7 +42,7 @@ def quick_test():
     # Test 3: Question simple
     print("\n3️⃣ Test d'une question...")
     question = "Comment obtenir une carte vitale ?"
-    response = requests.post(f"{base_url}/api/chat", json={
+    response = session.post(f"{base_url}/api/chat", json={
         "message": question
     })
     
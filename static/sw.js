@@ -0,0 +1,59 @@
+// Service worker de l'interface web : page d'accueil, catégories et FAQ disponibles hors ligne.
+// Les réponses en cache sont servies immédiatement puis revalidées avec leur ETag (If-None-Match).
+
+const CACHE_NAME = 'assistant-v1';
+const PRECACHE_URLS = ['/', '/api/categories'];
+const REVALIDATED_PATHS = [/^\/$/, /^\/api\/categories$/, /^\/api\/faq-bundle\/[\w-]+$/];
+
+self.addEventListener('install', (event) => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE_NAME);
+        await cache.addAll(PRECACHE_URLS);
+        // FAQ de chaque catégorie, pour répondre aux questions fréquentes sans connexion
+        try {
+            const categories = await (await cache.match('/api/categories')).json();
+            await Promise.all(categories.categories.map(
+                (category) => cache.add(`/api/faq-bundle/${category.id}`).catch(() => {})
+            ));
+        } catch (error) {
+            // Les FAQ seront mises en cache à leur première consultation
+        }
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        const names = await caches.keys();
+        await Promise.all(names.filter((name) => name !== CACHE_NAME).map((name) => caches.delete(name)));
+        await self.clients.claim();
+    })());
+});
+
+async function revalidate(cache, request, cached) {
+    const headers = new Headers();
+    const etag = cached && cached.headers.get('ETag');
+    if (etag) headers.set('If-None-Match', etag);
+    const response = await fetch(request.url, { headers: headers, cache: 'no-store' });
+    if (response.status === 304) return cached;
+    if (response.ok) await cache.put(request, response.clone());
+    return response;
+}
+
+self.addEventListener('fetch', (event) => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== self.location.origin
+            || !REVALIDATED_PATHS.some((pattern) => pattern.test(url.pathname))) {
+        return;  // Questions (POST) et autres routes : réseau uniquement
+    }
+    event.respondWith((async () => {
+        const cache = await caches.open(CACHE_NAME);
+        const cached = await cache.match(event.request);
+        const network = revalidate(cache, event.request, cached);
+        if (cached) {
+            event.waitUntil(network.catch(() => {}));
+            return cached;
+        }
+        return network;
+    })());
+});
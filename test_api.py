@@ -10,13 +10,14 @@ from datetime import datetime
 
 # Configuration
 BASE_URL = "http://127.0.0.1:8080"
+session = requests.Session()  # Connexion HTTP réutilisée d'un test à l'autre
 
 def test_api_status():
     """Test de l'endpoint de status"""
     print("🔍 Test du status de l'API...")
     
     try:
-        response = requests.get(f"{BASE_URL}/api/status")
+        response = session.get(f"{BASE_URL}/api/status")
         if response.status_code == 200:
             data = response.json()
             print(f"✅ API active - Version: {data['version']}")
@@ -38,7 +39,7 @@ def test_api_categories():
     print("\n🔍 Test des catégories...")
     
     try:
-        response = requests.get(f"{BASE_URL}/api/categories")
+        response = session.get(f"{BASE_URL}/api/categories")
         if response.status_code == 200:
             data = response.json()
             print(f"✅ {len(data['categories'])} catégories disponibles:")
@@ -57,7 +58,7 @@ def test_api_help():
     print("\n🔍 Test de la documentation...")
     
     try:
-        response = requests.get(f"{BASE_URL}/api/help")
+        response = session.get(f"{BASE_URL}/api/help")
         if response.status_code == 200:
             data = response.json()
             print(f"✅ Documentation disponible - {len(data['endpoints'])} endpoints:")
@@ -71,6 +72,27 @@ def test_api_help():
         print(f"❌ Erreur: {e}")
         return False
 
+def test_api_faq(category="sante"):
+    """Test de l'endpoint des FAQ pré-calculées"""
+    print(f"\n🔍 Test des FAQ ({category})...")
+    
+    try:
+        response = session.get(f"{BASE_URL}/api/faq/{category}")
+        if response.status_code == 200:
+            data = response.json()
+            ready = [item for item in data['faq'] if item['answer']]
+            print(f"✅ {len(ready)}/{len(data['faq'])} FAQ pré-calculées:")
+            for item in data['faq']:
+                status = "✅" if item['answer'] else "⏳"
+                print(f"   {status} {item['question']}")
+            return True
+        else:
+            print(f"❌ Erreur FAQ: {response.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Erreur: {e}")
+        return False
+
 def test_api_chat(message, context=None):
     """Test de l'endpoint de chat"""
     print(f"\n🔍 Test du chat avec le message: '{message[:50]}...'")
@@ -81,7 +103,7 @@ def test_api_chat(message, context=None):
     
     try:
         start_time = time.time()
-        response = requests.post(
+        response = session.post(
             f"{BASE_URL}/api/chat",
             json=payload,
             headers={"Content-Type": "application/json"}
@@ -115,21 +137,21 @@ def test_error_handling():
     print("\n🔍 Test de la gestion d'erreurs...")
     
     # Test message vide
-    response = requests.post(f"{BASE_URL}/api/chat", json={"message": ""})
+    response = session.post(f"{BASE_URL}/api/chat", json={"message": ""})
     if response.status_code == 400:
         print("✅ Gestion message vide OK")
     else:
         print("❌ Gestion message vide échouée")
     
     # Test format JSON invalide
-    response = requests.post(f"{BASE_URL}/api/chat", data="invalid json")
+    response = session.post(f"{BASE_URL}/api/chat", data="invalid json")
     if response.status_code == 400:
         print("✅ Gestion JSON invalide OK")
     else:
         print("❌ Gestion JSON invalide échouée")
     
     # Test endpoint inexistant
-    response = requests.get(f"{BASE_URL}/api/inexistant")
+    response = session.get(f"{BASE_URL}/api/inexistant")
     if response.status_code == 404:
         print("✅ Gestion endpoint inexistant OK")
     else:
@@ -159,12 +181,17 @@ def run_comprehensive_test():
     if test_api_help():
         tests_passed += 1
     
-    # Test 4: Chat simple
+    # Test 4: FAQ pré-calculées
+    total_tests += 1
+    if test_api_faq():
+        tests_passed += 1
+    
+    # Test 5: Chat simple
     total_tests += 1
     if test_api_chat("Comment obtenir une carte vitale ?"):
         tests_passed += 1
     
-    # Test 5: Chat avec contexte
+    # Test 6: Chat avec contexte
     total_tests += 1
     if test_api_chat(
         "Quelles sont les étapes pour ouvrir un compte bancaire ?", 
@@ -172,7 +199,7 @@ def run_comprehensive_test():
     ):
         tests_passed += 1
     
-    # Test 6: Gestion d'erreurs
+    # Test 7: Gestion d'erreurs
     test_error_handling()
     
     # Résumé
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Tests du pool de sessions MCP (sans serveur MCP ni clé API : outil et modèle simulés)
+
+Usage :
+    python -m pytest test_mcp_pool.py
+"""
+
+import asyncio
+import time
+
+import anyio
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.tools import StructuredTool
+
+import app
+
+class FakeChatModel(GenericFakeChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+def test_tool_transport_error_retires_slot():
+    """Une erreur de transport MCP pendant un appel d'outil ne rend pas la session au pool
+
+    L'agent transforme l'erreur en message d'outil et termine normalement : seule l'enveloppe
+    budgeted_tool voit l'exception.
+    """
+    app.load_agent_libraries()
+
+    async def closed_transport(query: str):
+        raise anyio.ClosedResourceError()
+
+    tool = StructuredTool.from_function(
+        coroutine=closed_transport, name='search_engine', description="Recherche web",
+        response_format='content_and_artifact'
+    )
+    model = FakeChatModel(messages=iter([
+        AIMessage(content="", tool_calls=[{'name': 'search_engine', 'args': {'query': 'carte vitale'}, 'id': 'call-1'}]),
+        AIMessage(content="Réponse sans recherche web")
+    ]))
+
+    async def scenario():
+        pool = app.McpSessionPool(1)
+        pool.idle = asyncio.Queue()
+        slot = app.McpSessionSlot()
+        slot.session = object()  # Session ouverte simulée
+        pool.slots.add(slot)
+        pool.idle.put_nowait(slot)
+
+        async with pool.session() as borrowed:
+            budget = app.RunBudget(app.get_agent_budget())
+            agent = app.create_react_agent(model, [app.budgeted_tool(tool, budget, borrowed)])
+            result = await agent.ainvoke({'messages': [{'role': 'user', 'content': "Carte vitale ?"}]})
+        return slot, pool, result
+
+    try:
+        slot, pool, result = asyncio.run(scenario())
+    finally:
+        app.breakers['brightdata'].record_success()
+
+    assert result['messages'][-1].content == "Réponse sans recherche web"
+    assert any(getattr(message, 'status', None) == 'error' for message in result['messages'])
+    assert slot.retire_reason == 'broken'
+    assert pool.idle.empty()
+    assert slot.closing.is_set()
+
+def test_supervisor_retires_slots_without_processes():
+    """Une session ouverte dont les processus ont disparu est recyclée ; la durée de vie s'applique à toutes"""
+    supervisor = app.McpSupervisor(4)
+    dead = app.McpSessionSlot()
+    dead.session = object()
+    starting = app.McpSessionSlot()  # Processus pas encore lancé : pas de session
+    old = app.McpSessionSlot()
+    old.created_at -= app.MCP_CHILD_MAX_LIFETIME + 1
+    supervisor.slots = {slot.id: slot for slot in (dead, starting, old)}
+
+    supervisor.check(tagged={})
+
+    assert dead.retire_reason == 'dead' and dead.closing.is_set()
+    assert starting.retire_reason is None
+    assert old.retire_reason == 'lifetime'
+
+def test_session_without_wait_never_opens_a_dedicated_session():
+    """Le préchauffage n'emprunte qu'une session libre : pool vide, aucune session dédiée n'est ouverte"""
+    async def scenario():
+        pool = app.McpSessionPool(1)
+        pool.idle = asyncio.Queue()
+        async with pool.session(wait=False) as empty:
+            pass
+        slot = app.McpSessionSlot()
+        slot.session = object()
+        pool.slots.add(slot)
+        pool.idle.put_nowait(slot)
+        async with pool.session(wait=False) as borrowed:
+            in_use = borrowed.in_use
+        return empty, borrowed is slot, in_use, pool.idle.qsize()
+
+    assert asyncio.run(scenario()) == (None, True, True, 1)
+
+def test_every_category_can_read_the_pages_it_navigates():
+    """Chaque catégorie autorisée à ouvrir une page dans le navigateur peut aussi en lire le contenu"""
+    names = (
+        'search_engine', 'scrape_as_markdown', 'scrape_as_html', 'extract',
+        'scraping_browser_navigate', 'scraping_browser_links', 'scraping_browser_click',
+        'scraping_browser_get_text', 'scraping_browser_get_html', 'scraping_browser_wait_for',
+        'scraping_browser_screenshot'
+    )
+    assert app.tool_allowlist_gaps(names) == []
+    for category in [None, *app.CATEGORIES]:
+        allowed = app.get_allowed_tool_names(category, app.generate_system_prompt(category), names)
+        if 'scraping_browser_navigate' in allowed:
+            assert set(app.BROWSER_PAGE_TOOLS) <= allowed
+
+def test_tool_error_result_does_not_trip_brightdata_breaker():
+    """Une erreur renvoyée par l'outil (sélecteur introuvable) ne compte pas comme une panne de BrightData"""
+    app.load_agent_libraries()
+
+    async def missing_selector(selector: str):
+        raise app.ToolException("No element matches selector")
+
+    tool = StructuredTool.from_function(
+        coroutine=missing_selector, name='scraping_browser_click', description="Clic",
+        response_format='content_and_artifact'
+    )
+    breaker = app.breakers['brightdata']
+    breaker.record_success()
+    wrapped = app.budgeted_tool(tool, app.RunBudget(app.get_agent_budget()))
+    for _ in range(breaker.threshold + 1):
+        try:
+            asyncio.run(wrapped.coroutine(selector='#absent'))
+        except app.ToolException:
+            pass
+
+    assert breaker.state == 'closed' and breaker.failures == 0
+
+def test_brightdata_outage_releases_anthropic_trial(monkeypatch):
+    """Une tentative arrêtée par le disjoncteur BrightData ne garde pas l'essai semi-ouvert d'Anthropic"""
+    monkeypatch.setattr(app, 'DEGRADED_MODE_ENABLED', False)
+    anthropic_breaker = app.CircuitBreaker('anthropic')
+    anthropic_breaker.state, anthropic_breaker.opened_at = 'open', time.time() - anthropic_breaker.reset_timeout
+    brightdata_breaker = app.CircuitBreaker('brightdata')
+    brightdata_breaker.state, brightdata_breaker.opened_at = 'open', time.time()
+    monkeypatch.setitem(app.breakers, 'anthropic', anthropic_breaker)
+    monkeypatch.setitem(app.breakers, 'brightdata', brightdata_breaker)
+
+    run_info = {}
+    asyncio.run(app.get_agent_response("Carte vitale ?", run_info=run_info, max_retries=1))
+
+    assert run_info['unavailable'] == 'brightdata'
+    assert anthropic_breaker.state == 'half_open'
+    assert anthropic_breaker.allow()
+
+def test_session_open_failure_keeps_mcp_config_class():
+    """Une session dédiée impossible à ouvrir pour une erreur de configuration n'est pas retentée"""
+    class McpError(Exception):
+        pass
+    McpError.__module__ = 'mcp.shared.exceptions'
+
+    try:
+        try:
+            raise BaseExceptionGroup("session", [McpError("List roots not supported")])
+        except BaseExceptionGroup as e:
+            raise app.McpSessionUnavailable(f"Session MCP impossible à ouvrir: {e}") from e
+    except app.McpSessionUnavailable as e:
+        wrapped = e
+
+    assert app.classify_error(wrapped) == 'mcp_config'
+    assert app.classify_error(app.McpSessionUnavailable("Pool saturé")) == 'mcp_session'
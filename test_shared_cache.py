@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests du cache partagé sur le backend Redis (serveur RESP simulé dans le processus, sans Redis)
+
+Usage :
+    python -m pytest test_shared_cache.py
+"""
+
+import fnmatch
+import socket
+import socketserver
+import threading
+
+import app
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Sous-ensemble de Redis utilisé par RedisCacheBackend : GET, SET EX [NX], DEL, SCAN"""
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def bulk(self, value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        store = self.server.store
+        while (args := self.read_command()) is not None:
+            name = args[0].decode().upper()
+            if name == 'GET':
+                reply = self.bulk(store.get(args[1]))
+            elif name == 'SET':
+                if b'NX' in args[3:] and args[1] in store:
+                    reply = self.bulk(None)
+                else:
+                    store[args[1]] = args[2]
+                    reply = b"+OK\r\n"
+            elif name == 'DEL':
+                reply = b":%d\r\n" % int(store.pop(args[1], None) is not None)
+            elif name == 'SCAN':
+                pattern = args[args.index(b'MATCH') + 1].decode()
+                keys = [key for key in store if fnmatch.fnmatchcase(key.decode(), pattern)]
+                reply = b"*2\r\n" + self.bulk(b'0') + b"*%d\r\n" % len(keys) + b''.join(self.bulk(key) for key in keys)
+            else:
+                reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+def start_fake_redis():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.store = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_redis_backend_round_trip():
+    """Lecture, écriture, réservation, parcours et suppression via le protocole RESP ; compression au-delà du seuil"""
+    server = start_fake_redis()
+    try:
+        cache = app.SharedCache(app.RedisCacheBackend(f"redis://127.0.0.1:{server.server_address[1]}/0"))
+        small = cache.key('page', 'web', 'petite')
+        large = cache.key('page', 'web', 'grande')
+        cache.set(small, {'content': 'court'}, 60)
+        cache.set(large, {'content': 'x' * (app.CACHE_COMPRESS_MIN_SIZE * 2)}, 60)
+
+        assert cache.get(small) == {'content': 'court'}
+        assert cache.get(large)['content'] == 'x' * (app.CACHE_COMPRESS_MIN_SIZE * 2)
+        assert server.store[small.encode()][:1] == b'j'
+        assert server.store[large.encode()][:1] == b'z'
+        assert len(server.store[large.encode()]) < app.CACHE_COMPRESS_MIN_SIZE
+        assert not cache.add(small, {'content': 'autre'}, 60)
+        assert cache.add(cache.key('faq', 'general', 'claim'), {'claimed': True}, 60)
+        assert sorted(key for key, _ in cache.scan('page')) == sorted([small, large])
+
+        cache.delete(small)
+        assert cache.get(small) is None
+        assert [key for key, _ in cache.scan('page')] == [large]
+        assert cache.get_stats()['hits'] == 2 and cache.get_stats()['misses'] == 1
+        assert cache.get_stats()['errors'] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_unreachable_redis_counts_as_miss():
+    """Serveur injoignable : la lecture est une absence en cache, comptée comme erreur, sans exception"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    cache = app.SharedCache(app.RedisCacheBackend(f"redis://127.0.0.1:{port}/0", timeout=0.5))
+
+    assert cache.get(cache.key('page', 'web', 'absente')) is None
+    cache.set(cache.key('page', 'web', 'absente'), {'content': 'court'}, 60)
+
+    stats = cache.get_stats()
+    assert stats['misses'] == 1 and stats['hits'] == 0
+    assert stats['errors'] == 2 and stats['sets'] == 0
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Rapport de coût et de latence à partir du journal d'usage de l'API (data/usage.jsonl)
+
+Résume, par catégorie, par outil, par client et par endpoint : nombre de requêtes, part servie
+sans agent (FAQ, cache), tâches de fond (préchauffage, rafraîchissement du cache), latence p50/p95
+des requêtes, tokens consommés, appels d'outils et coût estimé.
+
+Usage :
+    python usage_report.py [--log data/usage.jsonl] [--days 7] [--endpoint /api/chat] [--source agent] [--json]
+"""
+
+import argparse
+import json
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Tarifs par défaut (modifiables par variables d'environnement ou options)
+INPUT_PRICE = float(os.getenv('ANTHROPIC_INPUT_PRICE', 3.0))     # $ par million de tokens en entrée
+OUTPUT_PRICE = float(os.getenv('ANTHROPIC_OUTPUT_PRICE', 15.0))  # $ par million de tokens en sortie
+TOOL_PRICE = float(os.getenv('BRIGHTDATA_REQUEST_PRICE', 1.5))   # $ pour 1000 appels d'outils BrightData
+
+# Travail de fond sans utilisateur en attente : compté dans les coûts, pas dans les requêtes ni les latences
+BACKGROUND_SOURCES = ('prewarm', 'refresh')
+
+def load_entries(path, since=None, endpoints=None, sources=None):
+    """Lit le journal (et sa rotation .1) en ignorant les lignes illisibles
+
+    `endpoints` / `sources` : ne garder que les lignes de ces endpoints / origines de réponse.
+    """
+    entries = []
+    for file_path in (path + '.1', path):
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if since and datetime.fromisoformat(entry['timestamp']) < since:
+                    continue
+                if endpoints and entry.get('endpoint') not in endpoints:
+                    continue
+                if sources and entry.get('source') not in sources:
+                    continue
+                entries.append(entry)
+    return entries
+
+def percentile(values, ratio):
+    """Percentile au rang le plus proche (0 si aucune valeur)"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(max(math.ceil(ratio * len(values)), 1), len(values)) - 1]
+
+def entry_cost(entry, prices):
+    """Coût estimé d'une requête : tokens Anthropic et appels d'outils BrightData (hors pages en cache)"""
+    tokens = entry.get('tokens') or {}
+    llm = tokens.get('input', 0) * prices['input'] / 1e6 + tokens.get('output', 0) * prices['output'] / 1e6
+    tools = (entry.get('tool_calls', 0) - entry.get('cached_tool_calls', 0)) * prices['tool'] / 1000
+    return llm, tools
+
+def summarize(entries, key, prices):
+    """Agrège les requêtes par valeur de `key` (catégorie ou client)"""
+    groups = defaultdict(list)
+    for entry in entries:
+        groups[entry.get(key) or 'aucune'].append(entry)
+    rows = []
+    for name, group in groups.items():
+        requests = [entry for entry in group if entry.get('source') not in BACKGROUND_SOURCES]
+        latencies = [entry.get('timings', {}).get('total', 0) for entry in requests]
+        agent_runs = [entry for entry in group if entry.get('source') in ('agent', 'error', 'refresh') and not entry.get('coalesced')]
+        llm_cost = tool_cost = 0.0
+        for entry in group:
+            llm, tools = entry_cost(entry, prices)
+            llm_cost += llm
+            tool_cost += tools
+        rows.append({
+            key: name,
+            'requests': len(requests),
+            'background': len(group) - len(requests),
+            'agent_runs': len(agent_runs),
+            'served_without_agent': sum(1 for entry in requests if entry.get('source') in ('faq', 'cache', 'fallback')),
+            'errors': sum(1 for entry in requests if entry.get('status', 200) != 200 or entry.get('source') == 'error'),
+            'retries': sum(max(entry.get('attempts', 1) - 1, 0) for entry in group),
+            'latency_p50': round(percentile(latencies, 0.5), 2),
+            'latency_p95': round(percentile(latencies, 0.95), 2),
+            'input_tokens': sum((entry.get('tokens') or {}).get('input', 0) for entry in group),
+            'output_tokens': sum((entry.get('tokens') or {}).get('output', 0) for entry in group),
+            'tool_calls': sum(entry.get('tool_calls', 0) for entry in group),
+            'cached_tool_calls': sum(entry.get('cached_tool_calls', 0) for entry in group),
+            'cost_llm': round(llm_cost, 4),
+            'cost_tools': round(tool_cost, 4),
+            'cost_total': round(llm_cost + tool_cost, 4)
+        })
+    return sorted(rows, key=lambda row: row['cost_total'], reverse=True)
+
+def summarize_tools(entries, prices):
+    """Agrège les appels par outil (nombre, volume récupéré, latence par appel, coût)"""
+    tools = defaultdict(lambda: {'calls': 0, 'cached': 0, 'bytes': 0, 'requests': 0})
+    durations = defaultdict(list)
+    for entry in entries:
+        for name, stats in (entry.get('tools') or {}).items():
+            tools[name]['calls'] += stats.get('calls', 0)
+            tools[name]['cached'] += stats.get('cached', 0)
+            tools[name]['bytes'] += stats.get('bytes', 0)
+            tools[name]['requests'] += 1
+            durations[name].extend(stats.get('seconds', []))
+    rows = [
+        {
+            'tool': name,
+            **stats,
+            'avg_bytes': stats['bytes'] // max(stats['calls'], 1),
+            'latency_p50': round(percentile(durations[name], 0.5), 2),
+            'latency_p95': round(percentile(durations[name], 0.95), 2),
+            'cost': round(stats['calls'] * prices['tool'] / 1000, 4)
+        }
+        for name, stats in tools.items()
+    ]
+    return sorted(rows, key=lambda row: row['calls'], reverse=True)
+
+def print_table(title, rows, columns):
+    print(f"\n{title}")
+    if not rows:
+        print("   (aucune donnée)")
+        return
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print('   ' + '  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('   ' + '  '.join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Rapport de coût et de latence de l'API")
+    parser.add_argument('--log', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'usage.jsonl'))
+    parser.add_argument('--days', type=float, help="Ne considérer que les N derniers jours")
+    parser.add_argument('--endpoint', action='append', help="Ne considérer que cet endpoint (répétable, ex. /api/chat)")
+    parser.add_argument('--source', action='append', help="Ne considérer que cette origine de réponse (répétable, ex. agent)")
+    parser.add_argument('--input-price', type=float, default=INPUT_PRICE, help="$ par million de tokens en entrée")
+    parser.add_argument('--output-price', type=float, default=OUTPUT_PRICE, help="$ par million de tokens en sortie")
+    parser.add_argument('--tool-price', type=float, default=TOOL_PRICE, help="$ pour 1000 appels d'outils")
+    parser.add_argument('--json', action='store_true', help="Sortie JSON")
+    args = parser.parse_args()
+
+    since = datetime.now() - timedelta(days=args.days) if args.days else None
+    entries = load_entries(args.log, since, args.endpoint, args.source)
+    prices = {'input': args.input_price, 'output': args.output_price, 'tool': args.tool_price}
+    report = {
+        'requests': sum(1 for entry in entries if entry.get('source') not in BACKGROUND_SOURCES),
+        'by_category': summarize(entries, 'category', prices),
+        'by_tool': summarize_tools(entries, prices),
+        'by_client': summarize(entries, 'client_id', prices),
+        'by_endpoint': summarize(entries, 'endpoint', prices)
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    background = sum(1 for entry in entries if entry.get('source') in BACKGROUND_SOURCES)
+    print(f"📊 Rapport d'usage : {len(entries) - background} requêtes, {background} tâches de fond"
+          + (f" sur {args.days:g} jours" if args.days else ""))
+    columns = ['requests', 'background', 'agent_runs', 'served_without_agent', 'errors', 'retries',
+               'latency_p50', 'latency_p95', 'input_tokens', 'output_tokens', 'tool_calls', 'cached_tool_calls', 'cost_total']
+    print_table("🗂️ Par catégorie", report['by_category'], ['category'] + columns)
+    print_table("🔧 Par outil", report['by_tool'],
+                ['tool', 'calls', 'cached', 'requests', 'avg_bytes', 'latency_p50', 'latency_p95', 'cost'])
+    print_table("👤 Par client", report['by_client'], ['client_id'] + columns)
+    print_table("🌐 Par endpoint", report['by_endpoint'], ['endpoint'] + columns)
+    total = sum(row['cost_total'] for row in report['by_category'])
+    print(f"\n💰 Coût total estimé : {total:.2f} $")
+
+if __name__ == "__main__":
+    main()